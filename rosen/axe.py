@@ -40,7 +40,8 @@ class AXE:
     def parse(cls, raw_bytes):
         try:
             parsed = axe.parse(raw_bytes)
-            return cls(parsed.cmd, parsed.data)
+            # tx_id is only present on 'query' and 'statement'
+            return cls(parsed.cmd, parsed.data, parsed.tx_id or 0)
         except:
             return raw_bytes
 
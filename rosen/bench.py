@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+import asyncio
+from datetime import datetime, timezone
+import fnmatch
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from rich.console import Console
+from rich.table import Table
+
+from rosen.axe import AXE
+from rosen.client import RADCOM, parse_endpoint
+from rosen.down import download
+from rosen.gcomm import GCOMM, GCOMMScript
+from rosen.icomm import ICOMM, ICOMMScript, crc32
+from rosen.server import Simulator
+
+# units where a smaller result is better
+lower_is_better = {'s'}
+# results of `link_benchmarks`
+link_names = ('uplink.goodput', 'uplink.frames', 'downlink.goodput', 'downlink.frames')
+
+def measure(func, min_time=0.2, repeat=3):
+    """Best rate of calling `func` over `repeat` runs of at least `min_time` seconds
+
+    Returns:
+        float: calls per second
+    """
+    best = 0
+    for _ in range(repeat):
+        n = 0
+        start = time.perf_counter()
+        while True:
+            func()
+            n += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, n / elapsed)
+    return best
+
+def _statement(n):
+    return AXE('statement', {'therm1': 21.5 + n, 'therm2': 19.25, 'error_reg': n, 'mode': 'science'}, tx_id=n)
+
+def _selected(name, select):
+    return select is None or fnmatch.fnmatch(name, select)
+
+def codec_functions(script_size=1000, path='bench.frames'):
+    """Functions timed by `codec_benchmarks`, also run by the pytest-benchmark
+    tests
+
+    Args:
+        script_size (int): commands in the ICOMMScript compiled
+        path (str): where the compiled script is written
+
+    Returns:
+        dict: {name: function}
+    """
+    axe = _statement(1)
+    axe_bytes = axe.build()
+    icomm = ICOMM('cmd', 'ground', frm='dcm', payload=axe)
+    icomm_bytes = icomm.build()
+    gcomm = GCOMM('app_file', filename='bench.bin', n=1, m=1, packet=icomm)
+    gcomm_bytes = gcomm.build()
+
+    i = ICOMMScript('bench')
+    for n in range(script_size):
+        i.statement('dcm', error_reg=n, therm1=21.5)
+    def compile_script():
+        g = GCOMMScript('bench')
+        g.upload_script('bench.bin', i)
+        g.compile(path)
+
+    return {
+        'axe.build': axe.build,
+        'axe.parse': lambda: AXE.parse(axe_bytes),
+        'icomm.build': icomm.build,
+        'icomm.parse': lambda: ICOMM.parse(icomm_bytes),
+        'gcomm.build': gcomm.build,
+        'gcomm.parse': lambda: GCOMM.parse(gcomm_bytes),
+        # of one ICOMM packet
+        'crc32': lambda: crc32(icomm_bytes),
+        f'script.compile_{script_size}': compile_script,
+    }
+
+def codec_benchmarks(min_time=0.2, repeat=3, script_size=1000, select=None):
+    """Time packet building/parsing, crc32 and script compilation
+
+    Args:
+        min_time (float): min seconds to run each benchmark for
+        repeat (int): runs of each benchmark, of which the best is kept
+        script_size (int): commands in the ICOMMScript compiled
+        select (str or None): glob of benchmark names to run
+
+    Returns:
+        dict: {name: (value, unit)}
+    """
+    units = {'axe': 'packets/s', 'icomm': 'frames/s', 'gcomm': 'frames/s'}
+    results = {}
+    with tempfile.TemporaryDirectory() as d:
+        functions = codec_functions(script_size, os.path.join(d, 'bench.frames'))
+        for name, func in functions.items():
+            if not _selected(name, select):
+                continue
+            if name == 'crc32':
+                results[name] = (measure(func, min_time, repeat) * ICOMM.size / 1e6, 'MB/s')
+            elif name.startswith('script.compile'):
+                # fastest of `repeat` compiles
+                results[name] = (1 / measure(func, 0, repeat), 's')
+            else:
+                results[name] = (measure(func, min_time, repeat), units[name.split('.')[0]])
+    return results
+
+async def link_benchmarks(frames=256, window=8, endpoint=None):
+    """Time uploading a file of `frames` frames with `send_frames` and
+    downloading it again
+
+    Args:
+        frames (int): frames in the file
+        window (int): frames awaiting an OK while uploading
+        endpoint (str or None): HOST:PORT of a RADCOM or `rosen server`.  If
+            None, a simulator is run in this process
+
+    Returns:
+        dict: {name: (value, unit)}
+    """
+    if endpoint is None:
+        server = await asyncio.start_server(Simulator().handle_client, '127.0.0.1', 0)
+        host, port = '127.0.0.1', server.sockets[0].getsockname()[1]
+    else:
+        server = None
+        host, port = parse_endpoint(endpoint)
+
+    g = GCOMMScript('bench')
+    for n in range(1, frames + 1):
+        g.app_file('bench.bin', n, frames, 0, ICOMM('cmd', 'ground', frm='dcm', payload=_statement(n)))
+    data = b''.join(packet.build() for packet in g.script)
+    # AXE bytes carried by the frames, without GCOMM/ICOMM headers and padding
+    payload = sum(len(_statement(n).build()) for n in range(1, frames + 1))
+
+    try:
+        async with RADCOM(host, port) as r:
+            r.verbose = False
+            # start from an empty file
+            await r.send(GCOMM('rm_file', filename='bench.bin'))
+            await r.wait_oks(1, timeout=10)
+            start = time.perf_counter()
+            await r.send_frames(data, window, timeout=10, max_retries=3)
+            uplink = time.perf_counter() - start
+
+            with tempfile.TemporaryDirectory() as d:
+                start = time.perf_counter()
+                await download(r, 'bench.bin', os.path.join(d, 'bench.frames'))
+                downlink = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.close()
+
+    return {
+        # see `link_names`
+        'uplink.goodput': (payload / uplink / 1e3, 'kB/s'),
+        'uplink.frames': (frames / uplink, 'frames/s'),
+        'downlink.goodput': (payload / downlink / 1e3, 'kB/s'),
+        'downlink.frames': (frames / downlink, 'frames/s'),
+    }
+
+def run_benchmarks(min_time=0.2, repeat=3, script_size=1000, frames=256, window=8,
+                   endpoint=None, select=None):
+    """Run every benchmark
+
+    Args:
+        select (str or None): glob of benchmark names to keep, e.g. 'gcomm.*'
+        others: see `codec_benchmarks` and `link_benchmarks`
+
+    Returns:
+        dict: JSON serializable results with `results` mapping benchmark name
+            to `{'value': float, 'unit': str}`
+    """
+    results = codec_benchmarks(min_time, repeat, script_size, select)
+    # the link benchmarks replace bench.bin on the endpoint, so only run them
+    # if asked for
+    if any(_selected(name, select) for name in link_names):
+        results.update(asyncio.run(link_benchmarks(frames, window, endpoint)))
+    return {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': {
+            name: {'value': value, 'unit': unit}
+            for name, (value, unit) in results.items()
+            if _selected(name, select)
+        },
+    }
+
+def compare(baseline, current, threshold=0.1):
+    """Relative change of each benchmark from a baseline
+
+    Args:
+        baseline, current (dict): results of `run_benchmarks`
+        threshold (float): fractional slowdown counted as a regression
+
+    Returns:
+        dict: {name: (change, regressed)} for benchmarks in both results, where
+            change > 0 is an improvement
+    """
+    changes = {}
+    for name, new in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None or not old['value']:
+            continue
+        change = new['value'] / old['value'] - 1
+        if new['unit'] in lower_is_better:
+            change = old['value'] / new['value'] - 1 if new['value'] else 0
+        changes[name] = (change, change < -threshold)
+    return changes
+
+def report(current, baseline=None, threshold=0.1, console=None):
+    """Print benchmark results, and changes from a baseline
+
+    Returns:
+        list of str: names of regressed benchmarks
+    """
+    console = console or Console()
+    changes = compare(baseline, current, threshold) if baseline else {}
+    table = Table('Benchmark', 'Result', 'Unit', title='Benchmarks')
+    if baseline:
+        table.add_column('Baseline')
+        table.add_column('Change')
+    for name, r in current['results'].items():
+        row = [name, f"{r['value']:.4g}", r['unit']]
+        if baseline:
+            old = baseline['results'].get(name)
+            row.append(f"{old['value']:.4g}" if old else '')
+            if name in changes:
+                change, regressed = changes[name]
+                row.append(f"[{'red' if regressed else 'green'}]{change:+.1%}")
+            else:
+                row.append('')
+        table.add_row(*row)
+    console.print(table)
+    regressions = [name for name, (_, regressed) in changes.items() if regressed]
+    if regressions:
+        console.print(f"[red]{len(regressions)} regressions of more than {threshold:.0%}: {' '.join(regressions)}")
+    return regressions
+
+def bench(args):
+    """Argparse entry point for `bench` command"""
+    current = run_benchmarks(
+        args.min_time, args.repeat, args.script_size, args.frames, args.window,
+        args.endpoint, args.select
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if report(current, baseline, args.threshold):
+        sys.exit(1)
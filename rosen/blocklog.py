@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+
+from construct import Struct, Const, Int8ub, Int32ub, Int64ub, Float64b, Mapping, Byte
+import datetime
+import glob
+import lzma
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from rosen.common import handle_time
+from rosen.gcomm import GCOMM
+from rosen.packetlog import log_record
+
+# ----- Compressed Block Log Format -----
+# A header, then blocks of compressed records each preceded by the time range
+# they cover, then an index of the blocks written when the file is closed.
+# Files without an index (e.g. after a crash) are indexed by scanning the
+# block headers.
+
+block_log_header = Struct(
+    "magic" / Const(b'ROSENBLK'),
+    "version" / Const(1, Int8ub),
+    # packets: records are `log_record`s
+    # text: records are a float64 time, uint32 length and utf8 line
+    "kind" / Mapping(Byte, {'packets': 0, 'text': 1}),
+    "codec" / Mapping(Byte, {'zlib': 0, 'lzma': 1}),
+)
+
+block_header = Struct(
+    # times of first and last record in the block
+    "first" / Float64b,
+    "last" / Float64b,
+    "count" / Int32ub,
+    # compressed size of records
+    "size" / Int32ub,
+)
+
+index_entry = Struct(
+    # file offset of block header
+    "offset" / Int64ub,
+    "first" / Float64b,
+    "last" / Float64b,
+    "count" / Int32ub,
+)
+
+index_trailer = Struct(
+    "entries" / Int32ub,
+    "magic" / Const(b'ROSENIDX'),
+)
+
+codecs = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+class _RotatingLog:
+    """Compressed log which is rotated when it reaches a size or a new day
+
+    Records are buffered in memory and handed off in blocks of `block_size`
+    records to a background thread, which compresses them, appends them to
+    the current file and rotates files.  So writers never wait on compression
+    or disk.  The thread also writes out records which have been buffered for
+    `flush_interval` seconds, even if no more arrive.  If writing a block
+    fails (e.g. the disk is full), the error is raised from the next `write`,
+    `sync` or `close`.
+
+    Files are named <prefix>_<date>_<n>.blk in `directory`, by UTC date.
+
+    Args:
+        directory (str): directory to write logs to.  Created if necessary
+        prefix (str): log file name prefix
+        codec (str): 'zlib' or 'lzma'
+        block_size (int): records per compressed block
+        flush_interval (float): max seconds a record is buffered before its
+            block is written
+        max_bytes (int): start a new file once the current one reaches this size
+        daily (bool): start a new file when the date changes
+    """
+
+    kind = None
+
+    def __init__(self, directory, prefix='log', codec='zlib', block_size=256,
+                 flush_interval=5, max_bytes=64 * 2**20, daily=True):
+        assert codec in codecs, f"Unknown codec {codec}"
+        self.directory, self.prefix, self.codec = directory, prefix, codec
+        self.block_size, self.flush_interval = block_size, flush_interval
+        self.max_bytes, self.daily = max_bytes, daily
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.records, self.first, self.last = [], None, None
+        self.buffered_since = None
+        self.file, self.file_date, self.index = None, None, []
+        self.paths = []
+        # first error raised in the background thread
+        self.error = None
+
+        self.blocks = queue.Queue()
+        self.thread = threading.Thread(target=self._compress, daemon=True)
+        self.thread.start()
+
+    def _append(self, record, t):
+        """Buffer one encoded record, handing off the block if it is full"""
+        self._raise_error()
+        with self.lock:
+            if not self.records:
+                self.first, self.buffered_since = t, time.monotonic()
+            self.records.append(record)
+            self.last = t
+            if (len(self.records) >= self.block_size
+                    or time.monotonic() - self.buffered_since >= self.flush_interval):
+                self._handoff()
+
+    def _handoff(self):
+        if self.records:
+            self.blocks.put((self.first, self.last, self.records))
+            self.records = []
+
+    def _compress(self):
+        """Background thread which compresses blocks and writes/rotates files"""
+        compress = codecs[self.codec][0]
+        while True:
+            with self.lock:
+                since = self.buffered_since if self.records else None
+            # wake up when the oldest buffered record is due to be written
+            timeout = self.flush_interval if since is None else since + self.flush_interval - time.monotonic()
+            try:
+                block = self.blocks.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                with self.lock:
+                    if self.records and time.monotonic() - self.buffered_since >= self.flush_interval:
+                        self._handoff()
+                continue
+            if block is None:
+                break
+            try:
+                self._write_block(compress, *block)
+            except Exception as e:
+                self.error = self.error or e
+            finally:
+                self.blocks.task_done()
+        try:
+            self._close_file()
+        except Exception as e:
+            self.error = self.error or e
+
+    def _write_block(self, compress, first, last, records):
+        data = compress(b''.join(records))
+        date = datetime.datetime.fromtimestamp(first, datetime.timezone.utc).date()
+        if (self.file is None
+                or self.file.tell() >= self.max_bytes
+                or (self.daily and date != self.file_date)):
+            self._rotate(date)
+        offset = self.file.tell()
+        self.file.write(block_header.build(dict(first=first, last=last, count=len(records), size=len(data))))
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.index.append(dict(offset=offset, first=first, last=last, count=len(records)))
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _rotate(self, date):
+        self._close_file()
+        n = 0
+        while os.path.exists(path := os.path.join(
+                self.directory, f'{self.prefix}_{date.isoformat()}_{n:03d}.blk')):
+            n += 1
+        self.file = open(path, 'wb')
+        self.file.write(block_log_header.build(dict(kind=self.kind, codec=self.codec)))
+        self.file_date, self.index = date, []
+        self.paths.append(path)
+
+    def _close_file(self):
+        if self.file is not None:
+            for entry in self.index:
+                self.file.write(index_entry.build(entry))
+            self.file.write(index_trailer.build(dict(entries=len(self.index))))
+            self.file.close()
+            self.file = None
+
+    def sync(self):
+        """Hand off buffered records and wait until they are on disk"""
+        with self.lock:
+            self._handoff()
+        self.blocks.join()
+        self._raise_error()
+
+    def close(self):
+        """Write buffered records, index the last file and stop the thread"""
+        with self.lock:
+            self._handoff()
+            self.blocks.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RotatingPacketLog(_RotatingLog):
+    """Compressed, rotating binary packet log.  See `_RotatingLog` for arguments
+
+    Can be used in place of a PacketLogWriter, or as a RADCOM packet listener
+    to log received packets.
+    """
+
+    kind = 'packets'
+
+    def __call__(self, packet, frame):
+        self.write(frame, 'rx')
+
+    def write(self, frame, direction='rx', t=None):
+        """Log a packet
+
+        Args:
+            frame (bytes): raw GCOMM frame
+            direction (str): 'rx' for received packets, 'tx' for sent packets
+            t (float): unix time of packet.  Defaults to now
+        """
+        t = time.time() if t is None else t
+        self._append(log_record.build(dict(time=t, direction=direction, frame=frame)), t)
+
+
+class RotatingTextLog(_RotatingLog):
+    """Compressed, rotating text log with a file-like `write`.  See
+    `_RotatingLog` for arguments
+    """
+
+    kind = 'text'
+
+    def write(self, text):
+        """Log a line of text, timestamped with the current time"""
+        t = time.time()
+        line = text.encode('utf8')
+        self._append(struct.pack('>dI', t, len(line)) + line, t)
+
+    def flush(self):
+        """Records are written a block at a time in the background, so there
+        is nothing to do here"""
+
+
+class BlockLog:
+    """Reader for compressed block logs
+
+    Only the blocks overlapping a requested time range are decompressed.
+
+        log = BlockLog('~/seaque_logs/log_2024-06-01_000.blk')
+        for t, direction, packet in log.between('2024-06-01 12:00', '2024-06-01 13:00'): ...
+
+    Args:
+        path (str): log file
+
+    Attributes:
+        kind (str): 'packets' or 'text'
+        blocks (list of dict): offset, first, last and count of each block
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        header = block_log_header.parse(self.file.read(block_log_header.sizeof()))
+        self.kind, self.codec = header.kind, header.codec
+        self.blocks = self._read_index()
+
+    def _read_index(self):
+        size = os.fstat(self.file.fileno()).st_size
+        if size >= block_log_header.sizeof() + index_trailer.sizeof():
+            self.file.seek(size - index_trailer.sizeof())
+            trailer = self.file.read(index_trailer.sizeof())
+            if trailer.endswith(b'ROSENIDX'):
+                n = index_trailer.parse(trailer).entries
+                self.file.seek(size - index_trailer.sizeof() - n * index_entry.sizeof())
+                return [
+                    dict(index_entry.parse(self.file.read(index_entry.sizeof())))
+                    for _ in range(n)
+                ]
+        # no index, scan block headers.  A torn final block is ignored
+        blocks = []
+        offset = block_log_header.sizeof()
+        while offset + block_header.sizeof() <= size:
+            self.file.seek(offset)
+            b = block_header.parse(self.file.read(block_header.sizeof()))
+            if offset + block_header.sizeof() + b.size > size:
+                break
+            blocks.append(dict(offset=offset, first=b.first, last=b.last, count=b.count))
+            offset += block_header.sizeof() + b.size
+        return blocks
+
+    def read_block(self, block, parse=True):
+        """Decompress one block
+
+        Args:
+            block (dict): entry of `blocks`
+            parse (bool): parse packets.  Otherwise raw frames are returned
+
+        Returns:
+            list of tuple: (time, direction, packet) for packet logs, (time, line)
+                for text logs
+        """
+        self.file.seek(block['offset'])
+        b = block_header.parse(self.file.read(block_header.sizeof()))
+        data = codecs[self.codec][1](self.file.read(b.size))
+        records = []
+        offset = 0
+        for _ in range(b.count):
+            if self.kind == 'packets':
+                t, d = struct.unpack_from('>dB', data, offset)
+                frame = data[offset + 9:offset + log_record.sizeof()]
+                offset += log_record.sizeof()
+                packet = frame
+                if parse:
+                    try:
+                        packet = GCOMM.parse(frame)
+                    except Exception:
+                        pass
+                records.append((t, 'tx' if d else 'rx', packet))
+            else:
+                t, n = struct.unpack_from('>dI', data, offset)
+                records.append((t, data[offset + 12:offset + 12 + n].decode('utf8')))
+                offset += 12 + n
+        return records
+
+    def between(self, start=None, end=None, parse=True):
+        """Iterate over records logged in the time range [start, end)
+
+        Args:
+            start (float, str or datetime.datetime): start time, or None
+            end (float, str or datetime.datetime): end time, or None
+            parse (bool): parse packets.  Otherwise raw frames are yielded
+
+        Yields:
+            tuple: see `read_block`
+        """
+        start = float('-inf') if start is None else _unix(start)
+        end = float('inf') if end is None else _unix(end)
+        for block in self.blocks:
+            if block['last'] < start or block['first'] >= end:
+                continue
+            for record in self.read_block(block, parse):
+                if start <= record[0] < end:
+                    yield record
+
+    def __iter__(self):
+        return self.between()
+
+    def __len__(self):
+        return sum(b['count'] for b in self.blocks)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _unix(t):
+    return t if isinstance(t, float) else float(handle_time(t))
+
+def read_rotated(directory, prefix='log', start=None, end=None):
+    """Iterate over records in a time range across all rotated files of a log
+
+    Args:
+        directory (str): log directory
+        prefix (str): log file name prefix
+        start (float, str or datetime.datetime): start time, or None
+        end (float, str or datetime.datetime): end time, or None
+
+    Yields:
+        tuple: see `BlockLog.read_block`
+    """
+    for path in sorted(glob.glob(os.path.join(directory, f'{prefix}_*.blk'))):
+        with BlockLog(path) as log:
+            yield from log.between(start, end)
+
+
+def catlog(args):
+    """Argparse entry point for `catlog` command"""
+    for path in args.logs:
+        with BlockLog(path) as log:
+            for record in log.between(args.since, args.until):
+                if log.kind == 'packets':
+                    t, direction, packet = record
+                    print(f"{t:.3f} {'<' if direction == 'rx' else '>'} {packet}")
+                else:
+                    print(record[1], end='')
@@ -1,66 +1,249 @@
 #!/usr/bin/env python3
 
 import asyncio
+from dataclasses import dataclass
+import io
 import logging
+import os
 from pathlib import Path
 import sys
+import time
+from rich.console import Console
+from rich.table import Table
 
 from rosen.gcomm import GCOMMScript, GCOMM
 from rosen.icomm import ICOMMScript, ICOMM
 from rosen.axe import AXE
+from rosen.telemetry import Telemetry
 
 logging.basicConfig(format='%(message)s')
 log = logging.getLogger('rosen')
 
+@dataclass
+class LinkStats:
+    """Per-endpoint statistics collected while running a script"""
+
+    endpoint: str
+    sent: int = 0
+    retries: int = 0
+    oks: int = 0
+    elapsed: float = 0
+    startup: float = 0
+    teardown: float = 0
+    error: str = ''
+
+@dataclass
+class FileInfo:
+    """Size of a file on the SD card, as reported by `file_sd`"""
+
+    filename: str
+    records: int
+
+    @property
+    def size(self):
+        """Number of bytes the file takes up when downloaded"""
+        return self.records * GCOMM.size
+
 class RADCOM:
     """Class for holding state communicating with RADCOM
 
+    Use as an async context manager to connect, run the receiver in the
+    background and cleanly shut everything down afterwards
+
+        async with RADCOM(host, port) as r:
+            await r.send(GCOMM('get_time'))
+
     Args:
         host (str): RADCOM address
         port (int): RADCOM port
+        name (str): optional name prefixed to printed packets, useful when
+            talking to several RADCOMs at once
 
     Attributes:
         ok_received (asyncio.Event): whether an OK has been received for the last
             message sent
         host (str): RADCOM address
         port (int): RADCOM port
-        should_quit (bool): set this to True to tell infinite-running `receive`
-            coroutine to quit
+        receiving (asyncio.Task): background `receive` task started by `start`
+        sending (set): `send` tasks started by `send_soon` which haven't finished
+        pending (dict): futures for outstanding AXE query/statement requests,
+            keyed by tx_id
+        expected (list): (predicate, future) pairs registered by `expect`
+        stats (LinkStats): packet/retry counters for this endpoint
+        listeners (list): callables run as `listener(packet, frame)` with every
+            parsed GCOMM packet and its raw bytes
+        verbose (bool): print every packet sent and received
 
     """
-    def __init__(self, host, port):
+    def __init__(self, host, port, name=''):
         self.host, self.port = host, port
+        self.prefix = f'[{name}] ' if name else ''
+        self.stats = LinkStats(f'{host}:{port}')
         self.ok_received = None
-        self.should_quit = False
+        self.writer = None
+        self.receiving = None
+        self.sending = set()
+        self.pending = {}
+        self.expected = []
+        # set to a DuplicateFilter to drop repeated frames before they are parsed
+        self.dedup = None
+        # running stats of received AXE variables
+        self.telemetry = Telemetry()
+        self.listeners = [self.telemetry]
+        self.verbose = True
+        self._last_tx_id = 0
 
     async def connect(self):
         """Open connection to RADCOM"""
         try:
             self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
         except ConnectionRefusedError:
-            log.error("Connection refused")
-            sys.exit(1)
+            log.error(f"{self.prefix}Connection refused")
+            raise
+
+    async def start(self):
+        """Connect to RADCOM and start receiving packets in the background"""
+        start = time.perf_counter()
+        await self.connect()
+        self.receiving = asyncio.create_task(self.receive())
+        self.stats.startup = time.perf_counter() - start
+        log.debug(f"{self.prefix}Connected in {self.stats.startup * 1000:.1f} ms")
+
+    async def close(self, timeout=5):
+        """Clean up connection
+
+        Sends still in progress are given `timeout` seconds to drain, then the
+        receiver is cancelled, outstanding requests are cancelled and the socket
+        is closed.
+
+        Args:
+            timeout (float): max time to wait for pending sends to finish
+        """
+        start = time.perf_counter()
+        if self.writer is None:
+            return
+        try:
+            if self.sending:
+                await asyncio.wait(self.sending, timeout=timeout)
+            if not self.writer.is_closing():
+                await asyncio.wait_for(self.writer.drain(), timeout=timeout)
+        except (ConnectionError, asyncio.TimeoutError):
+            log.error(f"{self.prefix}Could not drain pending sends")
+
+        for task in [*self.sending, self.receiving]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *self.sending, *filter(None, [self.receiving]), return_exceptions=True
+        )
+        for future in [*self.pending.values(), *(f for _, f in self.expected)]:
+            future.cancel()
+        self.pending.clear()
+        self.expected.clear()
 
-    async def close(self):
-        """Clean up connection"""
         self.writer.close()
-        await writer.wait_closed()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        self.writer, self.receiving = None, None
+        self.stats.teardown = time.perf_counter() - start
+        log.debug(f"{self.prefix}Closed in {self.stats.teardown * 1000:.1f} ms")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
 
     async def receive(self):
-        """Forever-running coroutine that logs/prints received packets and checks for OK"""
+        """Coroutine that logs/prints received packets and checks for OK until
+        cancelled or the connection closes"""
         if self.ok_received is None:
             self.ok_received = asyncio.Event()
-        while not self.should_quit:
-            data = await self.reader.readexactly(GCOMM.size)
+        while True:
+            try:
+                data = await self.reader.readexactly(GCOMM.size)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                log.error(f"{self.prefix}Connection closed")
+                return
+            if self.dedup is not None and self.dedup(data):
+                log.debug(f"{self.prefix}Dropped duplicate frame")
+                continue
             try:
                 packet = GCOMM.parse(data)
-                print(f"Received {packet}")
-                if packet.cmd == 'ok':
-                    self.ok_received.set()
+            except Exception:
+                print(f'{self.prefix}Bad Packet')
+                continue
+            if self.verbose:
+                print(f"{self.prefix}Received {packet}")
+            if packet.cmd == 'ok':
+                self.stats.oks += 1
+                self.ok_received.set()
+            self.correlate(packet)
+            for listener in self.listeners:
+                try:
+                    listener(packet, data)
+                except Exception:
+                    log.exception(f"{self.prefix}Packet listener {listener} failed")
+
+    def correlate(self, packet):
+        """Hand a received packet to the outstanding request it answers, either
+        the oldest matching `expect` or the AXE request with matching tx_id
+
+        Args:
+            packet (GCOMM): received GCOMM packet
+        """
+        for predicate, future in self.expected:
+            if not future.done() and predicate(packet):
+                future.set_result(packet)
+                return
+        if not isinstance(packet.packet, ICOMM) or packet.packet.frm == 'ground':
+            return
+        axe = packet.packet.payload
+        if not isinstance(axe, AXE) or axe.cmd not in ('query', 'statement'):
+            return
+        future = self.pending.pop(axe.tx_id, None)
+        if future is not None and not future.done():
+            future.set_result(axe)
+
+    def expect(self, predicate):
+        """Register interest in the next received packet matching a predicate
+
+        Call this before sending the command being answered so the response
+        can't be missed
+
+        Args:
+            predicate (callable): called with each received GCOMM packet, returns
+                True for the packet wanted
+
+        Returns:
+            asyncio.Future: resolves to the matching GCOMM packet
+        """
+        future = asyncio.get_running_loop().create_future()
+        entry = (predicate, future)
+        self.expected.append(entry)
+        future.add_done_callback(lambda _: self._forget(entry))
+        return future
+
+    def _forget(self, entry):
+        # `close` may have already cleared expected
+        if entry in self.expected:
+            self.expected.remove(entry)
+
+    def allocate_tx_id(self):
+        """Get the next 16 bit transaction ID not used by an outstanding request
+
+        Returns:
+            int: tx_id in range 1-65535
+        """
+        for _ in range(0xffff):
+            self._last_tx_id = self._last_tx_id % 0xffff + 1
+            if self._last_tx_id not in self.pending:
+                return self._last_tx_id
+        raise RuntimeError("All AXE transaction IDs are in use")
 
-            except:
-                print('Bad Packet')
-            
     async def wait_ok(self, timeout=100):
         """Coroutine which waits for an OK to come through, or times out
 
@@ -75,17 +258,116 @@ class RADCOM:
         try:
             await asyncio.wait_for(self.ok_received.wait(), timeout=timeout)
         except asyncio.TimeoutError:
-            log.error("OK timed out")
+            log.error(f"{self.prefix}OK timed out")
             return False
         return True
 
+    async def wait_oks(self, count, timeout=100):
+        """Coroutine which waits until `count` OKs have been received in total
+        over the connection, or times out
+
+        Args:
+            count (int): value of `stats.oks` to wait for
+            timeout (float): max time to wait
+
+        Returns:
+            bool: whether the OK count was reached within the timeout period
+        """
+        if self.ok_received is None:
+            self.ok_received = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.stats.oks < count:
+            self.ok_received.clear()
+            try:
+                await asyncio.wait_for(
+                    self.ok_received.wait(), timeout=max(deadline - loop.time(), 0)
+                )
+            except asyncio.TimeoutError:
+                log.error(f"{self.prefix}OK timed out")
+                return self.stats.oks >= count
+        return True
+
+    async def _settle_oks(self, quiet):
+        """Wait until no OK has arrived for `quiet` seconds"""
+        while True:
+            self.ok_received.clear()
+            try:
+                await asyncio.wait_for(self.ok_received.wait(), timeout=quiet)
+            except asyncio.TimeoutError:
+                return
+
+    async def send_frames(self, frames, window=8, timeout=100, max_retries=None):
+        """Send pre-built GCOMM frames in bulk without rebuilding or copying them
+
+        Files are pushed with `loop.sendfile` (os.sendfile when the transport
+        supports it) and buffers are written as memoryview slices.  At most
+        `window` frames are sent before waiting for their OKs.  If the OKs don't
+        arrive in time, late OKs are waited for until none has arrived for a
+        second (or `timeout`, if shorter), then sending resumes from the first
+        unacknowledged frame.
+
+        Args:
+            frames (str, file or buffer): path or binary file object of a frame file
+                written by `GCOMMScript.compile`, or a buffer such as an mmap
+                containing contiguous GCOMM frames
+            window (int): max number of frames awaiting an OK
+            timeout (float): max time to wait for a window of OKs
+            max_retries (int or None): give up after resending a window this many
+                times.  Retry forever if None
+        """
+        if isinstance(frames, (str, Path)):
+            with open(frames, 'rb') as f:
+                return await self.send_frames(f, window, timeout, max_retries)
+
+        loop = asyncio.get_running_loop()
+        if isinstance(frames, io.IOBase):
+            size = os.fstat(frames.fileno()).st_size
+            async def write(offset, count):
+                await loop.sendfile(self.writer.transport, frames, offset, count)
+        else:
+            view = memoryview(frames)
+            size = view.nbytes
+            async def write(offset, count):
+                self.writer.write(view[offset:offset + count])
+                await self.writer.drain()
+
+        assert size % GCOMM.size == 0, "Frame data is not a whole number of GCOMM frames"
+        total = size // GCOMM.size
+        n = 0
+        retries = 0
+        try:
+            while n < total:
+                count = min(window, total - n)
+                base = self.stats.oks
+                log.debug(f"{self.prefix}Sending frames {n + 1}-{n + count} of {total}")
+                await write(n * GCOMM.size, count * GCOMM.size)
+                self.stats.sent += count
+                if await self.wait_oks(base + count, timeout):
+                    n += count
+                    retries = 0
+                    continue
+                # let late OKs for this window arrive, so they aren't credited to
+                # the resent frames, then skip past frames which did get an OK
+                await self._settle_oks(min(timeout, 1))
+                n += min(self.stats.oks - base, count)
+                if max_retries is not None and retries >= max_retries:
+                    raise TimeoutError(f"No OK after {retries} retries")
+                retries += 1
+                self.stats.retries += 1
+        finally:
+            if not isinstance(frames, io.IOBase):
+                view.release()
+
     async def send(self, packet):
         """Send a packet to GCOMM
 
         Args:
             packet (GCOMM): GCOMM packet to send
         """
-        print(f"Sending {packet}")
+        if self.verbose:
+            print(f"{self.prefix}Sending {packet}")
+        self.stats.sent += 1
         self.writer.write(packet.build())
         await self.writer.drain()
         # waiting for an OK
@@ -93,27 +375,156 @@ class RADCOM:
             self.ok_received = asyncio.Event()
         self.ok_received.clear()
 
+    def send_soon(self, packet):
+        """Send a packet in the background.  `close` waits for it to finish
+
+        Args:
+            packet (GCOMM): GCOMM packet to send
+
+        Returns:
+            asyncio.Task: task sending the packet
+        """
+        task = asyncio.create_task(self.send(packet))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+        return task
+
+    async def request(self, device, axe, timeout=10):
+        """Send an AXE query/statement to a device and wait for its response
+
+        Requests are matched to responses by tx_id, so many requests may be in
+        flight at once.
+
+        Args:
+            device (str): ICOMM device name
+            axe (AXE): AXE 'query' or 'statement' packet.  Its tx_id is overwritten
+            timeout (float): max time to wait for the response
+
+        Returns:
+            AXE or None: response payload, or None if the request timed out
+        """
+        axe.tx_id = self.allocate_tx_id()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[axe.tx_id] = future
+        try:
+            await self.send(GCOMM('exec_now', packet=ICOMM('cmd', device, payload=axe)))
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            log.error(f"No response to tx_id {axe.tx_id}")
+            return None
+        finally:
+            self.pending.pop(axe.tx_id, None)
+
+    async def query(self, device, items, timeout=10):
+        """Query items on a device and wait for the response
+
+        Args:
+            device (str): ICOMM device name
+            items (list): AXE items to query on device
+            timeout (float): max time to wait for the response
+
+        Returns:
+            AXE or None: response payload, or None if the request timed out
+        """
+        return await self.request(device, AXE('query', items), timeout=timeout)
+
+    async def statement(self, device, data, timeout=10):
+        """Send a statement to a device and wait for the response
+
+        Args:
+            device (str): ICOMM device name
+            data (dict): AXE items in statement
+            timeout (float): max time to wait for the response
+
+        Returns:
+            AXE or None: response payload, or None if the request timed out
+        """
+        return await self.request(device, AXE('statement', data), timeout=timeout)
+
+    async def file_sd(self, filename, timeout=10):
+        """Get the size of a file on the SD card
+
+        Returns as soon as RADCOM replies.  A NOK naming the file is taken as
+        the file not existing.
+
+        Args:
+            filename (str): file on the SD card
+            timeout (float): max time to wait for the reply
+
+        Returns:
+            FileInfo or None: file size, or None if the request timed out
+
+        Raises:
+            FileNotFoundError: RADCOM responded with NOK
+        """
+        reply = self.expect(
+            lambda p: p.cmd in ('file_sd', 'nok') and p.filename == filename
+        )
+        try:
+            await self.send(GCOMM('file_sd', filename=filename))
+            packet = await asyncio.wait_for(reply, timeout=timeout)
+        except asyncio.TimeoutError:
+            log.error(f"{self.prefix}No file_sd response for {filename}")
+            return None
+        finally:
+            reply.cancel()
+        if packet.cmd == 'nok':
+            raise FileNotFoundError(packet.errstr or filename)
+        return FileInfo(filename, packet.m)
+
+    async def list_sd(self, timeout=10):
+        """List the files on the SD card
+
+        RADCOM answers with one `list_sd` packet per file, numbered n of m, or a
+        single `list_sd` packet with m of 0 if the card is empty.
+
+        Args:
+            timeout (float): max time to wait for the full listing
+
+        Returns:
+            list of str or None: filenames, or None if the request timed out
+        """
+        filenames = {}
+        complete = asyncio.Event()
+        def listener(packet, frame):
+            if packet.cmd != 'list_sd':
+                return
+            if packet.m > 0:
+                filenames[packet.n] = packet.filename
+            if len(filenames) >= packet.m:
+                complete.set()
+        self.listeners.append(listener)
+        try:
+            await self.send(GCOMM('list_sd'))
+            await asyncio.wait_for(complete.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.error(f"{self.prefix}Incomplete list_sd response")
+            return None
+        finally:
+            self.listeners.remove(listener)
+        return [filenames[n] for n in sorted(filenames)]
+
 # ----- Interactive Shell -----
 
-async def shell_client(r, helper, loop):
+async def shell_client(r, helper):
     """
     Shell coroutine
 
     Args:
         r (RADCOM): RADCOM state object
         helper (str): path to Python script containing user defined functions/variables
-        loop (asyncio loop): kill the asyncio loop when the shell completes
     """
 
     from ptpython.repl import embed
     from prompt_toolkit.enums import EditingMode
 
-    await r.connect()
-    # kick off receive coroutine
-    receiving = asyncio.create_task(r.receive())
+    try:
+        await r.start()
+    except ConnectionRefusedError:
+        sys.exit(1)
 
     def send(command):
-        asyncio.create_task(r.send(command))
+        r.send_soon(command)
 
     if helper is not None:
         exec(Path(helper).read_text())
@@ -124,65 +535,142 @@ async def shell_client(r, helper, loop):
         repl.editing_mode = EditingMode.VI
 
     print('Use send() to stick things in the queue')
+    print('Use `await r.query(device, items)` or `await r.statement(device, data)` to get a response')
+    print("Use `r.telemetry['dcm.error_reg']` or `print(r.telemetry.table())` for received telemetry stats")
     print('CTRL+D to quit the shell')
-    await embed(
-        globals=globals(),
-        locals=locals(),
-        return_asyncio_coroutine=True,
-        patch_stdout=True,
-        configure=repl_config
-    )
-
-    # tell coroutines to exit, and wait for exit
-    # r.should_quit = True
-    # await receiving
-    # FIXME: r.should_quit doesn't work
-    loop.stop()
+    try:
+        await embed(
+            globals=globals(),
+            locals=locals(),
+            return_asyncio_coroutine=True,
+            patch_stdout=True,
+            configure=repl_config
+        )
+    finally:
+        # let queued sends go out, then stop the receiver
+        await r.close()
 
 def shell(args):
     """Argparse entry point for `shell` command"""
     r = RADCOM(args.host, args.port)
-    loop = asyncio.get_event_loop()
-    asyncio.run(shell_client(r, args.script, loop))
+    asyncio.run(shell_client(r, args.script))
 
 # ----- Manual Script Running -----
 
-async def run_client(r, script_file, loop):
+async def stream_script(r, script, timeout=100, max_retries=None, window=8):
     """
-    Script runner coroutine
+    Connect to a single RADCOM and send it every packet of a script
 
     Args:
         r (RADCOM): RADCOM state object
-        script (str or GCOMMScript): GCOMM script to execute
-        loop (asyncio loop): kill the asyncio loop when the shell completes
+        script (GCOMMScript or str): GCOMM script to execute, or path of a compiled
+            frame file to send in bulk
+        timeout (float): max time to wait for each OK before resending
+        max_retries (int or None): give up after resending a packet this many
+            times.  Retry forever if None
+        window (int): max frames awaiting an OK when sending a frame file
     """
-    await r.connect()
-    # kick off receive coroutine
-    receiving = asyncio.create_task(r.receive())
+    start = time.perf_counter()
+    async with r:
+        if not isinstance(script, GCOMMScript):
+            await r.send_frames(script, window, timeout, max_retries)
+        else:
+            for packet in script:
+                # wait for an OK, resend previous packet if no OK received
+                await r.send(packet)
+                retries = 0
+                while not await r.wait_ok(timeout):
+                    if max_retries is not None and retries >= max_retries:
+                        raise TimeoutError(f"No OK after {retries} retries")
+                    retries += 1
+                    r.stats.retries += 1
+                    await r.send(packet)
+
+    r.stats.elapsed = time.perf_counter() - start
+
+async def _stream_script_stats(r, *args):
+    """Run `stream_script`, recording any failure in the endpoint's stats
+    instead of raising, so one bad endpoint doesn't cancel the others"""
+    try:
+        await stream_script(r, *args)
+    except Exception as e:
+        r.stats.error = str(e) or type(e).__name__
+
+async def run_client(r, script_file, timeout=100, max_retries=None,
+                     bulk=False, window=8):
+    """
+    Script runner coroutine.  The script is streamed to every RADCOM concurrently,
+    each with its own OK tracking and retry state
 
-    if type(script_file) is str:
+    Args:
+        r (RADCOM or list of RADCOM): RADCOM state object(s), one per endpoint
+        script_file (str or GCOMMScript): GCOMM script to execute
+        timeout (float): max time to wait for each OK before resending
+        max_retries (int or None): give up on an endpoint after resending a
+            packet this many times.  Retry forever if None
+        bulk (bool): script_file is a frame file written by `GCOMMScript.compile`
+            and should be sent with `RADCOM.send_frames`
+        window (int): max frames awaiting an OK in bulk mode
+
+    Returns:
+        list of LinkStats: statistics for each endpoint
+    """
+    radcoms = [r] if isinstance(r, RADCOM) else list(r)
+
+    if bulk:
+        script = script_file
+    elif type(script_file) is str:
         script = GCOMMScript.load(script_file)
-    elif type(script) is GCOMMScript:
+    elif type(script_file) is GCOMMScript:
         script = script_file
     else:
         raise TypeError("Invalid type for script_file")
 
-    for packet in script:
-        # wait for an OK, resend previous packet if no OK received
-        await r.send(packet)
-        while not await r.wait_ok():
-            await r.send(packet)
+    async with asyncio.TaskGroup() as tg:
+        for r in radcoms:
+            tg.create_task(_stream_script_stats(r, script, timeout, max_retries, window))
 
-    # tell coroutines to exit, and wait for exit
-    # r.should_quit = True
-    # await receiving
-    # FIXME: r.should_quit doesn't work
-    loop.stop()
+    return [r.stats for r in radcoms]
 
+def report(stats):
+    """Print a table summarizing a script run on each endpoint
+
+    Args:
+        stats (list of LinkStats): statistics returned by `run_client`
+    """
+    table = Table(
+        "Endpoint", "Sent", "Retries", "OKs", "Time (s)", "Packets/s", "Status",
+        title="Run Summary",
+    )
+    for s in stats:
+        table.add_row(
+            s.endpoint, str(s.sent), str(s.retries), str(s.oks),
+            f'{s.elapsed:.3f}' if not s.error else '',
+            f'{s.sent / s.elapsed:.1f}' if s.elapsed and not s.error else '',
+            f'[red]{s.error}' if s.error else '[green]done',
+        )
+    Console().print(table)
+
+def parse_endpoint(endpoint):
+    """Split a HOST:PORT string
+
+    Returns:
+        tuple: (host, port)
+    """
+    host, _, port = endpoint.rpartition(':')
+    return host, int(port)
 
 def run(args):
     """Argparse entry point for `run` command"""
-    r = RADCOM(args.host, args.port)
-    # FIXME: ugly
-    loop = asyncio.get_event_loop()
-    asyncio.run(run_client(r, args.script, loop))
+    endpoints = args.endpoint or [f'{args.host}:{args.port}']
+    radcoms = [
+        RADCOM(*parse_endpoint(e), name=e if len(endpoints) > 1 else '')
+        for e in endpoints
+    ]
+    stats = asyncio.run(run_client(
+        radcoms, args.script, max_retries=args.retries,
+        bulk=args.bulk, window=args.window
+    ))
+    report(stats)
+    if any(s.error for s in stats):
+        sys.exit(1)
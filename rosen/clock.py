@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import heapq
+import logging
+import pickle
+import time
+from rich.console import Console
+from rich.table import Table
+
+from rosen.axe import AXE
+from rosen.gcomm import GCOMM, GCOMMScript
+from rosen.icomm import ICOMM
+
+log = logging.getLogger('rosen')
+
+# ----- Clocks -----
+
+class Clock:
+    """Wall clock.  Simulator time and sleeps go through a clock so they can be
+    accelerated"""
+
+    def time(self):
+        return time.time()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(max(seconds, 0))
+
+
+class VirtualClock(Clock):
+    """Clock which runs `speed` times faster than real time
+
+    Args:
+        start (float or None): unix time the clock starts at.  Defaults to now
+        speed (float): virtual seconds per real second
+    """
+
+    def __init__(self, start=None, speed=1):
+        self.start = time.time() if start is None else start
+        self.speed = speed
+        self.real_start = time.monotonic()
+
+    def time(self):
+        return self.start + (time.monotonic() - self.real_start) * self.speed
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(max(seconds, 0) / self.speed)
+
+
+# ----- Scheduled Script Execution -----
+
+@dataclass
+class Event:
+    """One ICOMM packet executed by a scheduled script"""
+
+    time: float
+    end: float
+    filename: str
+    device: str
+    command: str
+    packet: ICOMM = field(repr=False)
+
+
+@dataclass
+class Run:
+    """One execution of a scheduled script file"""
+
+    filename: str
+    start: float
+    end: float
+    events: list = field(repr=False)
+
+
+def command_name(icomm):
+    """Name used to look up how long an ICOMM packet takes: the command of an
+    AXE `execute`, otherwise the AXE verb"""
+    axe = icomm.payload
+    if not isinstance(axe, AXE):
+        return 'unknown'
+    return str(axe.data) if axe.cmd == 'execute' else axe.cmd
+
+def sweep(items, start, end):
+    """Pairs of items whose [start, end) intervals overlap
+
+    Args:
+        items (list): items to check
+        start, end (callable): interval of an item
+
+    Returns:
+        list of tuple: (earlier, later) overlapping pairs
+    """
+    pairs = []
+    active = []
+    for item in sorted(items, key=start):
+        active = [a for a in active if end(a) > start(item)]
+        pairs.extend((a, item) for a in active)
+        active.append(item)
+    return pairs
+
+
+class Timeline:
+    """Result of executing scheduled scripts
+
+    Attributes:
+        runs (list of Run): script executions in start order
+        events (list of Event): executed packets in time order
+        overlaps (list of tuple): pairs of Runs which execute at the same time
+        contention (list of tuple): pairs of Events from different scripts
+            which keep the same device busy at the same time
+    """
+
+    def __init__(self, runs):
+        self.runs = sorted(runs, key=lambda r: r.start)
+        self.events = list(heapq.merge(*(r.events for r in self.runs), key=lambda e: e.time))
+        self.overlaps = sweep(self.runs, lambda r: r.start, lambda r: r.end)
+        self.contention = []
+        by_device = {}
+        for e in self.events:
+            by_device.setdefault(e.device, []).append(e)
+        for events in by_device.values():
+            self.contention.extend(
+                (a, b) for a, b in sweep(events, lambda e: e.time, lambda e: e.end)
+                if a.filename != b.filename
+            )
+
+    def report(self, console=None):
+        """Print the timeline, overlapping scripts and device contention"""
+        console = console or Console()
+        fmt = lambda t: datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+        table = Table('Time (UTC)', 'End', 'File', 'Device', 'Command', title='Timeline')
+        for e in self.events:
+            table.add_row(fmt(e.time), fmt(e.end), e.filename, e.device, e.command)
+        console.print(table)
+
+        if self.overlaps:
+            table = Table('Script', 'Start', 'End', 'Overlaps', 'Start', 'End', title='Overlapping Scripts')
+            for a, b in self.overlaps:
+                table.add_row(a.filename, fmt(a.start), fmt(a.end), b.filename, fmt(b.start), fmt(b.end))
+            console.print(table)
+        if self.contention:
+            table = Table('Device', 'Script', 'Command', 'Busy Until', 'Script', 'Command', 'Starts', title='Device Contention')
+            for a, b in self.contention:
+                table.add_row(a.device, a.filename, a.command, fmt(a.end), b.filename, b.command, fmt(b.time))
+            console.print(table)
+        console.print(
+            f'{len(self.runs)} scripts, {len(self.events)} commands, '
+            f'{len(self.overlaps)} overlaps, {len(self.contention)} contended commands'
+        )
+
+
+class Executor:
+    """Replays scheduled (`!<timestamp>`) script files on a virtual clock
+    without waiting, to check the timing of a campaign
+
+    Args:
+        durations (dict): seconds each command keeps its device busy, keyed by
+            '<device>.<command>' or '<command>' (see `command_name`)
+        default_duration (float): duration of commands not in `durations`
+    """
+
+    def __init__(self, durations=None, default_duration=1):
+        self.durations = durations or {}
+        self.default_duration = default_duration
+
+    def duration(self, device, command):
+        return self.durations.get(
+            f'{device}.{command}', self.durations.get(command, self.default_duration)
+        )
+
+    @staticmethod
+    def sd_files(scripts):
+        """Apply the file commands of GCOMM scripts to an empty SD card
+
+        Args:
+            scripts (list of GCOMMScript or list of GCOMM): scripts in upload order
+
+        Returns:
+            dict: GCOMM app_file records of each file left on the card
+        """
+        files = {}
+        for script in scripts:
+            for g in script.script if isinstance(script, GCOMMScript) else script:
+                if g.cmd == 'app_file':
+                    files.setdefault(g.filename, {})[g.n] = g
+                elif g.cmd == 'rm_file':
+                    files.pop(g.filename, None)
+                elif g.cmd == 'clear_sd':
+                    files.clear()
+        return {name: [records[n] for n in sorted(records)] for name, records in files.items()}
+
+    def run(self, scripts, on_event=None):
+        """Execute the scheduled files left on the SD card by some scripts
+
+        Args:
+            scripts (list of GCOMMScript or list of GCOMM): scripts in upload order
+            on_event (callable): called with each Event in time order
+
+        Returns:
+            Timeline
+        """
+        runs = []
+        for filename, records in self.sd_files(scripts).items():
+            if not filename.startswith('!'):
+                continue
+            try:
+                start = int(filename[1:])
+            except ValueError:
+                log.error(f"Bad scheduled script name {filename}")
+                continue
+            events = []
+            for g in sorted(records, key=lambda g: g.offset):
+                if not isinstance(g.packet, ICOMM):
+                    continue
+                t = start + g.offset
+                command = command_name(g.packet)
+                end = t + self.duration(g.packet.to, command)
+                events.append(Event(t, end, filename, g.packet.to, command, g.packet))
+            if events:
+                runs.append(Run(filename, start, max(e.end for e in events), events))
+
+        timeline = Timeline(runs)
+        if on_event is not None:
+            for event in timeline.events:
+                on_event(event)
+        return timeline
+
+
+def load_script(path):
+    """Load a pickled GCOMMScript or a compiled frame file
+
+    Raises:
+        ValueError: a frame file which isn't a whole number of GCOMM frames
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    # pickles start with the PROTO opcode, frames with a GCOMM command number
+    if data[:1] == pickle.PROTO:
+        return GCOMMScript.load(path)
+    if len(data) % GCOMM.size:
+        raise ValueError(f"{path} is not a pickled GCOMMScript or a whole number of GCOMM frames")
+    return [GCOMM.parse(data[i:i + GCOMM.size]) for i in range(0, len(data), GCOMM.size)]
+
+def timeline(args):
+    """Argparse entry point for `timeline` command"""
+    durations = {}
+    for d in args.duration or []:
+        name, _, seconds = d.rpartition('=')
+        durations[name] = float(seconds)
+    start = time.perf_counter()
+    t = Executor(durations, args.default_duration).run([load_script(p) for p in args.scripts])
+    elapsed = time.perf_counter() - start
+    t.report()
+    if t.runs:
+        print(f'Checked {(t.runs[-1].end - t.runs[0].start) / 3600:.1f} hours of scheduling in {elapsed:.3f}s')
@@ -24,6 +24,27 @@ def handle_time(t):
 
     return int(d.timestamp())
 
+def flatten(data, prefix=''):
+    """Flatten nested AXE data into dotted keys
+
+    Args:
+        data (dict or list): AXE data
+        prefix (str): prefix for generated keys
+
+    Returns:
+        list of tuple: (key, value) pairs with scalar values
+    """
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, (list, tuple)):
+        items = enumerate(data)
+    else:
+        return [(prefix, data)]
+    flat = []
+    for k, v in items:
+        flat.extend(flatten(v, f'{prefix}.{k}' if prefix else str(k)))
+    return flat
+
 class Packet:
 
     def __repr__(self):
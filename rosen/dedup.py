@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+import hashlib
+import time
+
+from rosen.gcomm import GCOMM
+
+class DuplicateFilter:
+    """Drop raw frames identical to one received within the last `window`
+    seconds, before they are decoded, logged or displayed
+
+    Frames are keyed by a 64 bit BLAKE2b hash.  At most `max_entries` recent
+    frames are remembered.
+
+    Args:
+        window (float): seconds after a frame is first seen that identical
+            frames are dropped
+        max_entries (int): max frames remembered
+        passthrough (iterable of str): GCOMM commands whose repeats are
+            meaningful and are never dropped: OK/NOK, replies to requests
+            which may be repeated (file_sd, list_sd, get_time), and records
+            and statements which may be sent again unchanged (app_file,
+            exec_now)
+
+    Attributes:
+        suppressed (int): number of frames dropped
+    """
+
+    def __init__(self, window=2, max_entries=4096, passthrough=('ok', 'nok', 'file_sd', 'list_sd', 'get_time', 'app_file', 'exec_now')):
+        self.window, self.max_entries = window, max_entries
+        # GCOMM command is the first byte of the frame
+        self.passthrough = {GCOMM(cmd).build()[0] for cmd in passthrough}
+        self.seen = OrderedDict()
+        self.suppressed = 0
+
+    def __call__(self, frame, t=None):
+        """Check a received frame
+
+        Args:
+            frame (bytes): raw GCOMM frame
+            t (float): time frame was received.  Defaults to now
+
+        Returns:
+            bool: True if the frame is a duplicate and should be dropped
+        """
+        if frame[0] in self.passthrough:
+            return False
+        t = time.monotonic() if t is None else t
+        # forget frames which are out of the window (oldest first)
+        while self.seen and next(iter(self.seen.values())) <= t - self.window:
+            self.seen.popitem(last=False)
+
+        key = hashlib.blake2b(frame, digest_size=8).digest()
+        if key in self.seen:
+            self.suppressed += 1
+            return True
+        self.seen[key] = t
+        if len(self.seen) > self.max_entries:
+            self.seen.popitem(last=False)
+        return False
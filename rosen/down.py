@@ -1,107 +1,466 @@
-import socket
+import asyncio
+from fnmatch import fnmatch
+import hashlib
+import json
+import os
+from pathlib import Path
+import sys
 import time
-import threading
-import pickle as pkl
+from rich.console import Console
+from rich.table import Table
 
+from rosen.client import RADCOM, log
 from rosen.gcomm import GCOMM
+from rosen.monitor import Monitor
 
-sock = None
-packets = []
 
-def download():
+class IntegrityError(Exception):
+    """Downloaded file doesn't match its expected digest"""
 
-    global sock
-    global n
-    global m
-    global recv_l
-    global packets
 
-    data = b''
+class DownloadAborted(Exception):
+    """A monitor rule asked for the download to be abandoned"""
 
-    while True:
-        d = sock.recv(4162)
-        data = b''.join([data, d])
-        recv_l = recv_l + len(d)
-        if (len(data) >= 4162):
-            packet = GCOMM.parse(data[:4162])
-            data = data[4162:]
-            if packet.cmd == 'app_file':
-                n = packet.n
-                m = packet.m
-            packets.append(packet)
 
+# BLAKE2b tree hashing parameters, with one leaf per record
+tree_params = dict(digest_size=32, fanout=0, depth=2, leaf_size=GCOMM.size, inner_size=32)
 
-def down_file(args):
+def record_digest(n, m, frame):
+    """Leaf hash of record `n` of an `m` record frame file"""
+    return hashlib.blake2b(
+        frame, node_offset=n - 1, node_depth=0, last_node=n == m, **tree_params
+    ).digest()
 
-    global sock
-    global m
-    global n
-    global recv_l
-    global packets
+def file_digest(leaves):
+    """Hex digest of a frame file from the concatenated leaf hashes of its
+    records, see `record_digest`"""
+    return hashlib.blake2b(leaves, node_depth=1, last_node=True, **tree_params).hexdigest()
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
 
-    sock.connect((args.host, args.port))
+class Download:
+    """Packet listener which writes the `app_file` records of an SD card file
+    straight to their position in an output file as they arrive
 
-    n = 0
-    m = 1
-    recv_l = 0
+    The output file holds the received GCOMM frames back to back, record `n` at
+    offset `(n - 1) * GCOMM.size`, and is preallocated when the first record
+    arrives.  No packets are kept in memory, only a bitmap of which records
+    have been received.
 
-    # Get size of file
-    packets = []
-    sock.send(GCOMM('file_sd', filename=args.downfile).build())
-    datav = []
-    sock.settimeout(3)
-    while True:
-        try:
-            datav.append(sock.recv(4162))
-        except socket.timeout:
-            break
+    A BLAKE2b tree digest of the output file is computed as records are
+    written.  Each record is hashed as it arrives, in any order, and only the
+    32 byte leaf hashes are kept, so the file is never read back.  Once every
+    record is in, a `<path>.manifest` is written, unless the digest doesn't
+    match `expected`.
+
+    Args:
+        filename (str): name of file on the SD card
+        path (str): output file path
+        expected (str or None): hex digest the file should have
+
+    Attributes:
+        n (int): number of distinct records written
+        m (int or None): total number of records, once known
+        duplicates (int): number of records received more than once
+        done (asyncio.Event): set once every record has been written
+        leaves (bytearray): leaf hash of each record, see `record_digest`
+    """
+
+    def __init__(self, filename, path, expected=None):
+        self.filename, self.path, self.expected = filename, path, expected
+        self.n = 0
+        self.m = None
+        self.duplicates = 0
+        self.bitmap = bytearray()
+        self.leaves = bytearray()
+        self.done = asyncio.Event()
+        self.start_t = time.time()
+        self.end_t = None
+        self._fd = None
+        self._last_print = 0
+
+    def __call__(self, packet, frame):
+        if packet.cmd != 'app_file':
+            return
+        if packet.filename and packet.filename != self.filename:
+            return
+
+        if self.m is None:
+            self.m = packet.m
+            self.bitmap = bytearray((self.m + 7) // 8)
+            self.leaves = bytearray(self.m * tree_params['digest_size'])
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.ftruncate(self._fd, self.m * GCOMM.size)
+        if not 1 <= packet.n <= self.m:
+            log.error(f'Record {packet.n} out of range for {self.m} record file')
+            return
+        if self.has(packet.n):
+            self.duplicates += 1
+            return
+        os.pwrite(self._fd, frame, (packet.n - 1) * GCOMM.size)
+        self.bitmap[(packet.n - 1) >> 3] |= 1 << ((packet.n - 1) & 7)
+        self.n += 1
+        size = tree_params['digest_size']
+        self.leaves[(packet.n - 1) * size:packet.n * size] = record_digest(packet.n, self.m, frame)
+
+        if time.time() - self._last_print > 0.25:
+            self._last_print = time.time()
+            self.progress()
+
+        if self.n == self.m:
+            self.finish()
+
+    @property
+    def digest(self):
+        """Hex BLAKE2b tree digest of the output file, once every record is in"""
+        return file_digest(self.leaves) if self.n == self.m else None
+
+    def manifest(self):
+        """Sidecar manifest describing the downloaded file
+
+        Returns:
+            dict
+        """
+        return {
+            'filename': self.filename, 'records': self.m,
+            'size': self.m * GCOMM.size, 'blake2b': self.digest
+        }
+
+    def has(self, n):
+        """Whether record `n` has been received"""
+        return bool(self.bitmap[(n - 1) >> 3] & (1 << ((n - 1) & 7)))
+
+    def gaps(self):
+        """Find runs of records which haven't been received yet
+
+        Returns:
+            list of tuple: (first, last) record numbers of each missing run
+        """
+        if self.m is None:
+            return []
+        gaps = []
+        n = 1
+        while n <= self.m:
+            # skip whole bytes of received records
+            if n & 7 == 1 and self.bitmap[(n - 1) >> 3] == 0xff:
+                n += 8
+                continue
+            if not self.has(n):
+                start = n
+                while n <= self.m and not self.has(n):
+                    n += 1
+                gaps.append((start, n - 1))
+            n += 1
+        return gaps
+
+    def progress(self, end=''):
+        """Print download progress on the current line"""
+        dups = f', {self.duplicates} duplicates' if self.duplicates else ''
+        print(f'\rGot {self.n} of {self.m} packets at {self.rate:.3f} packets/s{dups}', end=end)
+
+    @property
+    def elapsed(self):
+        return (self.end_t or time.time()) - self.start_t
+
+    @property
+    def rate(self):
+        return self.n / self.elapsed
+
+    def finish(self):
+        """Close the output file, write its manifest if the digest is as
+        expected, and mark the download as done"""
+        self.end_t = time.time()
+        self.close()
+        if self.expected is None or self.expected == self.digest:
+            with open(self.path + '.manifest', 'w') as f:
+                json.dump(self.manifest(), f)
+        self.done.set()
+
+    def close(self):
+        """Close the output file"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+async def transfer(r, d, stall_timeout=5, max_rerequests=10, abort=None):
+    """Request a file from RADCOM and wait until every record has been written
+
+    If no new records arrive for `stall_timeout` seconds, only the missing
+    ranges are requested again with a ranged `down_file`
+
+    Args:
+        r (RADCOM): connected RADCOM
+        d (Download): download to feed with received records
+        stall_timeout (float): time without new records before re-requesting gaps
+        max_rerequests (int): give up after re-requesting gaps this many times
+        abort (asyncio.Event or None): stop waiting as soon as this is set
+
+    Raises:
+        DownloadAborted: `abort` was set before the download finished
+    """
+    r.listeners.append(d)
+    events = [d.done] if abort is None else [d.done, abort]
+    waiters = [asyncio.ensure_future(e.wait()) for e in events]
+    try:
+        await r.send(GCOMM('down_file', filename=d.filename))
+        rerequests = 0
+        last_n = 0
+        while True:
+            await asyncio.wait(waiters, timeout=stall_timeout, return_when=asyncio.FIRST_COMPLETED)
+            if abort is not None and abort.is_set():
+                print()
+                raise DownloadAborted(f'Download aborted with {d.n} of {d.m} records')
+            if d.done.is_set():
+                break
+            if d.n > last_n:
+                last_n = d.n
+                continue
+            if rerequests >= max_rerequests:
+                raise TimeoutError(f'Download stalled with {d.n} of {d.m} records')
+            rerequests += 1
+            # nothing received at all, so start over
+            gaps = d.gaps() if d.m is not None else [(0, 0)]
+            print()
+            log.error(f'Download stalled, re-requesting {gaps}')
+            for start, end in gaps:
+                await r.send(GCOMM('down_file', filename=d.filename, n=start, m=end))
+    finally:
+        for w in waiters:
+            w.cancel()
+        r.listeners.remove(d)
+        d.close()
+
+
+async def fetch(r, info, path, expected=None, **kwargs):
+    """Download a file from the SD card into a frame file.  The SD card should
+    already be disabled
 
-    sock.settimeout(None)
-    fullsize = 0
-    for d in datav:
-        p = GCOMM.parse(d)
-        print(p)
-        if p.m > fullsize:
-            fullsize = p.m
+    Args:
+        r (RADCOM): connected RADCOM
+        info (FileInfo): file to download, from `RADCOM.file_sd`
+        path (str): output file path
+        expected (str or None): BLAKE2b hex digest the file should have
+        **kwargs: passed to `transfer`
 
-    start_t = time.time()
-    sock.send(GCOMM('disable_sd').build())
-    time.sleep(0.2)
-    sock.send(GCOMM('down_file', filename=args.downfile).build())
+    Returns:
+        Download: finished download
 
+    Raises:
+        IntegrityError: the file doesn't match `expected`.  No manifest is
+            written for it
+    """
+    d = Download(info.filename, path, expected)
+    if info.records == 0:
+        open(path, 'wb').close()
+        d.m = 0
+        d.finish()
+    else:
+        await transfer(r, d, **kwargs)
+        d.progress(end='\n')
 
-    down_thread = threading.Thread(target=download, daemon=True)
-    down_thread.start()
+    if expected is not None and expected != d.digest:
+        raise IntegrityError(f'{info.filename} digest {d.digest} does not match {expected}')
 
-    print()
-    while n != m:
-        print(f'\rGot {n} of {m} packets at {n / (time.time() - start_t):.3f} packets/s', end='')
-        #print(f'\rGot {recv_l} of {fullsize} bytes ', end='')
-        time.sleep(0.25)
+    return d
 
-    print(f'\rGot {n} of {m} packets at {n / (time.time() - start_t):.3f} packets/s')
 
-    with open(str(int(time.time())) + '-' + args.downfile.replace('.','_') + '.pkl', 'wb') as f:
-        pkl.dump(packets, f)
+def verify(path, manifest=None):
+    """Check a downloaded frame file against a manifest
 
-    # Read packets for errors here
-    error_val_max = 0
-    for p in packets:
+    Args:
+        path (str): downloaded frame file
+        manifest (str): manifest path.  Defaults to `path + '.manifest'`
+
+    Returns:
+        bool: whether the file matches the manifest
+    """
+    with open(manifest or path + '.manifest') as f:
+        expected = json.load(f)
+    m = os.path.getsize(path) // GCOMM.size
+    leaves = bytearray()
+    with open(path, 'rb') as f:
+        for n in range(1, m + 1):
+            leaves += record_digest(n, m, f.read(GCOMM.size))
+        # trailing partial record
+        if f.read(1):
+            return False
+    return file_digest(leaves) == expected['blake2b']
+
+
+async def download(r, filename, path, **kwargs):
+    """Download a single file from the SD card into a frame file
+
+    Args:
+        r (RADCOM): connected RADCOM
+        filename (str): name of file on the SD card
+        path (str): output file path
+        **kwargs: passed to `fetch`
+
+    Returns:
+        Download: finished download
+
+    Raises:
+        FileNotFoundError: the file isn't on the SD card
+        TimeoutError: RADCOM stopped responding
+        IntegrityError: the file doesn't match its manifest
+        DownloadAborted: a monitor rule aborted the download
+    """
+    downloads = await download_many(r, [filename], [path], skip_errors=False, **kwargs)
+    return downloads[0]
+
+
+async def expand(r, patterns):
+    """Expand glob patterns against the files listed on the SD card
+
+    Args:
+        r (RADCOM): connected RADCOM
+        patterns (list of str): filenames or glob patterns
+
+    Returns:
+        list of str: filenames, in the order given
+    """
+    is_glob = lambda p: bool(set('*?[') & set(p))
+    listing = await r.list_sd() if any(map(is_glob, patterns)) else []
+    if listing is None:
+        raise TimeoutError('No response to list_sd')
+    filenames = []
+    for p in patterns:
+        matches = [f for f in listing if fnmatch(f, p)] if is_glob(p) else [p]
+        filenames.extend(f for f in matches if f not in filenames)
+    return filenames
+
+
+async def download_many(r, filenames, paths, manifest_dir=None, monitor=None,
+                        skip_errors=True, **kwargs):
+    """Download several files over one connection
+
+    Sizes of all files are requested at once up front, then files are
+    downloaded back to back so the link stays busy between them.  Files which
+    can't be found or fail to download are reported and skipped.  If a monitor
+    rule aborts, the remaining files are abandoned too.
+
+    Args:
+        r (RADCOM): connected RADCOM
+        filenames (list of str): names of files on the SD card
+        paths (list of str): output file path for each file
+        manifest_dir (str or None): directory of known-good manifests named
+            `<filename>.manifest` to check downloads against
+        monitor (Monitor or None): telemetry monitor checking every received
+            payload.  Defaults to one with `default_rules()`
+        skip_errors (bool): skip files which can't be found or fail to
+            download.  Otherwise the first error is raised
+        **kwargs: passed to `fetch`
+
+    Returns:
+        list of Download: successful downloads
+
+    Raises:
+        DownloadAborted: a monitor rule aborted the downloads
+    """
+    if monitor is None:
+        monitor = Monitor()
+    r.listeners.append(monitor)
+    try:
+        return await _download_many(r, filenames, paths, manifest_dir, monitor, skip_errors, **kwargs)
+    finally:
+        r.listeners.remove(monitor)
+        for key, value in monitor.maxima.items():
+            print(f'Largest payload {key} was {value}')
+
+
+async def _download_many(r, filenames, paths, manifest_dir, monitor, skip_errors, **kwargs):
+    infos = await asyncio.gather(
+        *(r.file_sd(f) for f in filenames), return_exceptions=True
+    )
+
+    await r.send(GCOMM('disable_sd'))
+    await asyncio.sleep(0.2)
+
+    downloads = []
+    for filename, path, info in zip(filenames, paths, infos):
+        if info is None:
+            info = TimeoutError(f'No file_sd response for {filename}')
+        if isinstance(info, Exception):
+            if not skip_errors:
+                raise info
+            log.error(f'Skipping {filename}: {info}')
+            continue
+        print(f'{filename} has {info.records} records ({info.size} bytes)')
+        expected = None
+        if manifest_dir is not None:
+            manifest = Path(manifest_dir) / (filename + '.manifest')
+            if manifest.exists():
+                expected = json.loads(manifest.read_text())['blake2b']
         try:
-            error_val = p.packet.payload.data['error_reg']
-            if error_val > error_val_max:
-                error_val_max = error_val
-        except:
-            pass
+            downloads.append(await fetch(
+                r, info, path, expected=expected, abort=monitor.aborted, **kwargs
+            ))
+        except (TimeoutError, IntegrityError) as e:
+            if not skip_errors:
+                raise
+            log.error(f'Skipping {filename}: {e}')
+    return downloads
+
 
-    if error_val_max >= 200 and error_val_max < 300:
-        print(f'Non-critical error {error_val_max} reported by payload, alert SEAQUE team.')
-    elif error_val_max > 300:
-        print(f'Critical error {error_val_max} reported by payload, alert SEAQUE team. DO NOT proceed with upload.')
+def report(downloads):
+    """Print a table of per-file and total download throughput
 
-    exit()
+    Args:
+        downloads (list of Download): finished downloads
+    """
+    table = Table(
+        "File", "Records", "Duplicates", "Time (s)", "Packets/s", "MB/s",
+        title="Download Summary",
+    )
+    def rates(records, elapsed):
+        if not elapsed:
+            return '', ''
+        return f'{records / elapsed:.1f}', f'{records * GCOMM.size / elapsed / 1e6:.3f}'
+    for d in downloads:
+        table.add_row(
+            d.filename, str(d.n), str(d.duplicates), f'{d.elapsed:.3f}',
+            *rates(d.n, d.elapsed)
+        )
+    if downloads:
+        records = sum(d.n for d in downloads)
+        elapsed = max(d.end_t for d in downloads) - min(d.start_t for d in downloads)
+        table.add_row(
+            'Total', str(records), str(sum(d.duplicates for d in downloads)),
+            f'{elapsed:.3f}', *rates(records, elapsed), style='bold'
+        )
+    Console().print(table)
 
+
+def default_path(filename, directory='.'):
+    """Output path for a downloaded file, named with the current time"""
+    return str(Path(directory) / (str(int(time.time())) + '-' + filename.replace('.', '_') + '.frames'))
+
+
+async def down_client(r, patterns, output=None, output_dir='.', manifest_dir=None):
+    """Connect to RADCOM and download files matching the given names/globs"""
+    r.verbose = False
+    async with r:
+        filenames = await expand(r, patterns)
+        if output is not None and len(filenames) == 1:
+            paths = [output]
+        else:
+            paths = [default_path(f, output_dir) for f in filenames]
+        return await download_many(r, filenames, paths, manifest_dir)
+
+
+def down_file(args):
+    """Argparse entry point for `download` command"""
+    r = RADCOM(args.host, args.port)
+    try:
+        downloads = asyncio.run(down_client(
+            r, args.downfile, args.output, args.output_dir, args.manifest_dir
+        ))
+    except DownloadAborted as e:
+        log.error(f'Download aborted: {e}')
+        sys.exit(1)
+    except (FileNotFoundError, TimeoutError, ConnectionRefusedError) as e:
+        log.error(f'Download failed: {e}')
+        sys.exit(1)
+    report(downloads)
+    for d in downloads:
+        print(f'Saved {d.filename} to {d.path} (blake2b {d.digest})')
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import tempfile
+import zipfile
+
+from rosen.axe import AXE
+from rosen.icomm import ICOMM
+from rosen.packetlog import decode_chunks
+from rosen.common import flatten
+
+log = logging.getLogger('rosen')
+
+def _import_numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError(
+            "Exporting telemetry requires numpy.  Install with `pip install rosen[export]`"
+        ) from None
+    return np
+
+# value dtypes in order of promotion
+kinds = ('?', '<i8', '<f8')
+
+def _kind(value):
+    """Narrowest dtype which can hold a value, or None for non-numeric values"""
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, int):
+        return 1 if -2**63 <= value < 2**63 else 2
+    if isinstance(value, float):
+        return 2
+    return None
+
+
+def _variables(record):
+    """Flattened (device, key, value) AXE variables of a LogRecord.  Runs in
+    decoder worker processes"""
+    packet = record.packet
+    if isinstance(packet, bytes) or not isinstance(packet.packet, ICOMM):
+        return []
+    icomm = packet.packet
+    if not isinstance(icomm.payload, AXE) or not isinstance(icomm.payload.data, dict):
+        return []
+    return [(icomm.frm, k, v) for k, v in flatten(icomm.payload.data)]
+
+
+class _Column:
+    """Time series of one device variable, buffered to a temporary file of
+    raw records until the total length is known"""
+
+    def __init__(self, np, path):
+        self.np = np
+        self.path = path
+        self.kind = None
+        self.length = 0
+
+    def dtype(self, kind=None):
+        kind = self.kind if kind is None else kind
+        return self.np.dtype([('time', '<f8'), ('value', kinds[kind])])
+
+    def append(self, times, values, kind, chunk):
+        """Append a batch of samples, promoting the stored values if needed"""
+        if self.kind is not None and kind > self.kind:
+            self._promote(kind, chunk)
+        self.kind = max(kind, self.kind or 0)
+        batch = self.np.empty(len(times), self.dtype())
+        batch['time'], batch['value'] = times, values
+        with open(self.path, 'ab') as f:
+            batch.tofile(f)
+        self.length += len(times)
+
+    def _promote(self, kind, chunk):
+        old, new = self.dtype(), self.dtype(kind)
+        tmp = self.path + '.promote'
+        with open(self.path, 'rb') as src, open(tmp, 'wb') as dst:
+            while len(batch := self.np.fromfile(src, old, count=chunk)):
+                batch.astype(new).tofile(dst)
+        os.replace(tmp, self.path)
+        self.kind = kind
+
+    def write(self, f, chunk):
+        """Write the column as a .npy file to an open file object"""
+        self.np.lib.format.write_array_header_1_0(f, {
+            'descr': self.np.lib.format.dtype_to_descr(self.dtype()),
+            'fortran_order': False,
+            'shape': (self.length,),
+        })
+        with open(self.path, 'rb') as src:
+            while data := src.read(chunk * self.dtype().itemsize):
+                f.write(data)
+
+
+def export(log_paths, output, chunk=4096, keys=None, workers=None):
+    """Export AXE telemetry from packet logs to one NumPy array per variable
+
+    Every numeric AXE variable reported by a device becomes a structured array
+    of `time` (float64 unix time, NaN for raw frame files) and `value` (bool,
+    int64 or float64, promoted as needed) samples.  Logs are decoded in
+    batches of `chunk` packets across `workers` processes (see
+    `decode_chunks`), so memory use doesn't grow with log size.
+
+    If `output` ends in .npz, the arrays are written to a single archive.
+    Otherwise `output` is a directory of <device>.<key>.npy files, which can
+    be opened with `np.load(path, mmap_mode='r')`.
+
+    Args:
+        log_paths (list of str): packet logs or raw frame files, in time order
+        output (str): output directory or .npz file
+        chunk (int): packets decoded per batch
+        keys (list of str or None): only export these flattened AXE keys
+        workers (int or None): decoder processes.  Defaults to the number of CPUs
+
+    Returns:
+        dict: number of samples exported for each '<device>.<key>'
+    """
+    np = _import_numpy()
+    columns = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in log_paths:
+            for records in decode_chunks(path, workers, chunk, _variables):
+                batch = {}
+                for t, _, variables in records:
+                    t = float('nan') if t is None else t
+                    for device, key, value in variables:
+                        if keys is not None and key not in keys:
+                            continue
+                        if (kind := _kind(value)) is None:
+                            log.debug(f"Skipping non-numeric {device}.{key}={value!r}")
+                            continue
+                        times, values, kind_max = batch.get(f'{device}.{key}', ([], [], 0))
+                        times.append(t)
+                        values.append(value)
+                        batch[f'{device}.{key}'] = (times, values, max(kind, kind_max))
+
+                for name, (times, values, kind) in batch.items():
+                    if name not in columns:
+                        columns[name] = _Column(np, os.path.join(tmp, f'{len(columns)}.part'))
+                    columns[name].append(times, values, kind, chunk)
+
+        if output.endswith('.npz'):
+            with zipfile.ZipFile(output, 'w', allowZip64=True) as z:
+                for name, column in columns.items():
+                    with z.open(f'{name}.npy', 'w', force_zip64=True) as f:
+                        column.write(f, chunk)
+        else:
+            os.makedirs(output, exist_ok=True)
+            for name, column in columns.items():
+                with open(os.path.join(output, f'{name}.npy'), 'wb') as f:
+                    column.write(f, chunk)
+
+    return {name: column.length for name, column in columns.items()}
+
+
+def export_telemetry(args):
+    """Argparse entry point for `export` command"""
+    counts = export(args.logs, args.output, args.chunk, args.key, args.workers)
+    for name, n in sorted(counts.items()):
+        print(f'{name}: {n} samples')
+    print(f'Exported {len(counts)} variables to {args.output}')
@@ -71,7 +71,9 @@ class GCOMM(Packet):
             m=self.m,
             offset=self.offset, addr=self.addr, time=self.time, errcode=self.errcode,
             errstr=self.errstr,
-            packet=self.packet.build() if self.packet else None
+            # packets which failed to parse are kept as raw bytes
+            packet=self.packet if isinstance(self.packet, bytes) else
+                self.packet.build() if self.packet else None
         ))
 
     @classmethod
@@ -175,9 +177,15 @@ class GCOMMScript(Script):
         """Generate GCOMM EXEC_FILE command """
         self.script.append(GCOMM('exec_file', filename=filename))
 
-    def down_file(self, filename):
-        """Generate GCOMM DOWN_FILE command """
-        self.script.append(GCOMM('down_file', filename=filename))
+    def down_file(self, filename, n=0, m=0):
+        """Generate GCOMM DOWN_FILE command
+
+        Args:
+            filename (str): file to download
+            n (int): if nonzero, only download records n through m
+            m (int): last record to download when n is nonzero
+        """
+        self.script.append(GCOMM('down_file', filename=filename, n=n, m=m))
 
     def list_sd(self):
         """Generate GCOMM LIST_SD command """
@@ -262,6 +270,17 @@ class GCOMMScript(Script):
         with open(filename, 'wb') as f:
             pickle.dump(self, f)
 
+    def compile(self, filename):
+        """Save GCOMM script as contiguous built GCOMM frames, suitable for bulk
+        sending with `rosen run --bulk`
+
+        Args:
+            filename (str): file to output to
+        """
+        with open(filename, 'wb') as f:
+            for g in self.script:
+                f.write(g.build())
+
     @classmethod
     def load(cls, filename):
         with open(filename, 'rb') as f:
@@ -13,6 +13,9 @@ def sdcard(*args):
     elif args[0] == 'list':
         return GCOMM('list_sd')
     elif args[0] == 'down':
+        # optional range of records to download
+        if len(args) > 3:
+            return GCOMM('down_file', filename=args[1], n=int(args[2]), m=int(args[3]))
         return GCOMM('down_file', filename=args[1])
     elif args[0] == 'rm':
         return GCOMM('rm_file', filename=args[1])
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+import asyncio
+from dataclasses import dataclass
+import logging
+import random
+from rich.console import Console
+from rich.table import Table
+
+from rosen.gcomm import GCOMM
+from rosen.icomm import ICOMM
+from rosen.server import LinkConfig
+
+log = logging.getLogger('rosen')
+
+# first bytes of GCOMM frames which carry an ICOMM packet
+icomm_cmds = {GCOMM(cmd).build()[0] for cmd in ('exec_now', 'app_file')}
+# the ICOMM packet is the last field of a GCOMM frame
+icomm_offset = GCOMM.size - ICOMM.size
+
+def checked_bytes(frame):
+    """Range of a frame which parsing depends on, rather than padding: the
+    ICOMM body and CRC of frames which carry one, else the GCOMM header
+
+    Returns:
+        tuple: (start, end) byte offsets
+    """
+    if frame[0] not in icomm_cmds:
+        return 0, icomm_offset
+    # size, cmd, to, frm, last, seq, n, m, then the AXE payload and CRC32
+    size = int.from_bytes(frame[icomm_offset:icomm_offset + 2], 'big')
+    return icomm_offset, min(icomm_offset + 9 + size + 4, len(frame))
+
+@dataclass
+class Impairment(LinkConfig):
+    """Impaired link.  See `LinkConfig` for latency, jitter, bandwidth and seed
+
+    Args:
+        drop (float): probability a frame is lost
+        corrupt (float): probability a frame has one random bit flipped.  The
+            bit is in the ICOMM body or CRC of frames which carry one, so the
+            ICOMM checksum rejects them, else in the GCOMM header
+        reorder (float): probability a frame is held back and delivered after
+            the next one
+        hold (float): max seconds a frame is held back.  If no other frame
+            arrives in that time it is delivered in order, so an idle link
+            doesn't stall
+    """
+
+    drop: float = 0
+    corrupt: float = 0
+    reorder: float = 0
+    hold: float = 0.1
+
+
+@dataclass
+class LinkCounters:
+    """Frames passed over one direction of an impaired link"""
+
+    frames: int = 0
+    dropped: int = 0
+    corrupted: int = 0
+    reordered: int = 0
+
+    def __iadd__(self, other):
+        self.frames += other.frames
+        self.dropped += other.dropped
+        self.corrupted += other.corrupted
+        self.reordered += other.reordered
+        return self
+
+
+class ImpairedLink:
+    """One direction of an impaired link, delivering GCOMM frames to a writer
+
+    Frames are dropped, corrupted and reordered at random, then delivered
+    after the link's latency and jitter at no more than its bandwidth.  With
+    the same seed the same frames are impaired each time.
+
+    Args:
+        config (Impairment): impairments
+        writer (asyncio.StreamWriter): where frames are delivered
+        seed (int or None): random seed, overriding `config.seed`
+    """
+
+    def __init__(self, config, writer, seed=None):
+        self.config, self.writer = config, writer
+        self.random = random.Random(config.seed if seed is None else seed)
+        self.counters = LinkCounters()
+        self.held = self.release = None
+        # delivery of a held frame released by `_release`
+        self.releasing = None
+        self.link_free = self.last_arrival = 0
+
+    async def feed(self, frame):
+        """Pass a frame over the link"""
+        await self._released()
+        c, rand = self.config, self.random.random
+        self.counters.frames += 1
+        if rand() < c.drop:
+            self.counters.dropped += 1
+            return
+        if rand() < c.corrupt:
+            start, end = checked_bytes(frame)
+            frame = bytearray(frame)
+            bit = self.random.randrange(start * 8, end * 8)
+            frame[bit // 8] ^= 1 << (bit % 8)
+            frame = bytes(frame)
+            self.counters.corrupted += 1
+        if self.held is not None:
+            held, self.held = self.held, None
+            self.release.cancel()
+            self.counters.reordered += 1
+            await self.deliver(frame)
+            await self.deliver(held)
+        elif rand() < c.reorder:
+            self.held = frame
+            self.release = asyncio.get_running_loop().call_later(c.hold, self._release)
+        else:
+            await self.deliver(frame)
+
+    def _release(self):
+        """Deliver a held frame which nothing overtook in time"""
+        if self.held is not None:
+            held, self.held = self.held, None
+            self.releasing = asyncio.create_task(self.deliver(held))
+
+    async def _released(self):
+        """Wait until a released frame has been delivered, so frames fed
+        later can't overtake it"""
+        if self.releasing is not None:
+            await self.releasing
+            self.releasing = None
+
+    async def deliver(self, frame):
+        c = self.config
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, self.link_free)
+        if c.bandwidth:
+            start += len(frame) / c.bandwidth
+            # don't queue more than a second of frames
+            if start - now > 1:
+                await asyncio.sleep(start - now - 1)
+        self.link_free = start
+        arrival = start + c.latency + self.random.uniform(0, c.jitter)
+        self.last_arrival = arrival = max(arrival, self.last_arrival)
+        if arrival <= now:
+            self.writer.write(frame)
+        else:
+            loop.call_at(arrival, self._write, frame)
+
+    def _write(self, frame):
+        if not self.writer.is_closing():
+            self.writer.write(frame)
+
+    async def close(self):
+        """Deliver any held frame, wait for frames in flight, then close the writer"""
+        await self._released()
+        if self.held is not None:
+            held, self.held = self.held, None
+            self.release.cancel()
+            await self.deliver(held)
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(max(self.last_arrival - loop.time(), 0))
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+class LinkProxy:
+    """TCP proxy which passes GCOMM frames between clients and a RADCOM (or
+    `rosen server`) over impaired links
+
+    Args:
+        host (str): RADCOM host
+        port (int): RADCOM port
+        uplink (Impairment): impairments of frames sent to RADCOM
+        downlink (Impairment): impairments of frames sent to clients
+
+    Attributes:
+        uplink_counters, downlink_counters (LinkCounters): totals over all
+            connections
+    """
+
+    def __init__(self, host, port, uplink=None, downlink=None):
+        self.host, self.port = host, port
+        self.uplink = Impairment() if uplink is None else uplink
+        self.downlink = Impairment() if downlink is None else downlink
+        self.uplink_counters, self.downlink_counters = LinkCounters(), LinkCounters()
+
+    async def handle_client(self, reader, writer):
+        try:
+            radcom_reader, radcom_writer = await asyncio.open_connection(self.host, self.port)
+        except ConnectionError:
+            log.error(f"Couldn't connect to {self.host}:{self.port}")
+            writer.close()
+            return
+        up = ImpairedLink(self.uplink, radcom_writer)
+        # don't impair both directions identically
+        down = ImpairedLink(
+            self.downlink, writer,
+            None if self.downlink.seed is None else self.downlink.seed + 1
+        )
+        await asyncio.gather(self.pump(reader, up), self.pump(radcom_reader, down))
+        self.uplink_counters += up.counters
+        self.downlink_counters += down.counters
+
+    @staticmethod
+    async def pump(reader, link):
+        """Pass frames from a reader over a link until the reader closes"""
+        try:
+            while True:
+                await link.feed(await reader.readexactly(GCOMM.size))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            await link.close()
+
+
+def report(proxy):
+    """Print a table of frames impaired in each direction"""
+    table = Table("Direction", "Frames", "Dropped", "Corrupted", "Reordered", title="Link Summary")
+    for name, c in (('uplink', proxy.uplink_counters), ('downlink', proxy.downlink_counters)):
+        table.add_row(name, str(c.frames), str(c.dropped), str(c.corrupted), str(c.reordered))
+    Console().print(table)
+
+async def run_link(proxy, host, port):
+    server = await asyncio.start_server(proxy.handle_client, host, port)
+    print(f"Forwarding {host} {port} to {proxy.host} {proxy.port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        report(proxy)
+
+def link(args):
+    """Argparse entry point for `link` command"""
+    config = Impairment.load(
+        args.config, latency=args.latency, jitter=args.jitter,
+        bandwidth=args.bandwidth, seed=args.seed, drop=args.drop,
+        corrupt=args.corrupt, reorder=args.reorder, hold=args.hold,
+    )
+    proxy = LinkProxy(
+        args.host, args.port,
+        uplink=config if args.direction in ('both', 'uplink') else Impairment(),
+        downlink=config if args.direction in ('both', 'downlink') else Impairment(),
+    )
+    try:
+        asyncio.run(run_link(proxy, args.listen_host, args.listen_port))
+    except KeyboardInterrupt:
+        pass
@@ -5,8 +5,16 @@ import logging
 
 from rosen.client import run, shell
 from rosen.server import server
+from rosen.link import link
+from rosen.clock import timeline
+from rosen.replay import replay_cmd
+from rosen.bench import bench
 from rosen.tui import tui
 from rosen.down import down_file
+from rosen.packetlog import convertlog
+from rosen.blocklog import catlog
+from rosen.store import query
+from rosen.export import export_telemetry
 
 logging.basicConfig(format='%(asctime)s line %(lineno)d: %(message)s')
 log = logging.getLogger('rosen')
@@ -31,23 +39,122 @@ def main():
     run_parser = subparsers.add_parser('run', help="run a GCOMM script file")
     run_parser.add_argument('--loop', action='store_true', default=False, help="loop forever")
     run_parser.add_argument('script', nargs='?', metavar='PATH', type=str, default='gcomm.script', help="script path")
+    run_parser.add_argument('--endpoint', metavar='HOST:PORT', type=str, action='append', default=None, help="RADCOM to send the script to.  May be given multiple times to run on several endpoints concurrently.  Defaults to --host/--port")
+    run_parser.add_argument('--bulk', action='store_true', default=False, help="PATH is a compiled frame file (GCOMMScript.compile) to send in bulk")
+    run_parser.add_argument('--window', metavar='N', type=int, default=8, help="max frames awaiting an OK with --bulk")
+    run_parser.add_argument('--retries', metavar='N', type=int, default=None, help="give up on an endpoint after resending a packet N times")
     run_parser.set_defaults(func=run)
 
     shell_parser = subparsers.add_parser('shell', help="run GCOMM commands interactively")
     shell_parser.add_argument('--script', metavar='PATH', type=str, default=None, help='Optional Python script containing variables to be made available in the shell')
     shell_parser.set_defaults(func=shell)
 
-    server_parser = subparsers.add_parser('server', help="run a test echo server")
+    server_parser = subparsers.add_parser('server', help="run a RADCOM simulator")
+    server_parser.add_argument('--sd-dir', metavar='DIR', type=str, default=None, help='directory of frame files backing the emulated SD card.  Defaults to an in-memory card')
+    server_parser.add_argument('--config', metavar='PATH', type=str, default=None, help='JSON file of link settings (latency, jitter, bandwidth, seed).  Options below override it')
+    server_parser.add_argument('--latency', metavar='SECONDS', type=float, default=None, help='delay before each reply frame arrives')
+    server_parser.add_argument('--jitter', metavar='SECONDS', type=float, default=None, help='extra random delay of up to this much per reply frame')
+    server_parser.add_argument('--bandwidth', metavar='BYTES/S', type=float, default=None, help='link rate in each direction, per client')
+    server_parser.add_argument('--seed', metavar='N', type=int, default=None, help='random seed for jitter')
+    server_parser.add_argument('--speed', metavar='X', type=float, default=1, help='run the simulated clock (and scheduled scripts) this many times faster than real time')
+    server_parser.add_argument('--report-interval', metavar='SECONDS', type=float, default=5, help='how often to print the served frame rate')
     server_parser.set_defaults(func=server)
 
+    link_parser = subparsers.add_parser('link', help="run a proxy which impairs the link to --host/--port")
+    link_parser.add_argument('--listen-host', metavar='HOST', type=str, default='127.0.0.1', help='address clients connect to')
+    link_parser.add_argument('--listen-port', metavar='PORT', type=int, default=8001, help='port clients connect to')
+    link_parser.add_argument('--config', metavar='PATH', type=str, default=None, help='JSON file of impairments.  Options below override it')
+    link_parser.add_argument('--drop', metavar='P', type=float, default=None, help='probability a frame is lost')
+    link_parser.add_argument('--corrupt', metavar='P', type=float, default=None, help='probability a frame has a bit flipped')
+    link_parser.add_argument('--reorder', metavar='P', type=float, default=None, help='probability a frame is swapped with the next')
+    link_parser.add_argument('--hold', metavar='SECONDS', type=float, default=None, help='max time a reordered frame waits for the next one (default 0.1)')
+    link_parser.add_argument('--latency', metavar='SECONDS', type=float, default=None, help='delay of each frame')
+    link_parser.add_argument('--jitter', metavar='SECONDS', type=float, default=None, help='extra random delay of up to this much per frame')
+    link_parser.add_argument('--bandwidth', metavar='BYTES/S', type=float, default=None, help='link rate in each direction')
+    link_parser.add_argument('--seed', metavar='N', type=int, default=None, help='random seed, for repeatable impairments')
+    link_parser.add_argument('--direction', choices=('both', 'uplink', 'downlink'), default='both', help='which direction to impair')
+    link_parser.set_defaults(func=link)
+
+    timeline_parser = subparsers.add_parser('timeline', help='check the timing of scheduled scripts without waiting for them')
+    timeline_parser.add_argument('scripts', metavar='PATH', type=str, nargs='+', help='GCOMM scripts (pickled or compiled), in upload order')
+    timeline_parser.add_argument('--duration', metavar='CMD=SECONDS', type=str, nargs='+', default=None, help='how long commands keep their device busy, e.g. laser_start=30 or dcm.query=2')
+    timeline_parser.add_argument('--default-duration', metavar='SECONDS', type=float, default=1, help='duration of other commands')
+    timeline_parser.set_defaults(func=timeline)
+
+    replay_parser = subparsers.add_parser('replay', help='replay a recorded session to --host/--port, or to clients with --serve')
+    replay_parser.add_argument('log', metavar='LOG', type=str, help='binary packet log, compressed .blk packet log or raw frame file')
+    replay_parser.add_argument('--serve', action='store_true', default=False, help='act as RADCOM, replaying downlink to every client which connects')
+    replay_parser.add_argument('--listen-host', metavar='HOST', type=str, default='127.0.0.1', help='address clients connect to with --serve')
+    replay_parser.add_argument('--listen-port', metavar='PORT', type=int, default=8000, help='port clients connect to with --serve')
+    replay_parser.add_argument('--direction', choices=('rx', 'tx'), default=None, help='which recorded frames to replay.  Defaults to rx with --serve, otherwise tx')
+    replay_parser.add_argument('--speed', metavar='X', type=float, default=1, help='replay this many times faster than recorded')
+    replay_parser.add_argument('--fast', action='store_true', default=False, help='replay as fast as possible')
+    replay_parser.add_argument('--repeat', metavar='N', type=int, default=1, help='replay the session N times back to back')
+    replay_parser.set_defaults(func=replay_cmd)
+
+    bench_parser = subparsers.add_parser('bench', help='benchmark packet codecs, scripts and the link to a simulator')
+    bench_parser.add_argument('--output', metavar='PATH', type=str, default=None, help='save results to a JSON file')
+    bench_parser.add_argument('--compare', metavar='PATH', type=str, default=None, help='JSON results to compare against.  Exits with status 1 if any benchmark regressed')
+    bench_parser.add_argument('--threshold', metavar='FRACTION', type=float, default=0.1, help='slowdown counted as a regression with --compare')
+    bench_parser.add_argument('--select', metavar='GLOB', type=str, default=None, help="only report benchmarks matching this pattern, e.g. 'gcomm.*'")
+    bench_parser.add_argument('--min-time', metavar='SECONDS', type=float, default=0.2, help='min time to run each codec benchmark for')
+    bench_parser.add_argument('--repeat', metavar='N', type=int, default=3, help='runs of each benchmark, of which the best is kept')
+    bench_parser.add_argument('--script-size', metavar='N', type=int, default=1000, help='commands in the ICOMM script compiled')
+    bench_parser.add_argument('--frames', metavar='N', type=int, default=256, help='frames uploaded and downloaded')
+    bench_parser.add_argument('--window', metavar='N', type=int, default=8, help='max frames awaiting an OK while uploading')
+    bench_parser.add_argument('--endpoint', metavar='HOST:PORT', type=str, default=None, help='RADCOM or `rosen server` to measure the link to.  Defaults to a simulator run in-process')
+    bench_parser.set_defaults(func=bench)
+
     # TUI parser
     tui_parser = subparsers.add_parser('tui', help='run the rosen interactive TUI')
-    tui_parser.add_argument('--logfile', metavar='PATH', type=str, default=None, help='pkl file to log an array of packets to')
+    tui_parser.add_argument('--logfile', metavar='PATH', type=str, default=None, help='binary packet log to append sent/received packets to')
+    tui_parser.add_argument('--log-dir', metavar='DIR', type=str, default=None, help='directory for compressed packet logs, rotated daily or every 64 MiB')
+    tui_parser.add_argument('--codec', choices=('zlib', 'lzma'), default='zlib', help='compression for --log-dir')
+    tui_parser.add_argument('--db', metavar='PATH', type=str, default=None, help='telemetry database to index sent/received packets into (see `rosen query`)')
+    tui_parser.add_argument('--dedup', action='store_true', default=False, help='drop frames repeated by the link within 2 seconds')
     tui_parser.set_defaults(func=tui)
 
+    convertlog_parser = subparsers.add_parser('convertlog', help='convert a pickled packet list to a binary packet log')
+    convertlog_parser.add_argument('pickle', metavar='PKL', type=str, help='pickled list of GCOMM packets')
+    convertlog_parser.add_argument('log', metavar='LOG', type=str, help='binary packet log to append to')
+    convertlog_parser.set_defaults(func=convertlog)
+
+    query_parser = subparsers.add_parser('query', help='query the telemetry database')
+    query_parser.add_argument('db', metavar='DB', type=str, help='telemetry database')
+    query_parser.add_argument('--ingest', metavar='LOG', type=str, nargs='+', default=None, help='index binary packet logs into DB before querying')
+    query_parser.add_argument('--packets', action='store_true', default=False, help='query packets instead of AXE variables')
+    query_parser.add_argument('--key', metavar='KEY', type=str, default=None, help='AXE variable')
+    query_parser.add_argument('--pattern', action='store_true', default=False, help="--key is a glob pattern, e.g. 'temp*'")
+    query_parser.add_argument('--cmd', metavar='CMD', type=str, default=None, help='GCOMM command (with --packets)')
+    query_parser.add_argument('--to', metavar='DEVICE', type=str, default=None, help='ICOMM destination (with --packets)')
+    query_parser.add_argument('--frm', metavar='DEVICE', type=str, default=None, help='ICOMM source device')
+    query_parser.add_argument('--axe', metavar='VERB', type=str, default=None, help='AXE verb (e.g. statement)')
+    query_parser.add_argument('--since', metavar='TIME', type=str, default=None, help='earliest time (UTC if no timezone given)')
+    query_parser.add_argument('--until', metavar='TIME', type=str, default=None, help='latest time')
+    query_parser.add_argument('--agg', choices=('count', 'min', 'max', 'avg', 'sum'), default=None, help='aggregate per device and variable (only count with --packets)')
+    query_parser.add_argument('--limit', metavar='N', type=int, default=None, help='max rows to show')
+    query_parser.set_defaults(func=query)
+
+    export_parser = subparsers.add_parser('export', help='export AXE telemetry from packet logs to NumPy arrays')
+    export_parser.add_argument('logs', metavar='LOG', type=str, nargs='+', help='packet logs or frame files, in time order')
+    export_parser.add_argument('--output', metavar='PATH', type=str, default='telemetry', help='directory of .npy files, or a .npz file')
+    export_parser.add_argument('--key', metavar='KEY', type=str, nargs='+', default=None, help='only export these AXE variables')
+    export_parser.add_argument('--chunk', metavar='N', type=int, default=4096, help='packets decoded per batch')
+    export_parser.add_argument('--workers', metavar='N', type=int, default=None, help='decoder processes.  Defaults to the number of CPUs')
+    export_parser.set_defaults(func=export_telemetry)
+
+    catlog_parser = subparsers.add_parser('catlog', help='print a time range of compressed packet/text logs')
+    catlog_parser.add_argument('logs', metavar='LOG', type=str, nargs='+', help='compressed .blk logs')
+    catlog_parser.add_argument('--since', metavar='TIME', type=str, default=None, help='earliest time (UTC if no timezone given)')
+    catlog_parser.add_argument('--until', metavar='TIME', type=str, default=None, help='latest time')
+    catlog_parser.set_defaults(func=catlog)
+
     # Download parser
     down_parser = subparsers.add_parser('download', help='Download a file from SEAQUE')
-    down_parser.add_argument('--downfile', metavar='PATH', type=str, default='down.bin', help='Name of file to download')
+    down_parser.add_argument('--downfile', metavar='PATH', type=str, nargs='+', default=['down.bin'], help='Names or glob patterns (matched against list_sd) of files to download')
+    down_parser.add_argument('--output', metavar='PATH', type=str, default=None, help='File to write received frames to when downloading a single file.  Defaults to <time>-<downfile>.frames')
+    down_parser.add_argument('--output-dir', metavar='DIR', type=str, default='.', help='Directory to write downloaded files to')
+    down_parser.add_argument('--manifest-dir', metavar='DIR', type=str, default=None, help='Directory of known-good <downfile>.manifest files to verify downloads against')
     down_parser.set_defaults(func=down_file)
 
     args = parser.parse_args()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import asyncio
+from dataclasses import dataclass, field
+import time
+
+from rosen.axe import AXE
+from rosen.icomm import ICOMM
+
+@dataclass
+class Rule:
+    """Alert when an AXE variable reported by a payload enters a range
+
+    Args:
+        key (str): AXE data key to check
+        low (float): alert when `low <= value < high`
+        high (float): alert when `low <= value < high`
+        severity (str): 'warning' or 'critical'
+        message (str): alert text.  `{device}`, `{key}` and `{value}` are filled in
+        device (str or None): only check packets from this device
+        abort (bool): whether an alert from this rule should abort the
+            current operation (e.g. a download)
+    """
+
+    key: str
+    low: float = float('-inf')
+    high: float = float('inf')
+    severity: str = 'warning'
+    message: str = '{device} reported {key}={value}'
+    device: str = None
+    abort: bool = False
+
+    def matches(self, device, value):
+        if self.device is not None and device != self.device:
+            return False
+        try:
+            return self.low <= value < self.high
+        except TypeError:
+            return False
+
+
+@dataclass
+class Alert:
+    """A rule which was triggered by a received packet"""
+
+    rule: Rule
+    device: str
+    value: object
+    time: float = field(default_factory=time.time)
+
+    def __str__(self):
+        return self.rule.message.format(
+            device=self.device, key=self.rule.key, value=self.value
+        )
+
+
+def default_rules():
+    """Payload error register thresholds from the SEAQUE team
+
+    Returns:
+        list of Rule
+    """
+    return [
+        Rule(
+            'error_reg', 200, 300, 'warning',
+            'Non-critical error {value} reported by payload, alert SEAQUE team.'
+        ),
+        Rule(
+            'error_reg', 300, severity='critical', abort=True,
+            message='Critical error {value} reported by payload, alert SEAQUE team. DO NOT proceed with upload.'
+        ),
+    ]
+
+
+class Monitor:
+    """Packet listener which checks every AXE payload against alert rules as
+    it is received
+
+    Each rule alerts once per device the first time it triggers.  Later
+    triggers are only counted.
+
+    Args:
+        rules (list of Rule): rules to check.  Defaults to `default_rules()`
+        on_alert (callable): called with each new Alert.  Defaults to printing it
+
+    Attributes:
+        alerts (list of Alert): alerts raised so far
+        counts (dict): number of times each (rule, device) has triggered
+        maxima (dict): largest numeric value seen for each checked key
+        aborted (asyncio.Event): set when a rule with `abort` triggers
+    """
+
+    def __init__(self, rules=None, on_alert=None):
+        self.rules = default_rules() if rules is None else rules
+        self.on_alert = on_alert or self.print_alert
+        self.alerts = []
+        self.counts = {}
+        self.maxima = {}
+        self.aborted = asyncio.Event()
+
+    def __call__(self, packet, frame=None):
+        if isinstance(packet.packet, ICOMM) and isinstance(packet.packet.payload, AXE):
+            self.check(packet.packet.frm, packet.packet.payload)
+
+    def check(self, device, axe):
+        """Check the data of one AXE payload against the rules
+
+        Args:
+            device (str): device which sent the payload
+            axe (AXE): payload
+        """
+        if not isinstance(axe.data, dict):
+            return
+        for key in {r.key for r in self.rules}.intersection(axe.data):
+            value = axe.data[key]
+            if isinstance(value, (int, float)) and value > self.maxima.get(key, value - 1):
+                self.maxima[key] = value
+            for i, rule in enumerate(self.rules):
+                if rule.key != key or not rule.matches(device, value):
+                    continue
+                count = self.counts.get((i, device), 0)
+                self.counts[(i, device)] = count + 1
+                if count == 0:
+                    alert = Alert(rule, device, value)
+                    self.alerts.append(alert)
+                    self.on_alert(alert)
+                if rule.abort:
+                    self.aborted.set()
+
+    @staticmethod
+    def print_alert(alert):
+        print(f'\n{alert}')
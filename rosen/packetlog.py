@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from construct import Struct, Const, Int8ub, Float64b, Mapping, Byte, Bytes
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+from rosen.common import handle_time
+from rosen.gcomm import GCOMM
+
+# ----- Binary Log Format -----
+# A header followed by fixed size records, one per packet
+
+log_header = Struct(
+    "magic" / Const(b'ROSENLOG'),
+    "version" / Const(1, Int8ub),
+)
+
+log_record = Struct(
+    # unix time packet was sent/received
+    "time" / Float64b,
+    "direction" / Mapping(Byte, {'rx': 0, 'tx': 1}),
+    # raw GCOMM frame
+    "frame" / Bytes(GCOMM.size),
+)
+
+class PacketLogWriter:
+    """Append-only binary packet log
+
+    Each packet costs one buffered write.  The log is flushed and fsynced
+    every `sync_every` packets or `sync_interval` seconds, whichever is first.
+    A timer syncs the last packets written even if no more arrive.  Safe to
+    write to from multiple threads.
+
+    Can be used as a RADCOM packet listener to log received packets.
+
+    Args:
+        path (str): log file.  New packets are appended if it exists
+        sync_every (int): max packets between fsyncs
+        sync_interval (float): max seconds between fsyncs
+    """
+
+    def __init__(self, path, sync_every=64, sync_interval=1):
+        self.path = path
+        self.sync_every, self.sync_interval = sync_every, sync_interval
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.last_sync = time.time()
+        self.timer = None
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                log_header.parse(f.read(log_header.sizeof()))
+            self.file = open(path, 'ab')
+            # drop a partial record left by a crash
+            excess = (os.path.getsize(path) - log_header.sizeof()) % log_record.sizeof()
+            if excess:
+                self.file.truncate(os.path.getsize(path) - excess)
+        else:
+            self.file = open(path, 'ab')
+            self.file.write(log_header.build({}))
+
+    def __call__(self, packet, frame):
+        self.write(frame, 'rx')
+
+    def write(self, frame, direction='rx', t=None):
+        """Append a packet to the log
+
+        Args:
+            frame (bytes): raw GCOMM frame
+            direction (str): 'rx' for received packets, 'tx' for sent packets
+            t (float): unix time of packet.  Defaults to now
+        """
+        record = log_record.build(dict(
+            time=time.time() if t is None else t, direction=direction, frame=frame
+        ))
+        with self.lock:
+            self.file.write(record)
+            self.unsynced += 1
+            if (self.unsynced >= self.sync_every
+                    or time.time() - self.last_sync >= self.sync_interval):
+                self._sync()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.sync_interval, self._timed_sync)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _timed_sync(self):
+        with self.lock:
+            self.timer = None
+            if self.unsynced and not self.file.closed:
+                self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def sync(self):
+        """Flush buffered packets to disk"""
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.file.closed:
+                self._sync()
+                self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_log(path, parse=True):
+    """Replay a binary packet log
+
+    Args:
+        path (str): log file
+        parse (bool): yield parsed GCOMM packets instead of raw frames.  Frames
+            which fail to parse are yielded as bytes
+
+    Yields:
+        tuple: (time, direction, packet) for each logged packet
+    """
+    with open(path, 'rb') as f:
+        log_header.parse(f.read(log_header.sizeof()))
+        while len(raw := f.read(log_record.sizeof())) == log_record.sizeof():
+            r = log_record.parse(raw)
+            packet = r.frame
+            if parse:
+                try:
+                    packet = GCOMM.parse(r.frame)
+                except Exception:
+                    pass
+            yield r.time, r.direction, packet
+
+
+class LogRecord:
+    """One packet in a PacketLog.  The GCOMM frame is only parsed when
+    `packet` is first accessed
+
+    Attributes:
+        time (float or None): unix time of packet, None for raw frame files
+        direction (str): 'rx' or 'tx'
+        frame (bytes): raw GCOMM frame
+    """
+
+    __slots__ = ('time', 'direction', 'frame', '_packet')
+
+    def __init__(self, time, direction, frame):
+        self.time, self.direction, self.frame = time, direction, frame
+        self._packet = None
+
+    @property
+    def packet(self):
+        """Parsed GCOMM packet, or the raw frame if it fails to parse"""
+        if self._packet is None:
+            try:
+                self._packet = GCOMM.parse(self.frame)
+            except Exception:
+                self._packet = self.frame
+        return self._packet
+
+    def __repr__(self):
+        return f"LogRecord({self.time}, {self.direction}, {self.packet})"
+
+
+class PacketLog:
+    """Memory-mapped random access reader for binary packet logs
+
+    Also reads raw frame files (`GCOMMScript.compile`, `rosen download`) which
+    have no header or timestamps.  Records are only decoded when accessed, so
+    logs much larger than memory can be inspected.
+
+    Time lookups assume records were logged in time order and use a sparse
+    index of every `index_every`-th timestamp, built on first use.
+
+        log = PacketLog('session.log')
+        len(log)
+        log[-1].packet
+        for rec in log.between('2024-06-01 12:00', '2024-06-01 13:00'): ...
+
+    Args:
+        path (str): log file
+        index_every (int): records between sparse time index entries
+    """
+
+    def __init__(self, path, index_every=1024):
+        self.path = path
+        self.index_every = index_every
+        self._index = None
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        header = log_header.build({})
+        if self.mm[:len(header)] == header:
+            self.start = len(header)
+            self.record_size = log_record.sizeof()
+            self.timestamped = True
+        else:
+            self.start = 0
+            self.record_size = GCOMM.size
+            self.timestamped = False
+        # ignore a torn trailing record
+        self.length = (size - self.start) // self.record_size
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.length))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("log record index out of range")
+        offset = self.start + i * self.record_size
+        if not self.timestamped:
+            return LogRecord(None, 'rx', self.mm[offset:offset + GCOMM.size])
+        t, d = struct.unpack_from('>dB', self.mm, offset)
+        offset += log_record.sizeof() - GCOMM.size
+        return LogRecord(t, 'tx' if d else 'rx', self.mm[offset:offset + GCOMM.size])
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self[i]
+
+    def time(self, i):
+        """Timestamp of record i, without reading the frame"""
+        return struct.unpack_from('>d', self.mm, self.start + i * self.record_size)[0]
+
+    def bisect(self, t):
+        """Index of the first record logged at or after time `t`
+
+        Args:
+            t (float, str or datetime.datetime): time, see `handle_time`
+        """
+        assert self.timestamped, "Raw frame files have no timestamps"
+        if not isinstance(t, float):
+            t = handle_time(t)
+        if self._index is None:
+            self._index = [self.time(i) for i in range(0, self.length, self.index_every)]
+        # find the block containing t, then scan it
+        block = max(bisect_left(self._index, t) - 1, 0)
+        i = block * self.index_every
+        while i < self.length and self.time(i) < t:
+            i += 1
+        return i
+
+    def between(self, start=None, end=None):
+        """Iterate over records logged in the time range [start, end)
+
+        Args:
+            start (float, str or datetime.datetime): start time, or None for the
+                beginning of the log
+            end (float, str or datetime.datetime): end time, or None for the end
+                of the log
+
+        Yields:
+            LogRecord
+        """
+        a = 0 if start is None else self.bisect(start)
+        b = self.length if end is None else self.bisect(end)
+        for i in range(a, b):
+            yield self[i]
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _decode_range(path, start, stop, func):
+    """Decode records [start, stop) of a log.  Runs in a worker process"""
+    with PacketLog(path) as log:
+        out = []
+        for i in range(start, stop):
+            r = log[i]
+            out.append((r.time, r.direction, r.packet if func is None else func(r)))
+        return out
+
+def decode_chunks(path, workers=None, chunk=4096, func=None, start=0):
+    """Decode a packet log or raw frame file in parallel
+
+    Records are fixed size, so the log is split into frame-aligned chunks of
+    `chunk` records with no scanning.  Each worker process maps the file and
+    decodes its own chunks.  Only a few chunks per worker are in flight at
+    once, so memory use doesn't grow with log size.
+
+    Args:
+        path (str): log file
+        workers (int or None): worker processes.  Defaults to the number of
+            CPUs.  With 1 worker, or a log of one chunk, decoding is done in
+            this process
+        chunk (int): records per chunk
+        func (callable or None): picklable function applied to each LogRecord in
+            the worker, whose result is returned in place of the parsed packet.
+            Useful to reduce what is sent back from workers
+        start (int): index of the first record to decode
+
+    Yields:
+        list of tuple: (time, direction, packet) for each record of a chunk,
+            chunks in log order
+    """
+    with PacketLog(path) as log:
+        length = len(log)
+    ranges = [(a, min(a + chunk, length)) for a in range(start, length, chunk)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(ranges) <= 1:
+        for a, b in ranges:
+            yield _decode_range(path, a, b, func)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        ranges = iter(ranges)
+        for a, b in ranges:
+            pending.append(pool.submit(_decode_range, path, a, b, func))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            yield pending.popleft().result()
+            for a, b in ranges:
+                pending.append(pool.submit(_decode_range, path, a, b, func))
+                break
+
+def decode(path, workers=None, chunk=4096, func=None, start=0):
+    """Decode a packet log in parallel, see `decode_chunks`
+
+    Yields:
+        tuple: (time, direction, packet) for each record, in log order
+    """
+    for records in decode_chunks(path, workers, chunk, func, start):
+        yield from records
+
+
+def convert_pickle(pkl_path, log_path):
+    """Convert a pickled list of GCOMM packets (old `tui --logfile` and
+    `download` output) to a binary packet log
+
+    Pickles don't record when packets arrived, so every packet is given the
+    pickle's modification time and marked as received.
+
+    Args:
+        pkl_path (str): pickle file
+        log_path (str): binary log to append to
+
+    Returns:
+        int: number of packets converted
+    """
+    with open(pkl_path, 'rb') as f:
+        packets = pickle.load(f)
+    t = os.path.getmtime(pkl_path)
+    with PacketLogWriter(log_path) as w:
+        for packet in packets:
+            w.write(packet.build(), 'rx', t)
+    return len(packets)
+
+
+def convertlog(args):
+    """Argparse entry point for `convertlog` command"""
+    n = convert_pickle(args.pickle, args.log)
+    print(f'Converted {n} packets to {args.log}')
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import math
+import os
+from rich.console import Console
+from rich.table import Table
+
+from rosen.common import handle_time
+from rosen.gcomm import GCOMM, GCOMMScript
+
+@dataclass
+class Pass:
+    """A contact window with SEAQUE
+
+    Args:
+        start (float, str or datetime): start of the pass.  See `handle_time`
+        end (float, str or datetime): end of the pass
+        rate (float): uplink rate in bytes/s
+        rtt (float): round trip time in seconds
+    """
+
+    start: float
+    end: float
+    rate: float
+    rtt: float = 1
+
+    def __post_init__(self):
+        self.start, self.end = _unix(self.start), _unix(self.end)
+
+    def frame_time(self, window=8):
+        """Seconds per uplinked frame, limited by the link rate or by waiting for
+        OKs with `window` frames outstanding"""
+        return max(GCOMM.size / self.rate, self.rtt / window)
+
+    def capacity(self, window=8):
+        """Number of frames which fit in the pass, after connecting (one RTT)"""
+        return max(math.floor((self.end - self.start - self.rtt) / self.frame_time(window)), 0)
+
+
+@dataclass
+class Upload:
+    """An ICOMMScript to be on the SD card before it runs at `time`
+
+    Args:
+        time (float, str or datetime): when the script runs.  See `handle_time`
+        script (ICOMMScript): script to upload
+    """
+
+    time: int
+    script: object = field(repr=False)
+
+    def __post_init__(self):
+        self.time = int(_unix(self.time))
+
+    @property
+    def filename(self):
+        return '!' + str(self.time)
+
+    @property
+    def frames(self):
+        return len(self.script.script)
+
+
+@dataclass
+class PassPlan:
+    """Frames uplinked in one pass"""
+
+    contact: Pass
+    script: GCOMMScript
+    capacity: int
+
+    @property
+    def utilization(self):
+        return len(self.script.script) / self.capacity if self.capacity else 0
+
+
+@dataclass
+class Plan:
+    """Uploads assigned to passes
+
+    Attributes:
+        passes (list of PassPlan): one GCOMM script of `app_file` frames per pass
+        unscheduled (list of Upload): uploads which can't reach the SD card
+            before they run
+    """
+
+    passes: list
+    unscheduled: list
+
+    def compile(self, directory):
+        """Write the frames of each pass to `<directory>/pass_<n>.frames` for
+        `rosen run --bulk`
+
+        Returns:
+            list of str: paths written
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for n, p in enumerate(self.passes, start=1):
+            path = os.path.join(directory, f'pass_{n}.frames')
+            p.script.compile(path)
+            paths.append(path)
+        return paths
+
+    def report(self):
+        fmt = lambda t: datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        table = Table('Pass', 'Start', 'End', 'Frames', 'Capacity', 'Utilization', 'Files', title='Uplink Plan')
+        for n, p in enumerate(self.passes, start=1):
+            files = sorted({g.filename for g in p.script.script})
+            table.add_row(
+                str(n), fmt(p.contact.start), fmt(p.contact.end),
+                str(len(p.script.script)), str(p.capacity),
+                f'{p.utilization:.0%}', ' '.join(files)
+            )
+        console = Console()
+        console.print(table)
+        for u in self.unscheduled:
+            console.print(f'[red]Can\'t upload {u.filename} ({u.frames} frames) before {fmt(u.time)}')
+
+
+def _unix(t):
+    return t if isinstance(t, float) else float(handle_time(t))
+
+def _assign(passes, uploads, window):
+    """Earliest deadline first assignment of upload frames to passes
+
+    Returns:
+        tuple: (list of list of (Upload, n) per pass, list of Uploads which
+            missed their deadline)
+    """
+    remaining = {id(u): u.frames for u in uploads}
+    assigned = []
+    for p in passes:
+        frames = []
+        t = p.start + p.rtt
+        dt = p.frame_time(window)
+        capacity = p.capacity(window)
+        for u in sorted(uploads, key=lambda u: u.time):
+            while remaining[id(u)] and len(frames) < capacity and t + dt <= u.time:
+                n = u.frames - remaining[id(u)] + 1
+                frames.append((u, n))
+                remaining[id(u)] -= 1
+                t += dt
+        assigned.append(frames)
+    missed = [u for u in uploads if remaining[id(u)]]
+    return assigned, missed
+
+def plan(passes, uploads, window=8):
+    """Fit script uploads into contact windows
+
+    Frames are packed into passes in time order, earliest deadline first, so
+    each pass is filled as far as deadlines allow.  A script may be split
+    across passes.  If some script can't be fully uploaded before it runs, the
+    one with the latest deadline among those is dropped and the rest are
+    replanned, so no capacity is spent on partial uploads.
+
+        p = plan(
+            [Pass('2024-06-01 10:00', '2024-06-01 10:08', rate=1200, rtt=0.5), ...],
+            [Upload('2024-06-01 12:00', i1), Upload('2024-06-02 00:00', i2)],
+        )
+        p.report()
+        p.compile('passes/')
+
+    Args:
+        passes (list of Pass): contact windows
+        uploads (list of Upload): scripts to upload
+        window (int): frames sent before waiting for OKs (see `rosen run --window`)
+
+    Returns:
+        Plan
+
+    Raises:
+        ValueError: two uploads run at the same time, so would be written to
+            the same file
+    """
+    filenames = [u.filename for u in uploads]
+    duplicates = sorted({f for f in filenames if filenames.count(f) > 1})
+    if duplicates:
+        raise ValueError(f"Several uploads run at the same time: {', '.join(duplicates)}")
+    passes = sorted(passes, key=lambda p: p.start)
+    uploads = [u for u in uploads if u.frames]
+    unscheduled = []
+    while True:
+        assigned, missed = _assign(passes, uploads, window)
+        if not missed:
+            break
+        drop = max(missed, key=lambda u: u.time)
+        uploads.remove(drop)
+        unscheduled.append(drop)
+
+    plans = []
+    for p, frames in zip(passes, assigned):
+        g = GCOMMScript(f'pass {p.start}')
+        for u, n in frames:
+            offset, icomm = u.script.script[n - 1]
+            g.app_file(u.filename, n, u.frames, offset, icomm)
+        plans.append(PassPlan(p, g, p.capacity(window)))
+    return Plan(plans, unscheduled)
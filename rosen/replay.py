@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import asyncio
+from dataclasses import dataclass, field
+import logging
+import time
+
+from rosen.blocklog import BlockLog
+from rosen.client import RADCOM
+from rosen.packetlog import PacketLog
+
+log = logging.getLogger('rosen')
+
+def read_frames(path, direction=None):
+    """Read the frames of a recorded session
+
+    Args:
+        path (str): binary packet log, compressed .blk packet log or raw frame file
+        direction (str or None): only read 'rx' or 'tx' frames.  Raw frame files
+            have no directions, so all their frames are read
+
+    Yields:
+        tuple: (time or None, frame)
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(8)
+    if magic == b'ROSENBLK':
+        with BlockLog(path) as blk:
+            for t, d, frame in blk.between(parse=False):
+                if direction is None or d == direction:
+                    yield t, frame
+        return
+    with PacketLog(path) as packet_log:
+        for r in packet_log:
+            if direction is None or not packet_log.timestamped or r.direction == direction:
+                yield r.time, r.frame
+
+
+@dataclass
+class ReplayStats:
+    """Frames replayed to one peer"""
+
+    peer: str
+    frames: int = 0
+    bytes: int = 0
+    start: float = field(default_factory=time.monotonic)
+    elapsed: float = 0
+
+    def __str__(self):
+        rate = self.frames / self.elapsed if self.elapsed else 0
+        return (
+            f'{self.peer}: replayed {self.frames} frames in {self.elapsed:.2f}s '
+            f'({rate:.1f} frames/s, {rate * self.bytes / max(self.frames, 1) / 1e6:.2f} MB/s)'
+        )
+
+
+async def load_frames(path, direction=None):
+    """Read the frames of a recorded session in a thread, so block logs are
+    decompressed without blocking the event loop
+
+    Returns:
+        list of tuple: (time or None, frame), see `read_frames`
+    """
+    return await asyncio.to_thread(lambda: list(read_frames(path, direction)))
+
+async def replay(writer, frames, speed=1, repeat=1, stats=None):
+    """Write the frames of a recorded session to a stream
+
+    Args:
+        writer (asyncio.StreamWriter): where to write frames
+        frames (list of tuple): (time, frame) pairs, see `load_frames`
+        speed (float or None): replay this many times faster than recorded.
+            If None, or the log has no timestamps, frames are written as fast
+            as possible
+        repeat (int): replay the session this many times back to back
+        stats (ReplayStats or None): statistics to update
+
+    Returns:
+        ReplayStats
+    """
+    stats = stats or ReplayStats(str(writer.get_extra_info('peername')))
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    # session time of the current repetition's first frame
+    offset = 0
+    for _ in range(repeat):
+        first = last = None
+        count = 0
+        for t, frame in frames:
+            if speed and t is not None:
+                if first is None:
+                    first = t
+                delay = start + (offset + t - first) / speed - loop.time()
+                if delay > 0:
+                    await writer.drain()
+                    await asyncio.sleep(delay)
+                last = t
+            writer.write(frame)
+            count += 1
+            stats.frames += 1
+            stats.bytes += len(frame)
+            if count % 64 == 0:
+                await writer.drain()
+        if first is not None:
+            # leave the mean frame spacing between repetitions
+            span = last - first
+            offset += span + (span / (count - 1) if count > 1 else 0)
+    await writer.drain()
+    stats.elapsed = time.monotonic() - stats.start
+    return stats
+
+
+async def discard(reader):
+    """Read and drop everything sent by the peer"""
+    try:
+        while await reader.read(1 << 16):
+            pass
+    except ConnectionError:
+        pass
+
+def replay_handler(frames, speed=1, repeat=1, on_done=None):
+    """Connection handler for `asyncio.start_server` which replays recorded
+    downlink to each client, discarding anything the client sends
+
+    Args:
+        frames (list of tuple): frames shared by every client, see `load_frames`
+        speed, repeat: see `replay`
+        on_done (callable): called with the ReplayStats of each finished client
+    """
+    async def handle_client(reader, writer):
+        peer = writer.get_extra_info('peername')
+        drain = asyncio.create_task(discard(reader))
+        try:
+            stats = await replay(writer, frames, speed, repeat, ReplayStats(f'{peer[0]}:{peer[1]}'))
+            if on_done is not None:
+                on_done(stats)
+        except ConnectionError:
+            log.error(f"Client {peer} disconnected during replay")
+        finally:
+            drain.cancel()
+            writer.close()
+    return handle_client
+
+async def serve(path, host, port, direction='rx', speed=1, repeat=1):
+    """Replay recorded downlink to every client which connects"""
+    frames = await load_frames(path, direction)
+    server = await asyncio.start_server(
+        replay_handler(frames, speed, repeat, on_done=print), host, port
+    )
+    print(f"Replaying {len(frames)} frames of {path} on {host} {port}")
+    async with server:
+        await server.serve_forever()
+
+async def replay_client(r, path, direction='tx', speed=1, repeat=1, timeout=5):
+    """Replay recorded uplink to a RADCOM
+
+    Args:
+        r (RADCOM): RADCOM to send to
+        path (str): recorded session, see `read_frames`
+        direction (str or None): replay only 'rx' or 'tx' frames
+        speed, repeat: see `replay`
+        timeout (float): max time to wait for OKs after the last frame
+
+    Returns:
+        ReplayStats
+    """
+    frames = await load_frames(path, direction)
+    async with r:
+        stats = await replay(r.writer, frames, speed, repeat, ReplayStats(r.stats.endpoint))
+        r.stats.sent += stats.frames
+        await r.wait_oks(stats.frames, timeout)
+    return stats
+
+def replay_cmd(args):
+    """Argparse entry point for `replay` command"""
+    speed = None if args.fast else args.speed
+    if args.serve:
+        direction = args.direction or 'rx'
+        try:
+            asyncio.run(serve(args.log, args.listen_host, args.listen_port, direction, speed, args.repeat))
+        except KeyboardInterrupt:
+            pass
+    else:
+        r = RADCOM(args.host, args.port)
+        r.verbose = False
+        stats = asyncio.run(replay_client(r, args.log, args.direction or 'tx', speed, args.repeat))
+        print(stats)
+        print(f'{r.stats.oks} OKs received')
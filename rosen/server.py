@@ -1,38 +1,425 @@
 from rosen.gcomm import GCOMM
+from rosen.icomm import ICOMM
+from rosen.axe import AXE
+from rosen.clock import Clock, VirtualClock
 
 import asyncio
-async def handle_client(reader, writer):
-    while True:
+from dataclasses import dataclass, field, fields
+import json
+import logging
+import os
+from pathlib import Path
+import random
+import time
+from rich.console import Console
+from rich.table import Table
+
+log = logging.getLogger('rosen')
+
+class SDCard:
+    """Emulated RADCOM SD card
+
+    Each file is a list of `app_file` GCOMM frames, stored by record number.
+    If `directory` is given, existing files are loaded from it and changes are
+    written through to it in the same contiguous frame layout as
+    `GCOMMScript.compile` or `rosen download` output.
+
+    Args:
+        directory (str or None): directory backing the card, or None to keep
+            the card in memory only
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.files = {}
+        if directory is not None:
+            for path in sorted(Path(directory).iterdir()):
+                if path.is_file():
+                    data = path.read_bytes()
+                    self.files[path.name] = [
+                        data[i:i + GCOMM.size] for i in range(0, len(data), GCOMM.size)
+                    ]
+
+    def __contains__(self, filename):
+        return filename in self.files
+
+    def names(self):
+        return sorted(self.files)
+
+    def records(self, filename):
+        """Frames of a file by record number (from 1), None where a record
+        hasn't been uploaded"""
+        return self.files[filename]
+
+    def frames(self, filename):
+        """Stored frames of a file, skipping records not yet uploaded"""
+        return [f for f in self.files[filename] if f is not None]
+
+    def complete(self, filename):
+        return filename in self.files and None not in self.files[filename]
+
+    @staticmethod
+    def check_name(filename):
+        """Raise ValueError for names which aren't a plain file in the card's
+        directory"""
+        if (not filename or filename in ('.', '..') or '\0' in filename
+                or any(sep and sep in filename for sep in ('/', '\\', os.sep, os.altsep))):
+            raise ValueError(f"Bad filename {filename!r}")
+
+    def write(self, filename, n, m, frame):
+        """Store record n (1-based) of an m record file
+
+        Raises:
+            ValueError: filename isn't a plain file name
+        """
+        self.check_name(filename)
+        records = self.files.setdefault(filename, [])
+        size = max(n, m, len(records))
+        records.extend([None] * (size - len(records)))
+        records[n - 1] = frame
+        if self.directory is not None:
+            path = os.path.join(self.directory, filename)
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                f.seek((n - 1) * GCOMM.size)
+                f.write(frame)
+
+    def remove(self, filename):
+        self.check_name(filename)
+        del self.files[filename]
+        if self.directory is not None:
+            os.remove(os.path.join(self.directory, filename))
+
+    def clear(self):
+        for filename in list(self.files):
+            self.remove(filename)
+
+
+@dataclass
+class LinkConfig:
+    """Emulated link between the simulator and each client
+
+    Args:
+        latency (float): seconds before each reply frame arrives
+        jitter (float): extra random delay of up to this many seconds per frame.
+            Frames still arrive in order
+        bandwidth (float or None): link rate in bytes/s in each direction, per
+            client.  Unlimited if None
+        seed (int or None): seed for jitter, for repeatable runs
+    """
+
+    latency: float = 0
+    jitter: float = 0
+    bandwidth: float = None
+    seed: int = None
+
+    @classmethod
+    def load(cls, path, **overrides):
+        """Read link settings from a JSON file, e.g. {"latency": 0.25, "jitter": 0.05}
+
+        Args:
+            path (str or None): JSON file, or None for defaults
+            **overrides: settings which replace those in the file, if not None
+        """
+        config = {}
+        if path is not None:
+            with open(path) as f:
+                config = json.load(f)
+            unknown = set(config) - {f.name for f in fields(cls)}
+            assert not unknown, f"Unknown link settings {unknown}"
+        config.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**config)
+
+
+@dataclass
+class ClientStats:
+    """Frames exchanged with one simulator client"""
+
+    peer: str
+    connected: float = field(default_factory=time.time)
+    disconnected: float = None
+    received: int = 0
+    sent: int = 0
+
+    @property
+    def elapsed(self):
+        return (self.disconnected or time.time()) - self.connected
+
+
+class Simulator:
+    """Stateful RADCOM simulator
+
+    Replies OK to every frame and keeps an emulated SD card which supports
+    `app_file`, `rm_file`, `exec_file`, `down_file`, `file_sd`, `list_sd` and
+    `clear_sd`.  Files named `!<timestamp>` are executed at that time once
+    fully uploaded.
+
+    Executing an ICOMM packet (`exec_now` or from a script) emulates the
+    payloads: `set` stores values, and `query` is answered with a `statement`
+    of the stored values (0 if never set).  Replies from scripts go to all
+    connected clients.
+
+    Any number of clients may be connected at once, each over its own
+    emulated link.
+
+    Args:
+        sd (SDCard or None): SD card.  Defaults to an empty in-memory card
+        link (LinkConfig or None): link emulation.  Defaults to a perfect link
+        clock (Clock or None): clock scheduled scripts run on.  Use a
+            VirtualClock to run them faster than real time
+
+    Attributes:
+        values (dict): stored payload values for each device
+        executed (list): (time, ICOMM) for every executed packet
+        stats (list of ClientStats): statistics of every client served
+        served (int): total frames received from all clients
+    """
+
+    def __init__(self, sd=None, link=None, clock=None):
+        self.sd = SDCard() if sd is None else sd
+        self.clock = Clock() if clock is None else clock
+        self.link = LinkConfig() if link is None else link
+        self.random = random.Random(self.link.seed)
+        self.stats = []
+        self.client_stats = {}
+        self.served = 0
+        self.values = {}
+        self.executed = []
+        self.scheduled = {}
+        self.running = set()
+        self.clients = set()
+        self.clock_offset = 0
+        # loop times at which each client's downlink is free and its last
+        # frame arrives
+        self.link_free = {}
+        self.last_arrival = {}
+
+    def time(self):
+        return self.clock.time() + self.clock_offset
+
+    async def send(self, writer, frame):
+        """Send a frame to a client over its emulated link"""
+        if writer in self.client_stats:
+            self.client_stats[writer].sent += 1
+        link = self.link
+        if not link.latency and not link.jitter and not link.bandwidth:
+            writer.write(frame)
+            await writer.drain()
+            return
+        loop = asyncio.get_running_loop()
+        start = max(loop.time(), self.link_free.get(writer, 0))
+        if link.bandwidth:
+            start += len(frame) / link.bandwidth
+        self.link_free[writer] = start
+        arrival = start + link.latency + self.random.uniform(0, link.jitter)
+        # TCP delivers in order, so a frame can't overtake the one before it
+        arrival = max(arrival, self.last_arrival.get(writer, 0))
+        self.last_arrival[writer] = arrival
+        loop.call_at(arrival, self._deliver, writer, frame)
+
+    @staticmethod
+    def _deliver(writer, frame):
+        if not writer.is_closing():
+            writer.write(frame)
+
+    async def broadcast(self, frame):
+        for writer in list(self.clients):
+            await self.send(writer, frame)
+
+    async def handle_client(self, reader, writer):
+        """Serve one client connection"""
+        self.clients.add(writer)
+        remote_addr = writer.get_extra_info('peername')
+        stats = ClientStats(f'{remote_addr[0]}:{remote_addr[1]}' if remote_addr else '?')
+        self.stats.append(stats)
+        self.client_stats[writer] = stats
         try:
-            data = await reader.readexactly(GCOMM.size)
-            remote_addr = writer.get_extra_info('peername')
-            g = GCOMM.parse(data)
-            print(f"Received from {remote_addr}:\n    {g}")
-        except EOFError:
-            break
-        except ConnectionResetError:
-            print("Client disconnected in middle of message")
-            break
-        # respond with OK
-        writer.write(GCOMM('ok').build())
-        await writer.drain()
-        # artificially slow the server down a bit
-        await asyncio.sleep(0.3)
-        writer.write(GCOMM('list_sd').build())
-        await asyncio.sleep(1)
-        writer.write(GCOMM('list_sd').build())
-        await asyncio.sleep(1)
-
-    print(f"Shutting down server")
-
-async def run_server(host, port):
-    server = await asyncio.start_server(handle_client, host, port)
+            while True:
+                try:
+                    data = await reader.readexactly(GCOMM.size)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                stats.received += 1
+                self.served += 1
+                if self.link.bandwidth:
+                    # uplink transmission time
+                    await asyncio.sleep(len(data) / self.link.bandwidth)
+                try:
+                    g = GCOMM.parse(data)
+                except Exception:
+                    log.error(f"Bad packet from {remote_addr}")
+                    continue
+                log.debug(f"Received from {remote_addr}:\n    {g}")
+                await self.send(writer, GCOMM('ok').build())
+                await self.handle(g, data, writer)
+        finally:
+            self.clients.discard(writer)
+            self.client_stats.pop(writer, None)
+            self.link_free.pop(writer, None)
+            self.last_arrival.pop(writer, None)
+            stats.disconnected = time.time()
+        log.info(
+            f"Client {stats.peer} disconnected after {stats.received} frames "
+            f"in {stats.elapsed:.1f}s"
+        )
+
+    async def handle(self, g, frame, writer):
+        """Carry out a received GCOMM command"""
+        nok = lambda errstr: self.send(
+            writer, GCOMM('nok', filename=g.filename, errstr=errstr).build()
+        )
+        if g.cmd == 'app_file':
+            try:
+                self.sd.write(g.filename, g.n, g.m, frame)
+            except ValueError as e:
+                return await nok(str(e))
+            if g.filename.startswith('!') and self.sd.complete(g.filename):
+                self.schedule(g.filename)
+        elif g.cmd == 'rm_file':
+            if g.filename not in self.sd:
+                return await nok('No such file')
+            self.cancel(g.filename)
+            self.sd.remove(g.filename)
+        elif g.cmd == 'clear_sd':
+            for filename in list(self.scheduled):
+                self.cancel(filename)
+            self.sd.clear()
+        elif g.cmd == 'exec_file':
+            if g.filename not in self.sd:
+                return await nok('No such file')
+            self.start_script(g.filename)
+        elif g.cmd == 'abort_script':
+            for task in list(self.running):
+                task.cancel()
+        elif g.cmd == 'exec_now':
+            await self.execute(g.packet)
+        elif g.cmd == 'file_sd':
+            if g.filename not in self.sd:
+                return await nok('No such file')
+            await self.send(writer, GCOMM(
+                'file_sd', filename=g.filename, m=len(self.sd.records(g.filename))
+            ).build())
+        elif g.cmd == 'down_file':
+            if g.filename not in self.sd:
+                return await nok('No such file')
+            records = self.sd.records(g.filename)
+            # nonzero n requests only records n through m
+            if g.n > 0:
+                records = records[g.n - 1:g.m]
+            # records not yet uploaded are missing from the download
+            for f in records:
+                if f is not None:
+                    await self.send(writer, f)
+        elif g.cmd == 'list_sd':
+            names = self.sd.names()
+            for n, name in enumerate(names, start=1):
+                await self.send(writer, GCOMM('list_sd', filename=name, n=n, m=len(names)).build())
+            if not names:
+                await self.send(writer, GCOMM('list_sd').build())
+        elif g.cmd == 'get_time':
+            await self.send(writer, GCOMM('get_time', time=int(self.time())).build())
+        elif g.cmd == 'set_time':
+            self.clock_offset = g.time - self.clock.time()
+
+    async def execute(self, icomm):
+        """Emulate a payload executing an ICOMM packet"""
+        self.executed.append((self.time(), icomm))
+        if not isinstance(icomm, ICOMM) or not isinstance(icomm.payload, AXE):
+            return
+        axe = icomm.payload
+        values = self.values.setdefault(icomm.to, {})
+        if axe.cmd == 'set' and isinstance(axe.data, dict):
+            values.update(axe.data)
+        elif axe.cmd == 'query':
+            response = AXE('statement', {item: values.get(item, 0) for item in axe.data}, tx_id=axe.tx_id)
+            await self.broadcast(GCOMM(
+                'exec_now', packet=ICOMM('cmd', 'ground', frm=icomm.to, payload=response)
+            ).build())
+
+    async def run_script(self, filename):
+        """Execute the ICOMM packets of a script file at their offsets"""
+        records = [GCOMM.parse(f) for f in self.sd.frames(filename)]
+        start = self.clock.time()
+        for g in sorted(records, key=lambda g: g.offset):
+            await self.clock.sleep(start + g.offset - self.clock.time())
+            await self.execute(g.packet)
+
+    def start_script(self, filename):
+        task = asyncio.create_task(self.run_script(filename))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+        return task
+
+    def schedule(self, filename):
+        """Execute a `!<timestamp>` script file at its time"""
+        self.cancel(filename)
+        try:
+            at = int(filename[1:])
+        except ValueError:
+            log.error(f"Bad scheduled script name {filename}")
+            return
+        async def wait():
+            await self.clock.sleep(at - self.time())
+            del self.scheduled[filename]
+            await self.start_script(filename)
+        self.scheduled[filename] = asyncio.create_task(wait())
+
+    def cancel(self, filename):
+        if filename in self.scheduled:
+            self.scheduled.pop(filename).cancel()
+
+
+async def handle_client(reader, writer, sd_dir=None):
+    """Serve one client from a fresh Simulator, with the SD card stored in `sd_dir`"""
+    await Simulator(SDCard(sd_dir)).handle_client(reader, writer)
+
+def report(sim):
+    """Print a table of frames exchanged with each client of a simulator"""
+    table = Table(
+        "Client", "Received", "Sent", "Time (s)", "Frames/s", "Status",
+        title="Server Summary",
+    )
+    for s in sim.stats:
+        table.add_row(
+            s.peer, str(s.received), str(s.sent), f'{s.elapsed:.3f}',
+            f'{s.received / s.elapsed:.1f}' if s.elapsed else '',
+            'connected' if s.disconnected is None else 'disconnected',
+        )
+    Console().print(table)
+
+async def monitor(sim, interval):
+    """Periodically print the rate frames are served at"""
+    served, last = sim.served, time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        if sim.served != served:
+            print(
+                f"{(sim.served - served) / (now - last):.1f} frames/s, "
+                f"{len(sim.clients)} clients"
+            )
+        served, last = sim.served, now
+
+async def run_server(host, port, sd_dir=None, link=None, report_interval=5, speed=1):
+    sim = Simulator(SDCard(sd_dir), link, VirtualClock(speed=speed) if speed != 1 else None)
+    server = await asyncio.start_server(sim.handle_client, host, port)
     print(f"Serving on {host} {port}")
-    async with server:
-        await server.serve_forever()
+    rate = asyncio.create_task(monitor(sim, report_interval))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        rate.cancel()
+        report(sim)
 
 def server(args):
-    """Run a test server which simply responds OK to all valid packets"""
-    # asyncio.run(run_server(args.host, args.port))
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(run_server(args.host, args.port))
+    """Run a RADCOM simulator"""
+    link = LinkConfig.load(
+        args.config, latency=args.latency, jitter=args.jitter,
+        bandwidth=args.bandwidth, seed=args.seed
+    )
+    try:
+        asyncio.run(run_server(
+            args.host, args.port, args.sd_dir, link, args.report_interval, args.speed
+        ))
+    except KeyboardInterrupt:
+        pass
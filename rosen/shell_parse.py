@@ -68,7 +68,7 @@ def exec_now_parse(args):
     if parsed == False:
         return False
 
-    return GCOMM('exec_now', packet=ICOMM(cmd='cmd', to=board, frm='ground', payload=AXE(cmd=axe_cmd_tbl[axe_cmd], data=parsed)))
+    return GCOMM('exec_now', packet=ICOMM(cmd='cmd', to=board, frm='ground', payload=AXE(cmd=axe_cmd_tbl[axe_cmd], data=parsed, tx_id=txid)))
 
 # TODO Checks that there are no invalid characters or formatting
 def check_valid(axe_cmd, data):
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timezone
+import os
+import sqlite3
+import threading
+import time
+from rich.console import Console
+from rich.table import Table
+
+from rosen.axe import AXE
+from rosen.common import flatten, handle_time
+from rosen.icomm import ICOMM
+from rosen.packetlog import PacketLog, decode_chunks
+
+schema = """
+CREATE TABLE IF NOT EXISTS packets (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    direction TEXT NOT NULL,
+    cmd TEXT NOT NULL,
+    filename TEXT,
+    icomm_to TEXT,
+    icomm_frm TEXT,
+    axe TEXT,
+    tx_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS telemetry (
+    packet_id INTEGER NOT NULL REFERENCES packets(id),
+    time REAL NOT NULL,
+    device TEXT,
+    axe TEXT,
+    key TEXT NOT NULL,
+    value
+);
+CREATE TABLE IF NOT EXISTS ingested (
+    path TEXT PRIMARY KEY,
+    records INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS packets_time ON packets(time);
+CREATE INDEX IF NOT EXISTS packets_cmd ON packets(cmd, time);
+CREATE INDEX IF NOT EXISTS packets_to ON packets(icomm_to, time);
+CREATE INDEX IF NOT EXISTS packets_frm ON packets(icomm_frm, time);
+CREATE INDEX IF NOT EXISTS packets_axe ON packets(axe, time);
+CREATE INDEX IF NOT EXISTS telemetry_key ON telemetry(key, time, value);
+CREATE INDEX IF NOT EXISTS telemetry_device_key ON telemetry(device, key, time, value);
+"""
+
+def rows(packet):
+    """Column values of a packet and its telemetry
+
+    Args:
+        packet (GCOMM): parsed packet
+
+    Returns:
+        tuple: (cmd, filename, to, frm, axe, tx_id) packet columns and a list of
+            (device, axe, key, value) telemetry rows
+    """
+    icomm = packet.packet if isinstance(packet.packet, ICOMM) else None
+    axe = icomm.payload if icomm and isinstance(icomm.payload, AXE) else None
+    columns = (
+        packet.cmd, packet.filename or None,
+        icomm.to if icomm else None, icomm.frm if icomm else None,
+        axe.cmd if axe else None, axe.tx_id if axe else None,
+    )
+    # only key/value data is telemetry, not lists of queried names
+    telemetry = []
+    if axe and isinstance(axe.data, dict):
+        telemetry = [
+            (icomm.frm, axe.cmd, k, v if isinstance(v, (int, float, str)) else str(v))
+            for k, v in flatten(axe.data)
+        ]
+    return columns, telemetry
+
+def record_rows(record):
+    """`rows` of a LogRecord, or None if it doesn't parse.  Runs in decoder
+    worker processes, so only plain tuples are sent back"""
+    packet = record.packet
+    return None if isinstance(packet, bytes) else rows(packet)
+
+
+class TelemetryStore:
+    """SQLite index of packets and the AXE variables they carry
+
+    Packets are keyed by time, GCOMM command, ICOMM to/from and AXE verb.  The
+    data of each AXE payload is flattened into one telemetry row per variable.
+    Inserts are committed in batches of `commit_every` packets or every
+    `commit_interval` seconds.
+
+    Can be used as a RADCOM packet listener to index received packets.
+
+    Args:
+        path (str): database file
+        commit_every (int): max packets between commits
+        commit_interval (float): max seconds between commits
+    """
+
+    def __init__(self, path, commit_every=256, commit_interval=1):
+        self.path = path
+        self.commit_every, self.commit_interval = commit_every, commit_interval
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(schema)
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        self.last_commit = time.time()
+
+    def __call__(self, packet, frame):
+        self.add(packet)
+
+    def add(self, packet, t=None, direction='rx'):
+        """Index a packet
+
+        Args:
+            packet (GCOMM): parsed packet
+            t (float): unix time packet was received.  Defaults to now
+            direction (str): 'rx' or 'tx'
+        """
+        t = time.time() if t is None else t
+        with self.lock:
+            self._insert(packet, t, direction)
+            self.uncommitted += 1
+            if (self.uncommitted >= self.commit_every
+                    or time.time() - self.last_commit >= self.commit_interval):
+                self._commit()
+
+    def _insert(self, packet, t, direction):
+        self._insert_rows(t, direction, *rows(packet))
+
+    def _insert_rows(self, t, direction, columns, telemetry):
+        cur = self.db.execute(
+            'INSERT INTO packets (time, direction, cmd, filename, icomm_to, icomm_frm, axe, tx_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (t, direction, *columns)
+        )
+        if telemetry:
+            self.db.executemany(
+                'INSERT INTO telemetry (packet_id, time, device, axe, key, value) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(cur.lastrowid, t, *row) for row in telemetry]
+            )
+
+    def _commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+        self.last_commit = time.time()
+
+    def commit(self):
+        with self.lock:
+            self._commit()
+
+    def ingest(self, path, workers=None, chunk=4096):
+        """Index the packets of a binary packet log
+
+        The number of records indexed from each log is remembered, so
+        ingesting a log again only indexes records appended since.  A log
+        shorter than last time is assumed to be a new file and is indexed from
+        the start.
+
+        Args:
+            path (str): packet log
+            workers (int or None): decoder processes, see `decode_chunks`.  By
+                default logs of a few chunks are decoded in this process, and
+                larger logs by up to 4 processes
+            chunk (int): records decoded and committed together
+
+        Returns:
+            int: number of records newly indexed
+        """
+        path = os.path.realpath(path)
+        with self.lock:
+            row = self.db.execute('SELECT records FROM ingested WHERE path = ?', (path,)).fetchone()
+        with PacketLog(path) as log:
+            length = len(log)
+        done = row[0] if row and row[0] <= length else 0
+        if workers is None:
+            workers = 1 if length - done <= 4 * chunk else min(os.cpu_count() or 1, 4)
+        count = 0
+        for records in decode_chunks(path, workers, chunk, record_rows, start=done):
+            # each chunk is committed together with the progress through the log
+            with self.lock:
+                for t, direction, packet_rows in records:
+                    if packet_rows is not None:
+                        self._insert_rows(t, direction, *packet_rows)
+                count += len(records)
+                self.db.execute(
+                    'INSERT OR REPLACE INTO ingested (path, records) VALUES (?, ?)',
+                    (path, done + count)
+                )
+                self._commit()
+        return count
+
+    def telemetry(self, key=None, device=None, axe=None, since=None, until=None,
+                  agg=None, limit=None, pattern=False):
+        """Query AXE variables
+
+        Args:
+            key (str): variable name
+            device (str): device which reported the variable
+            axe (str): AXE verb of the reporting packet
+            since (float, str or datetime): earliest time
+            until (float, str or datetime): latest time (exclusive)
+            agg (str): one of 'count', 'min', 'max', 'avg', 'sum' to aggregate
+                per device and variable instead of returning every value
+            limit (int): max rows returned
+            pattern (bool): `key` is a case sensitive glob pattern (*, ?, [...])
+                rather than an exact name
+
+        Returns:
+            list of tuple: (time, device, key, value) rows, or
+                (device, key, aggregate) rows if `agg` is given
+        """
+        where, params = self._filters(
+            [('key', 'GLOB' if pattern else '=', key),
+             ('device', '=', device), ('axe', '=', axe)],
+            since, until
+        )
+        if agg is not None:
+            assert agg in ('count', 'min', 'max', 'avg', 'sum'), f"Unknown aggregate {agg}"
+            sql = f'SELECT device, key, {agg}(value) FROM telemetry{where} GROUP BY device, key'
+        else:
+            sql = f'SELECT time, device, key, value FROM telemetry{where} ORDER BY time'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def packets(self, cmd=None, to=None, frm=None, axe=None, since=None, until=None,
+                agg=None, limit=None):
+        """Query indexed packets
+
+        Args:
+            cmd (str): GCOMM command
+            to (str): ICOMM destination device
+            frm (str): ICOMM source device
+            axe (str): AXE verb
+            since (float, str or datetime): earliest time
+            until (float, str or datetime): latest time (exclusive)
+            agg (str): 'count' to count packets per GCOMM command and AXE verb
+            limit (int): max rows returned
+
+        Returns:
+            list of tuple: (time, direction, cmd, filename, to, frm, axe, tx_id)
+                rows, or (cmd, axe, count) rows if `agg` is given
+        """
+        where, params = self._filters(
+            [('cmd', '=', cmd), ('icomm_to', '=', to), ('icomm_frm', '=', frm),
+             ('axe', '=', axe)],
+            since, until
+        )
+        if agg is not None:
+            assert agg == 'count', "Packets can only be counted"
+            sql = f'SELECT cmd, axe, count(*) FROM packets{where} GROUP BY cmd, axe'
+        else:
+            sql = (
+                'SELECT time, direction, cmd, filename, icomm_to, icomm_frm, axe, tx_id '
+                f'FROM packets{where} ORDER BY time'
+            )
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _filters(columns, since, until):
+        """Build a WHERE clause from (column, operator, value) filters"""
+        clauses, params = [], []
+        for column, op, value in columns:
+            if value is not None:
+                clauses.append(f'{column} {op} ?')
+                params.append(value)
+        if since is not None:
+            clauses.append('time >= ?')
+            params.append(since if isinstance(since, float) else handle_time(since))
+        if until is not None:
+            clauses.append('time < ?')
+            params.append(until if isinstance(until, float) else handle_time(until))
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def format_time(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+def query(args):
+    """Argparse entry point for `query` command"""
+    start = time.perf_counter()
+    with TelemetryStore(args.db) as store:
+        for log in args.ingest or []:
+            print(f'Indexed {store.ingest(log)} packets from {log}')
+        if args.packets:
+            rows = store.packets(
+                args.cmd, args.to, args.frm, args.axe, args.since, args.until,
+                args.agg, args.limit
+            )
+            headers = ('Command', 'AXE', 'Count') if args.agg else (
+                'Time', 'Dir', 'Command', 'Filename', 'To', 'From', 'AXE', 'TX ID'
+            )
+        else:
+            rows = store.telemetry(
+                args.key, args.frm, args.axe, args.since, args.until, args.agg,
+                args.limit, args.pattern
+            )
+            headers = ('Device', 'Key', args.agg) if args.agg else (
+                'Time', 'Device', 'Key', 'Value'
+            )
+    elapsed = time.perf_counter() - start
+
+    table = Table(*headers, title=f'{len(rows)} rows in {elapsed * 1000:.1f} ms')
+    for row in rows:
+        if not args.agg:
+            row = (format_time(row[0]), *row[1:])
+        table.add_row(*('' if v is None else str(v) for v in row))
+    Console().print(table)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+from collections import deque
+import fnmatch
+import math
+import threading
+import time
+from rich.table import Table
+
+from rosen.axe import AXE
+from rosen.icomm import ICOMM
+from rosen.common import flatten
+
+class VariableStats:
+    """Running statistics of one device variable, updated in O(1) (amortized
+    for the sliding window) per sample
+
+    Window statistics cover the `window` seconds up to the latest sample.  The
+    exponentially weighted mean decays by half every `halflife` seconds.
+
+    Args:
+        window (float): sliding window length in seconds
+        halflife (float): EWMA half life in seconds
+
+    Attributes:
+        count (int): samples seen
+        min, max, mean (float): over all samples
+        last (float): latest value
+        last_time (float): time of latest value
+        ewma (float): exponentially weighted moving average
+    """
+
+    __slots__ = (
+        'window', 'halflife', 'count', 'min', 'max', 'mean', 'last', 'last_time',
+        'ewma', '_samples', '_sum', '_mins', '_maxs'
+    )
+
+    def __init__(self, window=60, halflife=10):
+        self.window, self.halflife = window, halflife
+        self.count = 0
+        self.min = self.max = self.mean = self.last = self.last_time = self.ewma = None
+        self._samples = deque()
+        self._sum = 0
+        # monotonic deques of window samples whose fronts are the window min/max
+        self._mins, self._maxs = deque(), deque()
+
+    def update(self, value, t):
+        """Add a sample
+
+        Args:
+            value (int or float): sample value
+            t (float): unix time of sample
+        """
+        self.count += 1
+        if self.count == 1:
+            self.min = self.max = self.mean = self.ewma = value
+        else:
+            self.min, self.max = min(self.min, value), max(self.max, value)
+            self.mean += (value - self.mean) / self.count
+            alpha = 1 - 2 ** (-max(t - self.last_time, 0) / self.halflife)
+            self.ewma += alpha * (value - self.ewma)
+        self.last, self.last_time = value, t
+
+        self._samples.append((t, value))
+        self._sum += value
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        self._mins.append((t, value))
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        self._maxs.append((t, value))
+        self._expire(t - self.window)
+
+    def _expire(self, start):
+        while self._samples[0][0] <= start:
+            self._sum -= self._samples.popleft()[1]
+        while self._mins[0][0] <= start:
+            self._mins.popleft()
+        while self._maxs[0][0] <= start:
+            self._maxs.popleft()
+
+    @property
+    def window_count(self):
+        return len(self._samples)
+
+    @property
+    def window_mean(self):
+        return self._sum / len(self._samples) if self._samples else None
+
+    @property
+    def window_min(self):
+        return self._mins[0][1] if self._mins else None
+
+    @property
+    def window_max(self):
+        return self._maxs[0][1] if self._maxs else None
+
+    def __repr__(self):
+        return (
+            f"VariableStats(last={self.last}, min={self.min}, max={self.max}, "
+            f"mean={self.mean}, ewma={self.ewma}, window_mean={self.window_mean})"
+        )
+
+
+class Telemetry:
+    """Packet listener which keeps running statistics of every numeric AXE
+    variable reported by each device
+
+    Updates and summaries are serialized by a lock, so packets may be added
+    from a receive thread while another thread reads the stats.
+
+        r.telemetry['dcm.error_reg'].max
+        r.telemetry.table('dcm.*')
+
+    Args:
+        window (float): sliding window length in seconds
+        halflife (float): EWMA half life in seconds
+
+    Attributes:
+        stats (dict): VariableStats for each '<device>.<key>'
+    """
+
+    def __init__(self, window=60, halflife=10):
+        self.window, self.halflife = window, halflife
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, packet, frame=None):
+        if isinstance(packet.packet, ICOMM) and isinstance(packet.packet.payload, AXE):
+            self.update(packet.packet.frm, packet.packet.payload)
+
+    def update(self, device, axe, t=None):
+        """Add the variables of one AXE payload
+
+        Args:
+            device (str): device which sent the payload
+            axe (AXE): payload
+            t (float): unix time payload was received.  Defaults to now
+        """
+        if not isinstance(axe.data, dict):
+            return
+        t = time.time() if t is None else t
+        values = [
+            (f'{device}.{key}', value) for key, value in flatten(axe.data)
+            if not isinstance(value, bool) and isinstance(value, (int, float))
+            and not (isinstance(value, float) and math.isnan(value))
+        ]
+        with self.lock:
+            for name, value in values:
+                if name not in self.stats:
+                    self.stats[name] = VariableStats(self.window, self.halflife)
+                self.stats[name].update(value, t)
+
+    def __getitem__(self, name):
+        return self.stats[name]
+
+    def __contains__(self, name):
+        return name in self.stats
+
+    def select(self, pattern='*'):
+        """Stats of variables whose '<device>.<key>' matches a glob pattern
+
+        Returns:
+            dict: VariableStats for each matching name, sorted by name
+        """
+        with self.lock:
+            return self._select(pattern)
+
+    def _select(self, pattern):
+        return {
+            name: self.stats[name] for name in sorted(self.stats)
+            if fnmatch.fnmatchcase(name, pattern)
+        }
+
+    def table(self, pattern='*'):
+        """Rich table of variables matching a glob pattern"""
+        table = Table(
+            'Variable', 'Last', 'Age (s)', 'Min', 'Max', 'Mean',
+            f'Mean ({self.window:g}s)', 'EWMA', 'Count',
+            title='Telemetry'
+        )
+        now = time.time()
+        with self.lock:
+            rows = [
+                (name, f'{s.last:g}', f'{now - s.last_time:.1f}', f'{s.min:g}',
+                 f'{s.max:g}', f'{s.mean:.4g}', f'{s.window_mean:.4g}',
+                 f'{s.ewma:.4g}', str(s.count))
+                for name, s in self._select(pattern).items()
+            ]
+        for row in rows:
+            table.add_row(*row)
+        return table
+
+    def lines(self, pattern='*'):
+        """One line summary of each variable matching a glob pattern"""
+        with self.lock:
+            return [
+                f'{name}: last={s.last:g} min={s.min:g} max={s.max:g} '
+                f'mean={s.mean:.4g} mean{self.window:g}s={s.window_mean:.4g} '
+                f'ewma={s.ewma:.4g} n={s.count}'
+                for name, s in self._select(pattern).items()
+            ]
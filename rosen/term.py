@@ -1,9 +1,10 @@
 import curses
 import curses.textpad
 import time
-import datetime
 import os
 
+from rosen.blocklog import RotatingTextLog
+
 def trim_nulls(bstring):
 
     if len(bstring) == 0:
@@ -109,10 +110,8 @@ class Console:
         homedir = os.environ['HOME']
 
         if logfile == '__default__':
-            if os.access(homedir+'/seaque_logs', os.F_OK) is False:
-                os.mkdir(homedir+'/seaque_logs')
-
-            self.logfile = open(homedir+'/seaque_logs/log_' + datetime.date.today().isoformat() + '.txt', 'a')
+            # compressed, rotated daily or every 64 MiB
+            self.logfile = RotatingTextLog(homedir+'/seaque_logs', prefix='log', flush_interval=1)
         else:
             self.logfile = open(logfile, 'a')
 
@@ -288,6 +287,9 @@ class Console:
                     break
                 histf.write(l + '\n')
 
+        if self.logfile is not None:
+            self.logfile.close()
+
         curses.nocbreak()
         self.stdscr.keypad(False)
         curses.echo()
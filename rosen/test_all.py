@@ -5,9 +5,30 @@ import pytest
 from rosen.icomm import ICOMM, ICOMMScript
 from rosen.axe import AXE
 from rosen.gcomm import GCOMM, GCOMMScript
-from rosen.common import handle_time
+from rosen.common import flatten, handle_time
+from rosen.client import RADCOM, FileInfo, run_client
+from rosen.down import download, down_client, fetch, verify, record_digest, file_digest, Download, DownloadAborted, IntegrityError
+from rosen.monitor import Monitor, Rule
+from rosen.packetlog import PacketLogWriter, PacketLog, read_log, convert_pickle, decode, decode_chunks
+from rosen.server import handle_client as server_handle_client, Simulator, SDCard, LinkConfig
+from rosen.link import Impairment, ImpairedLink, LinkCounters, LinkProxy
+from rosen.clock import Clock, Executor, VirtualClock, load_script
+from rosen.planner import Pass, Upload, plan
+from rosen.blocklog import RotatingPacketLog, RotatingTextLog, BlockLog, read_rotated
+from rosen.store import TelemetryStore
+from rosen.telemetry import VariableStats
+from rosen.dedup import DuplicateFilter
+from rosen.export import export
+from rosen.replay import read_frames, load_frames, replay_handler, replay_client
+from rosen.bench import run_benchmarks, codec_functions, compare
+
+import asyncio
+import contextlib
+from functools import partial
 
 from datetime import datetime
+import pickle
+import time
 import os
 
 # ----- AXE -----
@@ -18,6 +39,13 @@ def test_axe_parsebuild():
     assert a.cmd == 'execute'
     assert a.data == 'foobar'
 
+def test_axe_tx_id():
+    # tx_id should survive a build/parse roundtrip for query/statement
+    a = AXE.parse(AXE('query', ['thermistor1'], tx_id=1234).build())
+    assert a.tx_id == 1234
+    a = AXE.parse(AXE('statement', {'foo': 1}, tx_id=4321).build())
+    assert a.tx_id == 4321
+
 # ----- ICOMM -----
 
 def test_icomm():
@@ -135,6 +163,1090 @@ def test_gcommscript_helpers(tmpdir):
     except Exception:
         pytest.fail("GCOMMScript printing failed")
 
+# ----- Planner -----
+
+def test_planner(tmpdir):
+    def script(n):
+        i = ICOMMScript()
+        for k in range(n):
+            i.query('dcm', [f'item{k}'])
+        return i
+
+    t0 = handle_time('2024-06-01')
+    # 10 frames/s (with 10 frames awaiting OKs per 1 s RTT) for 2 seconds
+    # after connecting, so 20 frames per pass
+    rate = 10 * GCOMM.size
+    passes = [Pass(t0 + 100, t0 + 103, rate, rtt=1), Pass(t0, t0 + 3, rate, rtt=1)]
+    assert passes[0].capacity(window=10) == 20
+    uploads = [
+        # doesn't fit once the earlier deadlines are met
+        Upload(t0 + 2000, script(15)),
+        # must go in the first pass, ahead of the later deadline
+        Upload(t0 + 50, script(12)),
+        Upload(t0 + 200, script(25)),
+    ]
+    p = plan(passes, uploads, window=10)
+    assert [u.frames for u in p.unscheduled] == [15]
+    first, second = p.passes
+    assert first.contact.start == t0
+    assert [(g.filename, g.n) for g in first.script.script[:12]] == [
+        ('!' + str(t0 + 50), n) for n in range(1, 13)
+    ]
+    # the first pass is filled with the start of the later script
+    assert len(first.script.script) == 20 and first.utilization == 1
+    assert [g.n for g in second.script.script] == list(range(9, 26))
+    assert second.script.script[-1].m == 25
+
+    paths = p.compile(str(tmpdir.join('passes')))
+    assert os.path.getsize(paths[1]) == 17 * GCOMM.size
+    # together the passes upload both scripts whole
+    t = Executor().run([first.script, second.script])
+    assert [len(r.events) for r in t.runs] == [12, 25]
+
+    # uploads at the same time would share a file
+    with pytest.raises(ValueError):
+        plan(passes, [Upload(t0 + 50, script(2)), Upload(t0 + 50, script(3))])
+
+# ----- Client -----
+
+@contextlib.asynccontextmanager
+async def serving(handler):
+    """Run a local server with connection handler `handler`, yielding its port"""
+    server = await asyncio.start_server(handler, '127.0.0.1', 0)
+    try:
+        yield server.sockets[0].getsockname()[1]
+    finally:
+        server.close()
+
+async def connected(handler, coro):
+    """Await `coro(r)` with a quiet RADCOM connected to a local server running
+    `handler`"""
+    async with serving(handler) as port:
+        async with RADCOM('127.0.0.1', port) as r:
+            r.verbose = False
+            return await coro(r)
+
+def run_against(handler, coro):
+    """Run `connected` in a new event loop and return the result of `coro`"""
+    return asyncio.run(connected(handler, coro))
+
+def test_client_query_correlation():
+    # responses sent back in reverse order should still reach the right query
+    async def handle_client(reader, writer):
+        requests = [GCOMM.parse(await reader.readexactly(GCOMM.size)) for _ in range(2)]
+        for g in reversed(requests):
+            axe = g.packet.payload
+            response = AXE('statement', {'item': axe.data[0]}, tx_id=axe.tx_id)
+            writer.write(GCOMM(
+                'exec_now', packet=ICOMM('cmd', 'ground', frm=g.packet.to, payload=response)
+            ).build())
+        await writer.drain()
+
+    a, b = run_against(handle_client, lambda r: asyncio.gather(
+        r.query('dcm', ['thermistor1'], timeout=5),
+        r.query('qcb', ['thermistor2'], timeout=5),
+    ))
+    assert a.data == {'item': 'thermistor1'}
+    assert b.data == {'item': 'thermistor2'}
+    assert a.tx_id != b.tx_id
+
+def test_client_statement():
+    # every item is sent, even one named like an argument
+    async def handle_client(reader, writer):
+        g = GCOMM.parse(await reader.readexactly(GCOMM.size))
+        axe = g.packet.payload
+        writer.write(GCOMM(
+            'exec_now', packet=ICOMM('cmd', 'ground', frm=g.packet.to, payload=AXE('statement', axe.data, tx_id=axe.tx_id))
+        ).build())
+        await writer.drain()
+
+    response = run_against(handle_client, lambda r: r.statement('dcm', {'timeout': 3, 'mode': 'science'}, timeout=5))
+    assert response.data == {'timeout': 3, 'mode': 'science'}
+
+def test_client_fanout():
+    # stream one script to two endpoints, one of which never responds
+    async def handle_ok(reader, writer):
+        while True:
+            await reader.readexactly(GCOMM.size)
+            writer.write(GCOMM('ok').build())
+
+    async def handle_silent(reader, writer):
+        while True:
+            await reader.readexactly(GCOMM.size)
+
+    g_scr = GCOMMScript()
+    g_scr.get_time()
+    g_scr.list_sd()
+    async def main():
+        async with serving(handle_ok) as good, serving(handle_silent) as bad:
+            radcoms = [RADCOM('127.0.0.1', port) for port in (good, bad)]
+            return await run_client(radcoms, g_scr, timeout=0.1, max_retries=1)
+
+    good, bad = asyncio.run(main())
+    assert good.sent == 2 and good.oks == 2 and good.error == ''
+    assert bad.retries == 1 and bad.error != ''
+
+def test_client_send_frames(tmpdir):
+    # bulk-send a compiled frame file, both from disk and from memory
+    g_scr = GCOMMScript()
+    i = ICOMMScript()
+    for n in range(20):
+        i.set('qcb', bar=n)
+    g_scr.upload_script('bulk', i)
+    path = str(tmpdir.join('bulk.frames'))
+    g_scr.compile(path)
+    with open(path, 'rb') as f:
+        compiled = f.read()
+    assert len(compiled) == 20 * GCOMM.size
+
+    received = []
+    async def handle_ok(reader, writer):
+        while True:
+            received.append(await reader.readexactly(GCOMM.size))
+            writer.write(GCOMM('ok').build())
+
+    async def send(r, frames):
+        await r.send_frames(frames, window=6, timeout=5, max_retries=0)
+        return r.stats
+
+    for frames in (path, compiled):
+        received.clear()
+        stats = run_against(handle_ok, partial(send, frames=frames))
+        assert b''.join(received) == compiled
+        assert stats.sent == 20 and stats.oks == 20
+
+def test_client_send_frames_late_oks():
+    # OKs for the first window arrive after the timeout, and the second window
+    # is lost the first time it's sent
+    frames = sd_file_frames('data.bin', 4)
+    attempts = [0] * 4
+    acked = set()
+    async def handle_client(reader, writer):
+        loop = asyncio.get_running_loop()
+        def ok(i):
+            acked.add(i)
+            writer.write(GCOMM('ok').build())
+        while True:
+            i = frames.index(await reader.readexactly(GCOMM.size))
+            attempts[i] += 1
+            if attempts[i] > 1:
+                ok(i)
+            elif i < 2:
+                loop.call_later(0.3, ok, i)
+
+    async def send(r):
+        await r.send_frames(b''.join(frames), window=2, timeout=0.2, max_retries=2)
+        return r.stats
+
+    stats = run_against(handle_client, send)
+    # late OKs weren't taken for the resent frames, so none were skipped
+    assert acked == {0, 1, 2, 3}
+    assert attempts == [1, 1, 2, 2] and stats.retries == 2
+
+def test_client_lifecycle():
+    # repeated runs in one event loop shouldn't leave tasks or connections behind
+    connections = []
+    async def handle_ok(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                await reader.readexactly(GCOMM.size)
+                writer.write(GCOMM('ok').build())
+        except asyncio.IncompleteReadError:
+            connections.remove(writer)
+
+    g_scr = GCOMMScript()
+    g_scr.get_time()
+    async def main():
+        async with serving(handle_ok) as port:
+            for _ in range(3):
+                r = RADCOM('127.0.0.1', port)
+                stats, = await run_client(r, g_scr, timeout=5)
+                assert stats.error == '' and stats.oks == 1
+                assert r.writer is None and r.receiving is None
+            # let the server notice the disconnects
+            await asyncio.sleep(0.1)
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    leftover = asyncio.run(main())
+    assert not leftover
+    assert not connections
+
+def test_duplicate_filter():
+    f = DuplicateFilter(window=2, max_entries=2)
+    a, b, c = (GCOMM('rm_file', filename=f'{n}.bin').build() for n in range(3))
+    assert not f(a, t=0) and f(a, t=1) and f(a, t=1.9)
+    # out of the window
+    assert not f(a, t=2.5)
+    # oldest entry is evicted when full
+    assert not f(b, t=2.6) and not f(c, t=2.7) and not f(a, t=2.8)
+    # repeated OKs and replies are meaningful
+    assert not any(f(GCOMM('ok').build(), t=3) for _ in range(3))
+    assert not any(f(GCOMM('list_sd').build(), t=3) for _ in range(3))
+    # so are records downloaded again and unchanged telemetry
+    assert not any(f(sd_file_frames('data.bin', 1)[0], t=3) for _ in range(3))
+    statement = GCOMM('exec_now', packet=ICOMM('cmd', 'ground', frm='dcm', payload=AXE('statement', {'error_reg': 0}))).build()
+    assert not any(f(statement, t=3) for _ in range(3))
+    assert f.suppressed == 2
+
+def test_client_drops_duplicates():
+    async def handle_client(reader, writer):
+        await reader.readexactly(GCOMM.size)
+        frame = GCOMM('rm_file', filename='data.bin').build()
+        for f in [GCOMM('ok').build(), frame, frame, GCOMM('ok').build(), GCOMM('get_time').build()]:
+            writer.write(f)
+        await writer.drain()
+
+    received = []
+    async def main(r):
+        # off by default
+        assert r.dedup is None
+        r.dedup = DuplicateFilter()
+        r.listeners.append(lambda packet, frame: received.append(packet.cmd))
+        done = r.expect(lambda packet: packet.cmd == 'get_time')
+        await r.send(GCOMM('list_sd'))
+        await asyncio.wait_for(done, 5)
+        return r
+
+    r = run_against(handle_client, main)
+    assert received == ['ok', 'rm_file', 'ok', 'get_time']
+    assert r.dedup.suppressed == 1 and r.stats.oks == 2
+
+def test_executor():
+    day = 86400
+    start = handle_time('2024-06-01')
+    g = GCOMMScript()
+    for d in range(7):
+        i = ICOMMScript(increment=600)
+        i.execute('qcb', 'laser_start')
+        i.query('dcm', ['thermistor1'])
+        g.schedule_script(start + d * day, i)
+    # runs into the next script's laser_start on qcb
+    late = ICOMMScript(increment=0)
+    late.execute('qcb', 'calibrate')
+    g.schedule_script(start + 2 * day - 300, late)
+    # removed before it runs
+    g.upload_script('!' + str(start + 3 * day + 10), late)
+    g.rm_file('!' + str(start + 3 * day + 10))
+
+    events = []
+    t = Executor({'laser_start': 900, 'qcb.calibrate': 400}).run([g], events.append)
+    assert len(t.runs) == 8 and len(t.events) == len(events) == 15
+    assert [e.time for e in events] == sorted(e.time for e in events)
+    assert t.events[0].command == 'laser_start' and t.events[0].end == start + 900
+    assert [(a.filename, b.filename) for a, b in t.overlaps] == [
+        ('!' + str(start + 2 * day - 300), '!' + str(start + 2 * day))
+    ]
+    assert [(a.command, b.command) for a, b in t.contention] == [('calibrate', 'laser_start')]
+
+def test_load_script(tmpdir):
+    g = GCOMMScript()
+    g.get_time()
+    g.list_sd()
+    pickled, compiled = str(tmpdir.join('script.pkl')), str(tmpdir.join('script.frames'))
+    g.save(pickled)
+    g.compile(compiled)
+    frames = [p.build() for p in g.script]
+    assert [p.build() for p in load_script(pickled).script] == frames
+    assert [p.build() for p in load_script(compiled)] == frames
+    # a broken pickle isn't mistaken for frames
+    with open(pickled, 'r+b') as f:
+        f.truncate(20)
+    with pytest.raises(pickle.UnpicklingError):
+        load_script(pickled)
+    with open(compiled, 'ab') as f:
+        f.write(b'\x00')
+    with pytest.raises(ValueError):
+        load_script(compiled)
+
+class SteppedClock(Clock):
+    """Clock which jumps straight to the end of each sleep"""
+
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += max(seconds, 0)
+        await asyncio.sleep(0)
+
+def test_simulator_virtual_clock():
+    # a script scheduled an hour ahead runs without waiting
+    clock = SteppedClock(1e9)
+    sim = Simulator(clock=clock)
+    i = ICOMMScript(increment=600)
+    i.set('dcm', x=1)
+    i.query('dcm', ['x'])
+    g = GCOMMScript()
+    at = int(clock.time()) + 3600
+    g.schedule_script(at, i)
+
+    async def main(r):
+        response = r.expect(lambda p: p.cmd == 'exec_now')
+        for packet in g.script:
+            await r.send(packet)
+        return await asyncio.wait_for(response, 2)
+
+    assert run_against(sim.handle_client, main).packet.payload.data == {'x': 1}
+    (t1, _), (t2, _) = sim.executed
+    assert t1 == at and t2 - t1 == 600
+    # accelerated wall clock
+    clock = VirtualClock(start=0, speed=600)
+    time.sleep(0.01)
+    assert clock.time() >= 6
+
+# ----- Download -----
+
+def sd_file_frames(name, count, error_reg=lambda n: n):
+    """Build the app_file frames RADCOM sends when downloading a file"""
+    return [
+        GCOMM(
+            'app_file', filename=name, n=n, m=count,
+            packet=ICOMM('cmd', 'ground', frm='dcm', payload=AXE('statement', {'error_reg': error_reg(n)}))
+        ).build()
+        for n in range(1, count + 1)
+    ]
+
+def test_file_sd(tmpdir):
+    sd_dir = tmpdir.mkdir('sd')
+    sd_dir.join('data.bin').write_binary(b''.join(sd_file_frames('data.bin', 12)))
+
+    errors = []
+    async def main(r):
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+        # a NOK for some other request doesn't answer file_sd
+        loop.call_soon(r.correlate, GCOMM('nok', errstr='busy'))
+        info = await r.file_sd('data.bin', timeout=5)
+        with pytest.raises(FileNotFoundError):
+            await r.file_sd('missing.bin', timeout=5)
+        # still outstanding when the connection closes
+        return info, r.expect(lambda p: False)
+
+    info, unanswered = run_against(partial(server_handle_client, sd_dir=str(sd_dir)), main)
+    assert unanswered.cancelled() and not errors
+    assert info.records == 12
+    assert info.size == 12 * GCOMM.size
+
+def test_simulator(tmpdir):
+    sd_dir = tmpdir.mkdir('sd')
+    sim = Simulator(SDCard(str(sd_dir)))
+    i = ICOMMScript(increment=0)
+    i.set('dcm', thermistor1=21)
+    i.query('dcm', ['thermistor1'])
+    g = GCOMMScript()
+    g.upload_script('prog', i)
+    # already due, so runs as soon as it is uploaded
+    g.schedule_script(int(time.time()) - 1, i)
+
+    async def main(r):
+        is_statement = lambda p: p.cmd == 'exec_now' and p.packet.payload.cmd == 'statement'
+        scheduled = r.expect(is_statement)
+        for packet in g.script:
+            await r.send(packet)
+        names = await r.list_sd(timeout=5)
+        scheduled = await asyncio.wait_for(scheduled, 5)
+
+        executed = r.expect(is_statement)
+        await r.send(GCOMM('exec_file', filename='prog'))
+        executed = await asyncio.wait_for(executed, 5)
+        info = await r.file_sd('prog', timeout=5)
+
+        await r.send(GCOMM('rm_file', filename='prog'))
+        with pytest.raises(FileNotFoundError):
+            await r.file_sd('prog', timeout=5)
+        return names, scheduled, executed, info
+
+    names, scheduled, executed, info = run_against(sim.handle_client, main)
+    assert names[0].startswith('!') and names[1] == 'prog'
+    assert scheduled.packet.frm == 'dcm'
+    assert scheduled.packet.payload.data == executed.packet.payload.data == {'thermistor1': 21}
+    assert info.records == 2
+    assert len(sim.executed) == 4
+    # only the scheduled script is left on the card
+    assert [p.basename for p in sd_dir.listdir()] == [names[0]]
+
+def test_simulator_partial_files(tmpdir):
+    sd_dir = tmpdir.mkdir('sd')
+    sim = Simulator(SDCard(str(sd_dir)))
+    frames = sd_file_frames('part.bin', 3)
+    # record 2 not uploaded yet
+    sim.sd.write('part.bin', 1, 3, frames[0])
+    sim.sd.write('part.bin', 3, 3, frames[2])
+    # names from the network stay inside the card's directory
+    for name in ('../evil', '/tmp/evil', '..'):
+        with pytest.raises(ValueError):
+            sim.sd.write(name, 1, 1, frames[0])
+
+    async def main(r):
+        info = await r.file_sd('part.bin', timeout=5)
+        record = r.expect(lambda p: p.cmd == 'app_file')
+        await r.send(GCOMM('down_file', filename='part.bin', n=3, m=3))
+        record = await asyncio.wait_for(record, 5)
+        nok = r.expect(lambda p: p.cmd == 'nok')
+        await r.send(GCOMM('app_file', filename='../evil', n=1, m=1))
+        return info, record, await asyncio.wait_for(nok, 5)
+
+    info, record, nok = run_against(sim.handle_client, main)
+    assert info.records == 3 and record.n == 3
+    assert 'Bad filename' in nok.errstr
+    assert [p.basename for p in sd_dir.listdir()] == ['part.bin']
+    assert not tmpdir.join('evil').exists()
+
+def test_simulator_link(tmpdir):
+    # replies are delayed by the latency and paced by the bandwidth
+    sim = Simulator(link=LinkConfig(latency=0.2, bandwidth=10 * GCOMM.size))
+    frames = sd_file_frames('data.bin', 5)
+    for n, f in enumerate(frames, start=1):
+        sim.sd.write('data.bin', n, 5, f)
+
+    async def main(r):
+        start = time.monotonic()
+        d = await download(r, 'data.bin', str(tmpdir.join('data.frames')))
+        return d, time.monotonic() - start
+
+    d, elapsed = run_against(sim.handle_client, main)
+    assert d.n == 5
+    # at least two round trips and 7 frames each way at 10 frames/s
+    assert elapsed > 2 * 0.2 + 0.7
+
+def test_simulator_clients(tmpdir):
+    config = tmpdir.join('link.json')
+    config.write('{"latency": 0.05, "jitter": 0.05, "seed": 1}')
+    link = LinkConfig.load(str(config), jitter=0.02, bandwidth=None)
+    assert link == LinkConfig(latency=0.05, jitter=0.02, seed=1)
+    sim = Simulator(link=link)
+
+    g_scr = GCOMMScript()
+    for _ in range(10):
+        g_scr.get_time()
+
+    async def main():
+        async with serving(sim.handle_client) as port:
+            radcoms = [RADCOM('127.0.0.1', port) for _ in range(5)]
+            for r in radcoms:
+                r.verbose = False
+            return await run_client(radcoms, g_scr, timeout=5)
+
+    stats = asyncio.run(main())
+    assert all(s.oks == 10 and s.error == '' for s in stats)
+    assert sim.served == 50 and len(sim.stats) == 5
+    # an OK and a get_time reply for every frame
+    assert all(c.received == 10 and c.sent == 20 and c.disconnected for c in sim.stats)
+
+class FrameWriter:
+    def __init__(self):
+        self.frames = []
+        self.closed = False
+    def write(self, frame):
+        self.frames.append(frame)
+    def is_closing(self):
+        return self.closed
+    async def drain(self):
+        pass
+    def close(self):
+        self.closed = True
+
+def test_impaired_link():
+    frames = sd_file_frames('data.bin', 4)
+
+    async def send(config, seed=None):
+        link = ImpairedLink(config, FrameWriter(), seed)
+        for f in frames:
+            await link.feed(f)
+        await link.close()
+        return link.writer.frames, link.counters
+
+    received, counters = asyncio.run(send(Impairment(drop=1)))
+    assert received == [] and counters.dropped == 4
+    received, counters = asyncio.run(send(Impairment(reorder=1)))
+    assert received == [frames[1], frames[0], frames[3], frames[2]] and counters.reordered == 2
+
+    # a held frame is delivered in order if nothing overtakes it in time
+    async def idle():
+        link = ImpairedLink(Impairment(reorder=1, hold=0.05), FrameWriter())
+        await link.feed(frames[0])
+        await asyncio.sleep(0.1)
+        delivered = list(link.writer.frames)
+        await link.close()
+        return delivered, link.counters
+    assert asyncio.run(idle()) == ([frames[0]], LinkCounters(frames=1))
+
+    # a released frame still waiting for bandwidth isn't lost on close
+    async def released():
+        link = ImpairedLink(Impairment(reorder=1, hold=0.05, bandwidth=GCOMM.size / 1.1), FrameWriter())
+        await link.feed(frames[0])
+        await asyncio.sleep(0.08)
+        await link.close()
+        return link.writer.frames
+    assert asyncio.run(released()) == frames[:1]
+
+    # corrupted frames are rejected by the ICOMM checksum
+    received, counters = asyncio.run(send(Impairment(corrupt=1, seed=3)))
+    for a, b in zip(frames, received):
+        assert sum(bin(x ^ y).count('1') for x, y in zip(a, b)) == 1
+        assert isinstance(GCOMM.parse(b).packet, bytes)
+    # repeatable
+    assert asyncio.run(send(Impairment(corrupt=1), seed=3))[0] == received
+
+    # lossy link is repeatable and delays frames
+    start = time.monotonic()
+    received, counters = asyncio.run(send(Impairment(drop=0.5, latency=0.1, seed=1)))
+    assert time.monotonic() - start > 0.1
+    assert received == asyncio.run(send(Impairment(drop=0.5, seed=1)))[0]
+    assert len(received) == 4 - counters.dropped
+
+def test_link_proxy():
+    async def through_proxy(sim, uplink, coro):
+        async with serving(sim.handle_client) as port:
+            proxy = LinkProxy('127.0.0.1', port, uplink=uplink)
+            result = await connected(proxy.handle_client, coro)
+            # let the proxy see the disconnect
+            await asyncio.sleep(0.3)
+        return result, proxy
+
+    async def set_x(r):
+        await r.send(GCOMM('exec_now', packet=ICOMM('cmd', 'dcm', payload=AXE('set', {'x': 3}))))
+        await r.wait_oks(1, timeout=5)
+
+    async def set_and_query(r):
+        await set_x(r)
+        return await r.query('dcm', ['x'], timeout=5)
+
+    response, proxy = asyncio.run(through_proxy(
+        Simulator(), Impairment(latency=0.05, jitter=0.05, seed=1), set_and_query
+    ))
+    assert response.data == {'x': 3}
+    assert proxy.uplink_counters.frames == 2
+    # OK for each frame and the query response
+    assert proxy.downlink_counters.frames == 3
+
+    # the simulator ignores statements which fail the ICOMM checksum
+    sim = Simulator()
+    asyncio.run(through_proxy(sim, Impairment(corrupt=1, seed=1), set_x))
+    assert isinstance(sim.executed[0][1], bytes) and sim.values == {}
+
+def test_download(tmpdir):
+    frames = sd_file_frames('data.bin', 50)
+
+    async def handle_client(reader, writer):
+        while True:
+            g = GCOMM.parse(await reader.readexactly(GCOMM.size))
+            writer.write(GCOMM('ok').build())
+            if g.cmd == 'file_sd':
+                writer.write(GCOMM('file_sd', filename=g.filename, m=len(frames)).build())
+            elif g.cmd == 'down_file':
+                for f in frames:
+                    writer.write(f)
+
+    path = str(tmpdir.join('data.frames'))
+    monitor = Monitor()
+    d = run_against(handle_client, lambda r: download(r, 'data.bin', path, monitor=monitor))
+    assert d.n == d.m == 50
+    assert monitor.maxima['error_reg'] == 50
+    assert not monitor.alerts
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(frames)
+
+def test_download_monitor_abort(tmpdir):
+    # error_reg turns non-critical at record 10 and critical at record 20
+    frames = sd_file_frames('data.bin', 500, error_reg=lambda n: n * 15)
+
+    async def handle_client(reader, writer):
+        while True:
+            g = GCOMM.parse(await reader.readexactly(GCOMM.size))
+            writer.write(GCOMM('ok').build())
+            if g.cmd == 'file_sd':
+                writer.write(GCOMM('file_sd', filename=g.filename, m=len(frames)).build())
+            elif g.cmd == 'down_file':
+                for f in frames:
+                    writer.write(f)
+                    await writer.drain()
+                    await asyncio.sleep(0.001)
+
+    async def main(r):
+        with pytest.raises(DownloadAborted):
+            await download(r, 'data.bin', str(tmpdir.join('data.frames')), monitor=monitor)
+
+    alerts = []
+    monitor = Monitor(on_alert=alerts.append)
+    run_against(handle_client, main)
+    assert [a.rule.severity for a in alerts] == ['warning', 'critical']
+    assert [a.value for a in alerts] == [210, 300]
+    assert monitor.maxima['error_reg'] < 500 * 15
+
+def test_download_stalled(tmpdir):
+    # the file exists but its records never arrive
+    async def handle_client(reader, writer):
+        while True:
+            g = GCOMM.parse(await reader.readexactly(GCOMM.size))
+            writer.write(GCOMM('ok').build())
+            if g.cmd == 'file_sd':
+                writer.write(GCOMM('file_sd', filename=g.filename, m=3).build())
+
+    async def main(r):
+        with pytest.raises(TimeoutError):
+            await download(r, 'data.bin', str(tmpdir.join('data.frames')),
+                           stall_timeout=0.05, max_rerequests=1)
+
+    run_against(handle_client, main)
+
+def test_monitor_rules():
+    alerts = []
+    monitor = Monitor([Rule('thermistor1', high=-20, device='dcm')], on_alert=alerts.append)
+    for device, value in [('dcm', 5), ('qcb', -30), ('dcm', -25), ('dcm', -40)]:
+        monitor.check(device, AXE('statement', {'thermistor1': value}))
+    assert len(alerts) == 1 and alerts[0].value == -25
+    assert monitor.counts[(0, 'dcm')] == 2
+    assert not monitor.aborted.is_set()
+
+def test_download_gaps(tmpdir):
+    d = Download('data.bin', str(tmpdir.join('data.frames')))
+    for n in (1, 2, 5, 9, 10, 11, 12, 13, 14, 15, 16, 2):
+        d(GCOMM.parse(GCOMM('app_file', n=n, m=20).build()), b'')
+    assert d.n == 11 and d.duplicates == 1
+    assert d.gaps() == [(3, 4), (6, 8), (17, 20)]
+    assert not d.done.is_set()
+
+def test_download_digest(tmpdir, monkeypatch):
+    # digest computed while receiving out of order should match the whole file,
+    # without reading records back
+    frames = sd_file_frames('data.bin', 20)
+    path = str(tmpdir.join('data.frames'))
+    monkeypatch.setattr(os, 'pread', None)
+    d = Download('data.bin', path)
+    for n in [3, 2, 1, 10, 4, 5, 6, 7, 8, 9] + list(range(20, 10, -1)):
+        d(GCOMM.parse(frames[n - 1]), frames[n - 1])
+    assert d.done.is_set()
+    leaves = b''.join(record_digest(n, 20, f) for n, f in enumerate(frames, 1))
+    assert d.digest == file_digest(leaves)
+    assert verify(path)
+    with open(path, 'r+b') as f:
+        f.write(b'corrupt')
+    assert not verify(path)
+
+    # no manifest for a file which doesn't match its expected digest
+    path = str(tmpdir.join('empty.frames'))
+    with pytest.raises(IntegrityError):
+        asyncio.run(fetch(None, FileInfo('empty.bin', 0), path, expected='0' * 64))
+    assert os.path.exists(path) and not os.path.exists(path + '.manifest')
+
+def test_download_rerequest(tmpdir):
+    # the emulated SD card drops every 7th record the first time it is sent
+    frames = sd_file_frames('data.bin', 40)
+    sd_dir = tmpdir.mkdir('sd')
+    sd_dir.join('data.bin').write_binary(b''.join(frames))
+    requests = []
+
+    async def handle_lossy(reader, writer):
+        class LossyWriter:
+            sent = set()
+            def write(self, frame):
+                g = GCOMM.parse(frame)
+                if g.cmd == 'app_file' and g.n % 7 == 0 and g.n not in self.sent:
+                    self.sent.add(g.n)
+                    return
+                writer.write(frame)
+            async def drain(self):
+                await writer.drain()
+            def get_extra_info(self, name):
+                return writer.get_extra_info(name)
+        class RecordingReader:
+            async def readexactly(self, size):
+                data = await reader.readexactly(size)
+                requests.append(GCOMM.parse(data))
+                return data
+        await server_handle_client(RecordingReader(), LossyWriter(), sd_dir=str(sd_dir))
+
+    path = str(tmpdir.join('data.frames'))
+    d = run_against(handle_lossy, lambda r: download(r, 'data.bin', path, stall_timeout=0.2))
+    assert d.n == 40 and d.gaps() == []
+    ranged = [(g.n, g.m) for g in requests if g.cmd == 'down_file' and g.n > 0]
+    assert ranged == [(7, 7), (14, 14), (21, 21), (28, 28), (35, 35)]
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(frames)
+
+def test_download_many(tmpdir):
+    sd_dir = tmpdir.mkdir('sd')
+    out_dir = tmpdir.mkdir('out')
+    files = {'a.bin': 5, 'b.bin': 0, 'c.bin': 30, 'notes.txt': 3}
+    for name, count in files.items():
+        sd_dir.join(name).write_binary(b''.join(sd_file_frames(name, count)))
+
+    async def main():
+        async with serving(partial(server_handle_client, sd_dir=str(sd_dir))) as port:
+            r = RADCOM('127.0.0.1', port)
+            return await down_client(r, ['*.bin', 'missing.txt'], output_dir=str(out_dir))
+
+    downloads = asyncio.run(main())
+    assert [d.filename for d in downloads] == ['a.bin', 'b.bin', 'c.bin']
+    for d in downloads:
+        assert d.n == files[d.filename]
+        with open(d.path, 'rb') as f:
+            assert f.read() == sd_dir.join(d.filename).read_binary()
+
+# ----- Packet Logs -----
+
+def test_packetlog(tmpdir):
+    path = str(tmpdir.join('session.log'))
+    frames = sd_file_frames('data.bin', 10)
+    with PacketLogWriter(path, sync_every=3) as w:
+        for n, f in enumerate(frames):
+            w.write(f, 'rx' if n % 2 else 'tx', t=1000 + n)
+    # appending to an existing log with a torn last record
+    with open(path, 'ab') as f:
+        f.write(b'partial')
+    with PacketLogWriter(path) as w:
+        w.write(GCOMM('ok').build(), t=2000)
+
+    records = list(read_log(path))
+    assert len(records) == 11
+    assert [t for t, _, _ in records] == [1000 + n for n in range(10)] + [2000]
+    assert records[0][1] == 'tx' and records[1][1] == 'rx'
+    assert records[3][2].n == 4 and records[3][2].packet.payload.data == {'error_reg': 4}
+    assert [f for _, _, f in read_log(path, parse=False)][:10] == frames
+
+    # the last packets are synced even if no more are written
+    w = PacketLogWriter(path, sync_interval=0.05)
+    w.write(GCOMM('ok').build(), t=3000)
+    time.sleep(0.3)
+    assert w.unsynced == 0 and len(list(read_log(path))) == 12
+    w.close()
+
+def test_packetlog_random_access(tmpdir):
+    path = str(tmpdir.join('session.log'))
+    frames = sd_file_frames('data.bin', 300)
+    with PacketLogWriter(path) as w:
+        for n, f in enumerate(frames):
+            w.write(f, t=1000 + n / 2)
+
+    with PacketLog(path, index_every=16) as log:
+        assert len(log) == 300
+        assert log[0].time == 1000 and log[-1].packet.n == 300
+        assert log[123].frame == frames[123]
+        assert [r.packet.n for r in log[10:13]] == [11, 12, 13]
+        assert log.bisect(1000.0) == 0 and log.bisect(1050.2) == 101
+        window = list(log.between(1010.0, 1020.0))
+        assert [r.time for r in window] == [1010 + n / 2 for n in range(20)]
+        assert len(list(log.between(end=1000.5))) == 1
+        with pytest.raises(IndexError):
+            log[300]
+
+    # raw frame files have no header or timestamps
+    raw = str(tmpdir.join('data.frames'))
+    with open(raw, 'wb') as f:
+        f.write(b''.join(frames))
+    with PacketLog(raw) as log:
+        assert len(log) == 300 and log[5].time is None and log[5].packet.n == 6
+
+def test_packetlog_decode_parallel(tmpdir):
+    path = str(tmpdir.join('session.log'))
+    frames = sd_file_frames('data.bin', 50)
+    with PacketLogWriter(path) as w:
+        for n, f in enumerate(frames):
+            w.write(f, t=1000 + n)
+        w.write(b'\x00' * GCOMM.size, t=2000)
+
+    serial = list(decode(path, workers=1))
+    assert [repr(r) for r in decode(path, workers=3, chunk=7)] == [repr(r) for r in serial]
+    assert [p.n for _, _, p in serial[:50]] == list(range(1, 51))
+    # undecodable frames come back raw
+    assert serial[-1] == (2000, 'rx', b'\x00' * GCOMM.size)
+    assert [len(c) for c in decode_chunks(path, workers=2, chunk=20)] == [20, 20, 11]
+    ns = [n for _, _, n in decode(path, workers=2, chunk=7, func=record_n)]
+    assert ns == list(range(1, 51)) + [None]
+
+def record_n(record):
+    return getattr(record.packet, 'n', None)
+
+def test_packetlog_convert(tmpdir):
+    import pickle
+    pkl_path = str(tmpdir.join('old.pkl'))
+    packets = [GCOMM.parse(f) for f in sd_file_frames('data.bin', 5)] + [GCOMM('ok')]
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(packets, f)
+    log_path = str(tmpdir.join('new.log'))
+    assert convert_pickle(pkl_path, log_path) == 6
+    assert [p.cmd for _, _, p in read_log(log_path)] == ['app_file'] * 5 + ['ok']
+
+def test_blocklog(tmpdir):
+    log_dir = str(tmpdir.join('logs'))
+    frames = sd_file_frames('data.bin', 100)
+    day = handle_time('2024-06-01 12:00')
+    with RotatingPacketLog(log_dir, block_size=16, max_bytes=1000) as log:
+        for n, f in enumerate(frames):
+            log.write(f, 'tx' if n == 0 else 'rx', t=float(day + n))
+        log.sync()
+        # rotates on a new day
+        log.write(GCOMM('ok').build(), t=float(day + 86400))
+    dates = [os.path.basename(p).split('_')[1] for p in log.paths]
+    assert len(log.paths) > 2 and dates[-1] != dates[-2]
+    # compressed much smaller than raw frames
+    assert sum(os.path.getsize(p) for p in log.paths) < len(b''.join(frames)) / 10
+
+    records = list(read_rotated(log_dir, 'log', day + 20.0, day + 30.0))
+    assert [p.n for _, _, p in records] == list(range(21, 31))
+    with BlockLog(log.paths[0]) as first:
+        assert first.kind == 'packets' and list(first)[0][:2] == (day, 'tx')
+    assert len(list(read_rotated(log_dir))) == 101
+
+def test_blocklog_text_unindexed(tmpdir):
+    log_dir = str(tmpdir.join('logs'))
+    text = RotatingTextLog(log_dir, codec='lzma', block_size=4)
+    for n in range(10):
+        text.write(f'line {n}\n')
+    text.sync()
+    # file not closed yet, so blocks are found by scanning
+    with BlockLog(text.paths[0]) as log:
+        assert len(log.blocks) == 3
+        assert [line for _, line in log] == [f'line {n}\n' for n in range(10)]
+    # written out after flush_interval even though no more lines arrive
+    timed = RotatingTextLog(str(tmpdir.join('timed')), block_size=100, flush_interval=0.05)
+    timed.write('quiet\n')
+    time.sleep(0.3)
+    with BlockLog(timed.paths[0]) as log:
+        assert [line for _, line in log] == ['quiet\n']
+    timed.close()
+
+    text.write('last\n')
+    text.close()
+    with BlockLog(text.paths[0]) as log:
+        assert len(log) == 11 and list(log)[-1][1] == 'last\n'
+
+def test_blocklog_errors(tmpdir, monkeypatch):
+    # files are named by UTC date, whatever the local timezone
+    monkeypatch.setenv('TZ', 'America/Chicago')
+    time.tzset()
+    try:
+        with RotatingPacketLog(str(tmpdir.join('utc')), block_size=1) as log:
+            log.write(GCOMM('ok').build(), t=float(handle_time('2024-06-01 23:30')))
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    assert os.path.basename(log.paths[0]) == 'log_2024-06-01_000.blk'
+
+    # a failed write is raised rather than hanging sync() or losing records
+    def fsync(fd):
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(os, 'fsync', fsync)
+    log = RotatingPacketLog(str(tmpdir.join('full')), block_size=1)
+    log.write(GCOMM('ok').build())
+    with pytest.raises(OSError):
+        log.sync()
+    with pytest.raises(OSError):
+        log.write(GCOMM('ok').build())
+    with pytest.raises(OSError):
+        log.close()
+
+# ----- Replay -----
+
+def test_replay_serve(tmpdir):
+    path = str(tmpdir.join('session.log'))
+    frames = sd_file_frames('data.bin', 20)
+    with PacketLogWriter(path) as w:
+        for n, f in enumerate(frames):
+            w.write(f, 'rx', t=1000 + n / 10)
+        w.write(GCOMM('ok').build(), 'tx', t=1003)
+    assert [f for _, f in read_frames(path, 'rx')] == frames
+
+    done = []
+    async def receive(r, repeat):
+        received = []
+        r.listeners.append(lambda packet, frame: received.append(frame))
+        start = time.monotonic()
+        while len(received) < 20 * repeat:
+            await asyncio.sleep(0.01)
+        return received, time.monotonic() - start
+
+    async def main(speed, repeat=1):
+        frames = await load_frames(path, 'rx')
+        handler = replay_handler(frames, speed=speed, repeat=repeat, on_done=done.append)
+        return await connected(handler, partial(receive, repeat=repeat))
+
+    # recorded over 1.9s, replayed 10 times faster
+    received, elapsed = asyncio.run(main(10))
+    assert received == frames and 0.18 < elapsed < 1.5
+    received, elapsed = asyncio.run(main(None, repeat=3))
+    assert received == frames * 3 and elapsed < 0.18
+    assert [s.frames for s in done] == [20, 60]
+
+def test_replay_client(tmpdir):
+    # replay recorded uplink to the simulator
+    frames = sd_file_frames('data.bin', 10)
+    with RotatingPacketLog(str(tmpdir), prefix='session') as log:
+        for n, f in enumerate(frames):
+            log.write(f, 'tx', t=1000.0 + n)
+            log.write(GCOMM('ok').build(), 'rx', t=1000.5 + n)
+    path = log.paths[0]
+    sim = Simulator()
+
+    async def main():
+        async with serving(sim.handle_client) as port:
+            r = RADCOM('127.0.0.1', port)
+            r.verbose = False
+            return r, await replay_client(r, path, speed=None)
+
+    r, stats = asyncio.run(main())
+    assert stats.frames == 10 and r.stats.sent == 10 and r.stats.oks == 10
+    assert sim.served == 10
+    assert sim.sd.frames('data.bin') == frames
+
+# ----- Benchmarks -----
+
+def test_bench(tmpdir):
+    current = run_benchmarks(min_time=0.01, repeat=1, script_size=20, frames=16)
+    results = current['results']
+    assert {'gcomm.parse', 'icomm.build', 'axe.parse', 'crc32', 'script.compile_20',
+            'uplink.goodput', 'downlink.frames'} <= set(results)
+    assert all(r['value'] > 0 for r in results.values())
+    assert results['crc32']['unit'] == 'MB/s' and results['script.compile_20']['unit'] == 's'
+    # unselected benchmarks don't run, so the endpoint isn't touched
+    only = run_benchmarks(min_time=0.01, repeat=1, script_size=20, endpoint='127.0.0.1:1', select='gcomm.*')
+    assert set(only['results']) == {'gcomm.build', 'gcomm.parse'}
+
+@pytest.fixture
+def benchmark_or_skip(request):
+    """pytest-benchmark's `benchmark` fixture, if it is installed"""
+    pytest.importorskip('pytest_benchmark')
+    return request.getfixturevalue('benchmark')
+
+@pytest.mark.parametrize('name', [
+    'axe.build', 'axe.parse', 'icomm.build', 'icomm.parse', 'gcomm.build',
+    'gcomm.parse', 'crc32', 'script.compile_100',
+])
+def test_codec_benchmark(name, tmpdir, benchmark_or_skip):
+    func = codec_functions(100, str(tmpdir.join('bench.frames')))[name]
+    benchmark_or_skip(func)
+
+def test_bench_compare():
+    baseline = {'results': {
+        'gcomm.parse': {'value': 1000, 'unit': 'frames/s'},
+        'crc32': {'value': 4, 'unit': 'MB/s'},
+        'script.compile_1000': {'value': 0.1, 'unit': 's'},
+        'removed': {'value': 1, 'unit': 's'},
+    }}
+    current = {'results': {
+        'gcomm.parse': {'value': 800, 'unit': 'frames/s'},
+        'crc32': {'value': 3.8, 'unit': 'MB/s'},
+        'script.compile_1000': {'value': 0.2, 'unit': 's'},
+        'added': {'value': 1, 'unit': 's'},
+    }}
+    changes = compare(baseline, current, threshold=0.1)
+    assert set(changes) == {'gcomm.parse', 'crc32', 'script.compile_1000'}
+    assert changes['gcomm.parse'] == pytest.approx((-0.2, True))
+    assert changes['crc32'] == pytest.approx((-0.05, False))
+    # slower compile is a regression
+    assert changes['script.compile_1000'] == pytest.approx((-0.5, True))
+
+# ----- Telemetry Store -----
+
+def test_flatten():
+    assert flatten({'a': 1, 'b': {'c': 2, 'd': [3, 4]}}) == [
+        ('a', 1), ('b.c', 2), ('b.d.0', 3), ('b.d.1', 4)
+    ]
+
+def test_store(tmpdir):
+    log_path = str(tmpdir.join('session.log'))
+    with PacketLogWriter(log_path) as w:
+        for n, f in enumerate(sd_file_frames('data.bin', 20)):
+            w.write(f, t=1000 + n)
+        w.write(GCOMM('ok').build(), 'tx', t=1100)
+
+    db = str(tmpdir.join('telemetry.db'))
+    with TelemetryStore(db) as store:
+        assert store.ingest(log_path) == 21
+        # already ingested records aren't indexed again
+        assert store.ingest(log_path) == 0
+        # listener path indexes received packets as they arrive
+        store(GCOMM.parse(sd_file_frames('data.bin', 1, lambda n: 500)[0]), None)
+
+    with TelemetryStore(db) as store:
+        rows = store.telemetry('error_reg', since=1005.0, until=1008.0)
+        assert rows == [(1005 + n, 'dcm', 'error_reg', 6 + n) for n in range(3)]
+        assert store.telemetry('error*', device='dcm', agg='max', pattern=True) == [('dcm', 'error_reg', 500)]
+        # exact names aren't patterns, and use the key index
+        assert store.telemetry('error?reg') == store.telemetry('ERROR_REG', pattern=True) == []
+        plan = store.db.execute("EXPLAIN QUERY PLAN SELECT * FROM telemetry WHERE key = 'error_reg'").fetchall()
+        assert 'SEARCH' in plan[0][-1]
+        assert store.telemetry('error_reg', until=2000.0, agg='avg') == [('dcm', 'error_reg', 10.5)]
+        assert store.telemetry(device='obc') == []
+        assert store.packets(cmd='ok')[0][:3] == (1100, 'tx', 'ok')
+        assert sorted(store.packets(agg='count')) == [('app_file', 'statement', 21), ('ok', None, 1)]
+        assert len(store.packets(frm='dcm', axe='statement', limit=5)) == 5
+
+    # only records appended since the last ingest are indexed
+    with PacketLogWriter(log_path) as w:
+        w.write(sd_file_frames('data.bin', 1, lambda n: 99)[0], t=1200)
+    with TelemetryStore(db) as store:
+        assert store.ingest(log_path) == 1
+        assert store.telemetry('error_reg', agg='count') == [('dcm', 'error_reg', 22)]
+
+    # worker processes send back rows, indexed the same as in-process
+    with TelemetryStore(db) as store, TelemetryStore(str(tmpdir.join('parallel.db'))) as parallel:
+        assert parallel.ingest(log_path, workers=2, chunk=7) == 22
+        # everything but the packet indexed by the listener
+        assert parallel.packets() == store.packets(until=2000.0)
+        assert parallel.telemetry('error_reg') == store.telemetry('error_reg', until=2000.0)
+
+# ----- Telemetry Stats -----
+
+def test_variable_stats():
+    s = VariableStats(window=10, halflife=5)
+    for t, v in enumerate([5, 1, 9, 3, 3, 7, 2, 8, 4, 6, 0, 10]):
+        s.update(v, 1000 + t)
+    assert (s.count, s.min, s.max, s.last) == (12, 0, 10, 10)
+    assert s.mean == pytest.approx(58 / 12)
+    # window covers t=1002..1011
+    assert (s.window_count, s.window_min, s.window_max) == (10, 0, 10)
+    assert s.window_mean == pytest.approx(52 / 10)
+    # a sample one half life later moves the EWMA half way
+    ewma = s.ewma
+    s.update(ewma + 2, 1016)
+    assert s.ewma == pytest.approx(ewma + 1)
+    assert (s.window_count, s.window_min) == (6, 0)
+
+def test_telemetry():
+    # RADCOM keeps stats of everything it receives
+    telemetry = RADCOM('127.0.0.1', 0).telemetry
+    for packet in sd_file_frames('data.bin', 5):
+        telemetry(GCOMM.parse(packet))
+    telemetry.update('qcb', AXE('statement', {'temp': {'a': 1.5}, 'ok': True}))
+    assert list(telemetry.select()) == ['dcm.error_reg', 'qcb.temp.a']
+    assert telemetry['dcm.error_reg'].max == 5 and telemetry['dcm.error_reg'].mean == 3
+    assert telemetry.lines('qcb.*') == [
+        'qcb.temp.a: last=1.5 min=1.5 max=1.5 mean=1.5 mean60s=1.5 ewma=1.5 n=1'
+    ]
+
+# ----- Export -----
+
+def test_export(tmpdir):
+    np = pytest.importorskip('numpy')
+    log_path = str(tmpdir.join('session.log'))
+    # error_reg switches from int to float part way through
+    frames = sd_file_frames('data.bin', 10, lambda n: n if n < 8 else n + 0.5)
+    frames.append(GCOMM(
+        'app_file', filename='x', packet=ICOMM('cmd', 'ground', frm='qcb', payload=AXE(
+            'statement', {'temp': {'a': True}, 'name': 'qcb'}
+        ))
+    ).build())
+    with PacketLogWriter(log_path) as w:
+        for n, f in enumerate(frames):
+            w.write(f, t=1000 + n)
+
+    out = str(tmpdir.join('out'))
+    assert export([log_path], out, chunk=4) == {'dcm.error_reg': 10, 'qcb.temp.a': 1}
+    a = np.load(os.path.join(out, 'dcm.error_reg.npy'), mmap_mode='r')
+    assert a.dtype['value'] == np.float64
+    assert list(a['time']) == [1000 + n for n in range(10)]
+    assert list(a['value']) == list(range(1, 8)) + [8.5, 9.5, 10.5]
+
+    npz = str(tmpdir.join('out.npz'))
+    export([log_path], npz, keys=['temp.a'])
+    with np.load(npz) as z:
+        assert list(z) == ['qcb.temp.a'] and z['qcb.temp.a']['value'].dtype == bool
+
 # ----- Common functions -----
 
 def test_handle_time():
@@ -1,19 +1,19 @@
 import threading
 import socket
 import sys
-import pickle as pkl
 import time
 
 from rosen.gcomm import GCOMM
 
 from rosen.term import Console
+from rosen.monitor import Monitor
+from rosen.packetlog import PacketLogWriter
+from rosen.blocklog import RotatingPacketLog
+from rosen.store import TelemetryStore
+from rosen.telemetry import Telemetry
+from rosen.dedup import DuplicateFilter
 import rosen.shell_parse
 
-if len(sys.argv) > 1:
-    pkl_fname = sys.argv[1]
-else:
-    pkl_fname = 'NA'
-
 asciiart = '''                                                        KN                                          
                                                         NM                                          
                                                     ,okKMMKOd;                                      
@@ -33,6 +33,8 @@ oM0l'.  .:KWc    NM..........   .WX.        xMo   lNXo,....,oXNo     .KWo'   .;O
 
 connection_started = False
 sock = None
+packet_log = None
+store = None
 
 def parse(string):
     'Parses Commands'
@@ -40,15 +42,28 @@ def parse(string):
     while not connection_started:
         time.sleep(1)
 
+    # stats [PATTERN] shows running stats of received AXE variables
+    args = string.split()
+    if args and args[0] == 'stats':
+        lines = telemetry.lines(args[1] if len(args) > 1 else '*')
+        for line in lines or ['No telemetry received']:
+            c.add_line("= " + line)
+        if dedup is not None:
+            c.add_line(f"= {dedup.suppressed} duplicate frames dropped")
+        return
+
     parsed = rosen.shell_parse.cmd_parse(string)
     if type(parsed) == GCOMM:
         dp = parsed.build()
-        d = b''.join([b'\0\0', dp])
         sock.send(dp)
+        if packet_log is not None:
+            packet_log.write(dp, 'tx')
+        if store is not None:
+            store.add(parsed, direction='tx')
 
 
 
-def get_packets(packets):
+def get_packets():
 
     'Continuous packet reception thread'
 
@@ -61,42 +76,42 @@ def get_packets(packets):
         data = b''
 
         while length < 4162:
-            d = sock.recv(4162)
+            d = sock.recv(4162 - length)
             data = b''.join([data, d])
             length = len(data)
 
+        if dedup is not None and dedup(data):
+            continue
+
+        if packet_log is not None:
+            packet_log.write(data, 'rx')
+
         try:
             packet = GCOMM.parse(data)
             c.add_line("< " + str(packet))
-            packets.append(packet)
+            monitor(packet)
+            telemetry(packet)
+            if store is not None:
+                store.add(packet)
 
         except:
             c.add_line("< Bad packet recieved." + str(d[:20]))
 
-def run_log(packets, pkl_fname):
-    'Continuous logging thread'
-    last_len = 0
-    while True:
-        if len(packets) != last_len:
-            if pkl_fname != 'NA':
-                last_len = len(packets)
-                with open(pkl_fname, 'wb') as pkl_file:
-                    pkl.dump(packets, pkl_file)
-            else:
-                time.sleep(0.1)
-        else:
-            time.sleep(0.1)
-
 def tui(args):
 
-    packets_arr = []
-
-
     global sock
+    global packet_log
+    global store
     global connection_started
     global c
+    global monitor
+    global telemetry
+    global dedup
 
     c = Console(splash_art=asciiart)
+    telemetry = Telemetry()
+    dedup = DuplicateFilter() if args.dedup else None
+    monitor = Monitor(on_alert=lambda alert: c.add_line("! " + str(alert)))
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
     sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
@@ -111,12 +126,15 @@ def tui(args):
 
     connection_started = True
 
-    recv_thread = threading.Thread(target=get_packets, kwargs={"packets":packets_arr}, daemon=True)
-    recv_thread.start()
-
     if (args.logfile != None):
-        logging_thread = threading.Thread(target=run_log, kwargs={"packets":packets_arr,"pkl_fname":args.logfile}, daemon=True)
-        logging_thread.start()
+        packet_log = PacketLogWriter(args.logfile)
+    elif args.log_dir is not None:
+        packet_log = RotatingPacketLog(args.log_dir, prefix='packets', codec=args.codec)
+    if args.db is not None:
+        store = TelemetryStore(args.db)
+
+    recv_thread = threading.Thread(target=get_packets, daemon=True)
+    recv_thread.start()
 
 
     try:
@@ -127,4 +145,8 @@ def tui(args):
     finally:
         c.cleanup()
         sock.close()
+        if packet_log is not None:
+            packet_log.close()
+        if store is not None:
+            store.close()
         sys.exit()
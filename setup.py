@@ -21,6 +21,8 @@ setup(
     author="Evan Widloski",
     author_email="evan_github@widloski.com",
     url="https://github.com/evidlo/rosen",
+    # asyncio.TaskGroup
+    python_requires=">=3.11",
     # your project's pip dependencies
     install_requires=[
         "asyncio-dgram",
@@ -31,6 +33,12 @@ setup(
         "msgpack",
         "ptpython"
     ],
+    extras_require={
+        # `rosen export`
+        "export": ["numpy"],
+        # benchmark tests in rosen/test_all.py
+        "bench": ["pytest-benchmark"],
+    },
     include_package_data=True,
     # automatically look for subfolders with __init__.py
     packages=find_packages(),